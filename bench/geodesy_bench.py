@@ -0,0 +1,136 @@
+"""Micro-benchmarks for locator/geodesy.py.
+
+    python bench/geodesy_bench.py [--points 100000] [--repeat 5]
+
+Times each array function against the same work done point by point with
+the scalar functions, and prints the best of ``--repeat`` runs as points
+per second. Before timing, it checks that both ways give the same answers.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np  # noqa: E402
+
+from locator import geodesy  # noqa: E402
+
+
+def best_time(function, repeat):
+    best = math.inf
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def make_points(count, seed=1):
+    """A random walk of ``count`` fixes a few meters apart, like a track"""
+    rng = random.Random(seed)
+    lat, lng = 59.91, 10.75
+    lats, lngs = [], []
+    for _ in range(count):
+        lat += rng.uniform(-3e-5, 3e-5)
+        lng += rng.uniform(-6e-5, 6e-5)
+        lats.append(lat)
+        lngs.append(lng)
+    return lats, lngs
+
+
+def cases(lats, lngs):
+    """(name, scalar version, array version) for each benchmark"""
+    a_lats, a_lngs = np.array(lats), np.array(lngs)
+    headings = [i * 7.0 % 360 for i in range(len(lats))]
+    a_headings = np.array(headings)
+    lat0, lng0 = lats[0], lngs[0]
+    queries = len(lats) // 100 or 1
+
+    def scalar_nearest_each():
+        found = []
+        for q in range(queries):
+            found.append(min(range(len(lats)), key=lambda i: geodesy.distance(lats[q], lngs[q], lats[i], lngs[i])))
+        return found
+
+    return [
+        (
+            "distance to one point",
+            lambda: [geodesy.distance(lat0, lng0, lat, lng) for lat, lng in zip(lats, lngs)],
+            lambda: geodesy.distances(lat0, lng0, a_lats, a_lngs),
+        ),
+        (
+            "bearing to one point",
+            lambda: [geodesy.bearing(lat0, lng0, lat, lng) for lat, lng in zip(lats, lngs)],
+            lambda: geodesy.bearings(lat0, lng0, a_lats, a_lngs),
+        ),
+        (
+            "destination",
+            lambda: [geodesy.destination(lat, lng, h, 100.0) for lat, lng, h in zip(lats, lngs, headings)],
+            lambda: geodesy.destinations(a_lats, a_lngs, a_headings, 100.0),
+        ),
+        (
+            "path length",
+            lambda: sum(geodesy.distance(lats[i], lngs[i], lats[i + 1], lngs[i + 1]) for i in range(len(lats) - 1)),
+            lambda: geodesy.path_length(a_lats, a_lngs),
+        ),
+        (
+            "bounds",
+            lambda: (min(lats), min(lngs), max(lats), max(lngs)),
+            lambda: geodesy.bounds(a_lats, a_lngs),
+        ),
+        (
+            "nearest to one point",
+            lambda: min(range(len(lats)), key=lambda i: geodesy.distance(lat0, lng0 + 1e-3, lats[i], lngs[i])),
+            lambda: geodesy.nearest(lat0, lng0 + 1e-3, a_lats, a_lngs),
+        ),
+        (
+            f"nearest for {queries} points",
+            scalar_nearest_each,
+            lambda: geodesy.nearest_each(a_lats[:queries], a_lngs[:queries], a_lats, a_lngs),
+        ),
+    ]
+
+
+def check(lats, lngs):
+    """The array functions agree with the scalar ones"""
+    sample = slice(0, 1000)
+    lats, lngs = lats[sample], lngs[sample]
+    vector = geodesy.distances(lats[0], lngs[0], lats, lngs)
+    scalar = [geodesy.distance(lats[0], lngs[0], lat, lng) for lat, lng in zip(lats, lngs)]
+    assert np.allclose(vector, scalar, rtol=1e-9, atol=1e-6), "distances"
+    vector = geodesy.bearings(lats[0], lngs[0], lats[1:], lngs[1:])
+    scalar = [geodesy.bearing(lats[0], lngs[0], lat, lng) for lat, lng in zip(lats[1:], lngs[1:])]
+    assert np.allclose(vector, scalar, atol=1e-9), "bearings"
+    for lat, lng in zip(lats[:50], lngs[:50]):
+        there = geodesy.destination(lat, lng, 123.0, 5000.0)
+        assert abs(geodesy.distance(lat, lng, *there) - 5000.0) < 1e-3, "destination distance"
+        assert geodesy.heading_change(geodesy.bearing(lat, lng, *there), 123.0) < 1e-6, "destination bearing"
+    south, west, north, east = geodesy.bbox_around(lats[0], lngs[0], 1000.0)
+    assert geodesy.distance(lats[0], lngs[0], north, lngs[0]) - 1000.0 < 1e-6, "bbox_around"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    lats, lngs = make_points(args.points)
+    check(lats, lngs)
+    print(f"{args.points} points, best of {args.repeat}")
+    print(f"{'benchmark':<26}{'scalar pts/s':>16}{'array pts/s':>16}{'speedup':>10}")
+    for name, scalar, vector in cases(lats, lngs):
+        scalar_time = best_time(scalar, args.repeat)
+        vector_time = best_time(vector, args.repeat)
+        print(
+            f"{name:<26}{args.points / scalar_time:>16,.0f}{args.points / vector_time:>16,.0f}"
+            f"{scalar_time / vector_time:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
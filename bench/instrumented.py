@@ -0,0 +1,103 @@
+"""The server with per-endpoint CPU accounting, as started by bench/loadtest.py.
+
+    python bench/instrumented.py --port 5051
+    gunicorn -c gunicorn.conf.py --pythonpath .,bench instrumented:application
+
+Run it from a directory holding config.json, like server.py. Every request
+is charged the CPU time of the thread that served it, including the time
+spent producing a streamed body. ``GET /__bench__/stats`` returns the totals
+per path and ``POST /__bench__/reset`` clears them. With several gunicorn
+workers each keeps its own totals, so benchmark with one.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from server import app  # noqa: E402
+
+CONTROL_PREFIX = "/__bench__/"
+
+
+class EndpointProfiler:
+    """WSGI middleware adding up requests, thread CPU time and wall time per path"""
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path.startswith(CONTROL_PREFIX):
+            return self._control(path, environ, start_response)
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        body = self.app(environ, start_response)
+        return _MeasuredBody(self, path, body, time.thread_time() - cpu_started, started)
+
+    def record(self, path, cpu, wall):
+        with self._lock:
+            stats = self._stats.setdefault(path, {"requests": 0, "cpu": 0.0, "wall": 0.0})
+            stats["requests"] += 1
+            stats["cpu"] += cpu
+            stats["wall"] += wall
+
+    def _control(self, path, environ, start_response):
+        if path == CONTROL_PREFIX + "reset" and environ["REQUEST_METHOD"] == "POST":
+            with self._lock:
+                self._stats.clear()
+            body = {"status": "reset"}
+        elif path == CONTROL_PREFIX + "stats":
+            with self._lock:
+                body = {"pid": os.getpid(), "endpoints": {p: dict(s) for p, s in self._stats.items()}}
+        else:
+            start_response("404 Not Found", [("Content-Type", "application/json")])
+            return [b'{"error": "Not found"}']
+        start_response("200 OK", [("Content-Type", "application/json")])
+        return [json.dumps(body).encode()]
+
+
+class _MeasuredBody:
+    """A response body that charges the CPU spent iterating it to its request"""
+
+    def __init__(self, profiler, path, body, cpu, started):
+        self._profiler = profiler
+        self._path = path
+        self._body = body
+        self._cpu = cpu
+        self._started = started
+
+    def __iter__(self):
+        chunks = iter(self._body)
+        while True:
+            cpu_started = time.thread_time()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                self._cpu += time.thread_time() - cpu_started
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self._body, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._profiler.record(self._path, self._cpu, time.perf_counter() - self._started)
+
+
+app.wsgi_app = EndpointProfiler(app.wsgi_app)
+application = app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the server with per-endpoint CPU accounting")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5051)
+    args = parser.parse_args()
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,754 @@
+"""Load test: simulated phones and map tabs against a local server.
+
+    python bench/loadtest.py run --phones 50 --tabs 20 --duration 30
+    python bench/loadtest.py compare bench/results/<old>.json bench/results/<new>.json
+
+``run`` starts this checkout's server (bench/instrumented.py) in a scratch
+directory, with every routing service pointed at a stub in this process.
+It then runs these phases, each lasting --duration seconds:
+
+    phones  phones posting fixes to /update_locations on the sender's cadence
+    tabs    map tabs doing the initial load, then polling like index.html
+            without EventSource (or, with --tab-mode sse, following /events)
+    routes  tabs asking /get_route for new routes, --route-rate per second in all
+    mixed   all of the above at once
+
+For each phase it reports requests per second and p50/p90/p99 latency per
+endpoint. It also reports the CPU time per request, measured inside the
+server, and the server's CPU use and resident memory. In SSE mode it adds
+the lag from a phone's fix to its event reaching a tab. Results are saved
+as JSON in --output. ``compare`` prints the change per endpoint between two
+result files and exits with status 1 when something got worse by more than
+--threshold.
+
+The simulated clients are threads in this process. Past a few hundred of
+them the load generator itself becomes the bottleneck; watch the reported
+client CPU.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from locator.fixcodec import CONTENT_TYPE, encode_fixes  # noqa: E402
+from locator.geodesy import destination, distance  # noqa: E402
+
+PHASES = ("phones", "tabs", "routes", "mixed")
+# Where the simulated phones walk and the tabs look
+CENTER = (59.9139, 10.7522)
+SPREAD = 0.02  # degrees
+# The sender's sampling, as in locator/py.py
+MIN_SAMPLE_INTERVAL = 2
+MAX_SAMPLE_INTERVAL = 30
+TARGET_FIX_SPACING = 10
+# index.html's polling fallback: (path, revision key or None, seconds between loads)
+POLL_SCHEDULE = (
+    ("/load", "drawings", 10),
+    ("/load_phones", None, 5),
+    ("/load_pois", "pois", 5),
+    ("/load_measurements", "measurements", 5),
+    ("/load_notes", "notes", 5),
+    ("/load_current_route", None, 3),
+)
+# /events names that make a tab reload, and what it reloads
+EVENT_LOADS = {
+    "drawings": "/load",
+    "phones": "/load_phones",
+    "pois": "/load_pois",
+    "measurements": "/load_measurements",
+    "notes": "/load_notes",
+    "current_route": "/load_current_route",
+}
+# Loads limited to the area around the map view
+AREA_LOADS = ("/load_pois", "/load_measurements")
+ROUTE_MODES = ("walking", "cycling", "driving")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+# ---------------------------------------------------------------- recording
+
+class Recorder:
+    """Latency and status of every request in one phase, by endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._errors = {}
+        self._lags = []
+
+    def record(self, endpoint, latency, ok):
+        with self._lock:
+            self._latencies.setdefault(endpoint, []).append(latency)
+            if not ok:
+                self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+
+    def record_lag(self, lag):
+        with self._lock:
+            self._lags.append(lag)
+
+    def summary(self, elapsed, server_cpu=None):
+        """Per-endpoint statistics; ``server_cpu`` is the instrumented server's /__bench__/stats"""
+        server_cpu = server_cpu or {}
+        endpoints = {}
+        with self._lock:
+            for endpoint, latencies in sorted(self._latencies.items()):
+                latencies = sorted(latencies)
+                cpu = server_cpu.get(endpoint)
+                endpoints[endpoint] = {
+                    "requests": len(latencies),
+                    "rps": len(latencies) / elapsed,
+                    "p50_ms": 1000 * percentile(latencies, 0.50),
+                    "p90_ms": 1000 * percentile(latencies, 0.90),
+                    "p99_ms": 1000 * percentile(latencies, 0.99),
+                    "max_ms": 1000 * latencies[-1],
+                    "errors": self._errors.get(endpoint, 0),
+                    "cpu_ms": 1000 * cpu["cpu"] / cpu["requests"] if cpu and cpu["requests"] else None,
+                }
+            lags = sorted(self._lags)
+        event_lag = None
+        if lags:
+            event_lag = {
+                "events": len(lags),
+                "p50_ms": 1000 * percentile(lags, 0.50),
+                "p99_ms": 1000 * percentile(lags, 0.99),
+            }
+        return endpoints, event_lag
+
+
+def new_session(pool_size=4):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    return session
+
+
+def timed(session, recorder, method, url, endpoint, **kwargs):
+    """Make a request and record it; returns the response, or None if it failed outright"""
+    started = time.perf_counter()
+    try:
+        response = session.request(method, url, timeout=30, **kwargs)
+    except requests.RequestException:
+        recorder.record(endpoint, time.perf_counter() - started, False)
+        return None
+    recorder.record(endpoint, time.perf_counter() - started, response.status_code < 500)
+    return response
+
+
+# ------------------------------------------------------------------- actors
+
+class Actor(threading.Thread):
+    def __init__(self, base_url, recorder, stop, seed):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.recorder = recorder
+        self.stop = stop
+        self.rng = random.Random(seed)
+        self.session = new_session()
+
+    def request(self, method, path, endpoint=None, **kwargs):
+        return timed(self.session, self.recorder, method, self.base_url + path, endpoint or path.split("?")[0], **kwargs)
+
+    def random_point(self):
+        return (
+            CENTER[0] + self.rng.uniform(-SPREAD, SPREAD),
+            CENTER[1] + self.rng.uniform(-SPREAD, SPREAD),
+        )
+
+
+class Phone(Actor):
+    """Walks around and uploads each sampled fix the way locator/py.py does"""
+
+    def __init__(self, index, base_url, recorder, stop, seed, speed, batch=True):
+        super().__init__(base_url, recorder, stop, seed)
+        self.phone_id = f"ph{index:04d}"
+        self.speed = speed
+        self.batch = batch
+        self.lat, self.lng = self.random_point()
+        self.heading = self.rng.uniform(0, 360)
+
+    def run(self):
+        interval = max(MIN_SAMPLE_INTERVAL, min(MAX_SAMPLE_INTERVAL, TARGET_FIX_SPACING / self.speed))
+        # Phones don't all start on the same second
+        if self.stop.wait(self.rng.uniform(0, interval)):
+            return
+        while True:
+            self.heading = (self.heading + self.rng.gauss(0, 15)) % 360
+            self.lat, self.lng = destination(self.lat, self.lng, self.heading, self.speed * interval)
+            fix = {
+                "id": self.phone_id, "lat": self.lat, "lng": self.lng,
+                "alt": 10.0, "heading": self.heading, "timestamp": time.time(),
+            }
+            if self.batch:
+                self.request("POST", "/update_locations", data=encode_fixes([fix]),
+                             headers={"Content-Type": CONTENT_TYPE})
+            else:
+                self.request("POST", "/update_location", json=fix)
+            if self.stop.wait(interval):
+                return
+
+
+class Tab(Actor):
+    """One open map: loads everything, then polls or follows /events"""
+
+    def __init__(self, base_url, recorder, stop, seed, mode="poll"):
+        super().__init__(base_url, recorder, stop, seed)
+        self.mode = mode
+        self.revisions = {}
+        self.etags = {}
+        lat, lng = self.random_point()
+        self.bbox = f"{lat - 0.01},{lng - 0.02},{lat + 0.01},{lng + 0.02}"
+        self._events = None
+
+    def load(self, path, revision_key=None):
+        query = []
+        if revision_key is not None:
+            query.append(f"since={self.revisions.get(revision_key, 0)}")
+        if path in AREA_LOADS:
+            query.append(f"bbox={self.bbox}")
+        url = path + ("?" + "&".join(query) if query else "")
+        # Browsers revalidate with the ETag they were given
+        headers = {"If-None-Match": self.etags[path]} if path in self.etags else {}
+        response = self.request("GET", url, endpoint=path, headers=headers)
+        if response is None or response.status_code != 200:
+            return
+        if "ETag" in response.headers:
+            self.etags[path] = response.headers["ETag"]
+        if revision_key is not None:
+            try:
+                body = response.json()
+            except ValueError:
+                return
+            if isinstance(body, dict) and "rev" in body:
+                self.revisions[revision_key] = body["rev"]
+
+    def load_all(self):
+        for path, revision_key, _ in POLL_SCHEDULE:
+            self.load(path, revision_key)
+
+    def run(self):
+        if self.stop.wait(self.rng.uniform(0, 3)):
+            return
+        if self.mode == "sse":
+            self.follow_events()
+        else:
+            self.poll()
+
+    def poll(self):
+        self.load_all()
+        now = time.monotonic()
+        due = {path: now + period for path, _, period in POLL_SCHEDULE}
+        while True:
+            path = min(due, key=due.get)
+            if self.stop.wait(max(0.0, due[path] - time.monotonic())):
+                return
+            _, revision_key, period = next(entry for entry in POLL_SCHEDULE if entry[0] == path)
+            self.load(path, revision_key)
+            due[path] += period
+
+    def follow_events(self):
+        revision_keys = {path: key for path, key, _ in POLL_SCHEDULE}
+        while not self.stop.is_set():
+            try:
+                self._events = self.session.get(self.base_url + "/events", stream=True, timeout=(5, None))
+            except requests.RequestException:
+                self.recorder.record("/events", 0.0, False)
+                self.stop.wait(1)
+                continue
+            self.recorder.record("/events", self._events.elapsed.total_seconds(), self._events.status_code < 500)
+            # Like EventSource's onopen: everything is reloaded on (re)connect
+            self.load_all()
+            event = None
+            try:
+                for line in self._events.iter_lines(decode_unicode=True):
+                    if self.stop.is_set():
+                        return
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:") and event == "phone":
+                        timestamp = json.loads(line[5:]).get("timestamp")
+                        if timestamp:
+                            self.recorder.record_lag(time.time() - timestamp)
+                    elif line.startswith("data:") and event in EVENT_LOADS:
+                        path = EVENT_LOADS[event]
+                        self.load(path, revision_keys[path])
+                    elif not line:
+                        event = None
+            except Exception:
+                # Closing the stream from close() lands here too
+                pass
+            finally:
+                self._events.close()
+
+    def close(self):
+        """Unblock a tab waiting on its event stream"""
+        if self._events is not None:
+            try:
+                self._events.close()
+            except Exception:
+                pass
+
+
+class RouteAsker(Actor):
+    """New route requests at random times, ``rate`` per second on average"""
+
+    def __init__(self, base_url, recorder, stop, seed, rate):
+        super().__init__(base_url, recorder, stop, seed)
+        self.rate = rate
+
+    def run(self):
+        while not self.stop.wait(self.rng.expovariate(self.rate)):
+            (start_lat, start_lng), (end_lat, end_lng) = self.random_point(), self.random_point()
+            self.request("POST", "/get_route", json={
+                "start_lat": start_lat, "start_lng": start_lng, "end_lat": end_lat, "end_lng": end_lng,
+                "mode": self.rng.choice(ROUTE_MODES),
+            })
+
+
+# -------------------------------------------------------------- route stub
+
+class StubRouter:
+    """Answers OSRM and MapBox route requests with a straight line after ``delay`` seconds"""
+
+    def __init__(self, delay=0.2, points=50):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                body = stub.answer(self.path.split("?")[0])
+                self.send_response(200 if body is not None else 404)
+                data = json.dumps(body if body is not None else {"message": "Not found"}).encode()
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.delay = delay
+        self.points = points
+        self.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, name="stub-router", daemon=True).start()
+
+    def answer(self, path):
+        if not (path.startswith("/route/v1/") or path.startswith("/directions/v5/")):
+            return None
+        try:
+            start, end = path.rsplit("/", 1)[1].split(";")
+            start_lng, start_lat = (float(v) for v in start.split(","))
+            end_lng, end_lat = (float(v) for v in end.split(","))
+        except ValueError:
+            return None
+        self.requests += 1
+        time.sleep(self.delay)
+        line = [
+            [start_lng + (end_lng - start_lng) * i / (self.points - 1), start_lat + (end_lat - start_lat) * i / (self.points - 1)]
+            for i in range(self.points)
+        ]
+        meters = distance(start_lat, start_lng, end_lat, end_lng)
+        return {"code": "Ok", "routes": [{
+            "geometry": {"type": "LineString", "coordinates": line},
+            "distance": meters,
+            "duration": meters / 1.4,
+            "legs": [{"steps": []}],
+        }]}
+
+    def close(self):
+        self.server.shutdown()
+
+
+# ------------------------------------------------------------------ server
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LocalServer:
+    """bench/instrumented.py in a scratch directory, under Flask's server or gunicorn"""
+
+    def __init__(self, kind, stub_url, overrides):
+        self.workdir = tempfile.mkdtemp(prefix="locator-bench-")
+        with open(os.path.join(REPO_DIR, "config.json.example")) as f:
+            config = json.load(f)
+        config.update({
+            "debug": False,
+            "mapbox_url": stub_url,
+            "osrm_url": stub_url,
+            "ors_url": stub_url,
+            "graphhopper_url": stub_url,
+        })
+        config.update(overrides)
+        with open(os.path.join(self.workdir, "config.json"), "w") as f:
+            json.dump(config, f, indent=2)
+
+        port = free_port()
+        self.url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ, PYTHONUNBUFFERED="1")
+        if kind == "gunicorn":
+            env.update(LOCATOR_BIND=f"127.0.0.1:{port}", LOCATOR_ACCESS_LOG="/dev/null")
+            command = [sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+                       "--pythonpath", f"{REPO_DIR},{BENCH_DIR}", "instrumented:application"]
+        else:
+            command = [sys.executable, os.path.join(BENCH_DIR, "instrumented.py"), "--port", str(port)]
+        self.log_path = os.path.join(self.workdir, "server.log")
+        self._log = open(self.log_path, "w")
+        self.process = subprocess.Popen(command, cwd=self.workdir, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+        self._wait_ready()
+
+    def _wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if requests.get(self.url + "/__bench__/stats", timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.close()
+        with open(self.log_path) as f:
+            log = f.read()[-2000:]
+        raise RuntimeError(f"Server did not start; last output:\n{log}")
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self._log.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class ProcessMonitor:
+    """CPU seconds and resident memory of a process and its children, from /proc (Linux only)"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.available = pid is not None and os.path.exists(f"/proc/{pid}/stat")
+        self._ticks = os.sysconf("SC_CLK_TCK") if self.available else 100
+        self._page = os.sysconf("SC_PAGE_SIZE") if self.available else 4096
+        self._rss_peak = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if self.available:
+            threading.Thread(target=self._run, name="process-monitor", daemon=True).start()
+
+    def _pids(self):
+        pids = [self.pid]
+        try:
+            for entry in os.listdir("/proc"):
+                if entry.isdigit() and self._parent(entry) == self.pid:
+                    pids.append(int(entry))
+        except OSError:
+            pass
+        return pids
+
+    @staticmethod
+    def _stat_fields(pid):
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces; fields after it are fixed
+            return f.read().rsplit(")", 1)[1].split()
+
+    def _parent(self, pid):
+        try:
+            return int(self._stat_fields(pid)[1])
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def sample(self):
+        """(cpu seconds, rss bytes) now, summed over the process tree"""
+        cpu = rss = 0
+        for pid in self._pids():
+            try:
+                fields = self._stat_fields(pid)
+                cpu += (int(fields[11]) + int(fields[12])) / self._ticks
+                with open(f"/proc/{pid}/statm") as f:
+                    rss += int(f.read().split()[1]) * self._page
+            except (OSError, IndexError, ValueError):
+                continue
+        return cpu, rss
+
+    def reset_peak(self):
+        with self._lock:
+            self._rss_peak = 0
+
+    @property
+    def rss_peak(self):
+        with self._lock:
+            return self._rss_peak
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            _, rss = self.sample()
+            with self._lock:
+                self._rss_peak = max(self._rss_peak, rss)
+
+    def close(self):
+        self._stop.set()
+
+
+def server_cpu_stats(base_url, reset=False):
+    """The instrumented server's per-path CPU totals, or None if it isn't instrumented"""
+    try:
+        if reset:
+            requests.post(base_url + "/__bench__/reset", timeout=5)
+            return None
+        response = requests.get(base_url + "/__bench__/stats", timeout=5)
+        return response.json()["endpoints"] if response.status_code == 200 else None
+    except (requests.RequestException, ValueError, KeyError):
+        return None
+
+
+# --------------------------------------------------------------------- run
+
+def run_phase(name, args, base_url, monitor):
+    recorder = Recorder()
+    stop = threading.Event()
+    actors = []
+    # Every phase walks and routes somewhere new, so the route cache doesn't answer for the stub
+    seeds = iter(range(PHASES.index(name) * 100000, (PHASES.index(name) + 1) * 100000))
+    if name in ("phones", "mixed"):
+        actors += [Phone(i, base_url, recorder, stop, next(seeds), args.speed, batch=args.phone_endpoint == "batch")
+                   for i in range(args.phones)]
+    if name in ("tabs", "mixed"):
+        actors += [Tab(base_url, recorder, stop, next(seeds), args.tab_mode) for _ in range(args.tabs)]
+    if name in ("routes", "mixed") and args.route_rate > 0:
+        askers = max(1, min(args.tabs, 8))
+        actors += [RouteAsker(base_url, recorder, stop, next(seeds), args.route_rate / askers) for _ in range(askers)]
+
+    server_cpu_stats(base_url, reset=True)
+    monitor.reset_peak()
+    cpu_before, _ = monitor.sample()
+    client_before = time.process_time()
+    started = time.monotonic()
+    for actor in actors:
+        actor.start()
+    time.sleep(args.duration)
+    stop.set()
+    elapsed = time.monotonic() - started
+    cpu_after, rss = monitor.sample()
+    client_cpu = time.process_time() - client_before
+    for actor in actors:
+        if isinstance(actor, Tab):
+            actor.close()
+    for actor in actors:
+        actor.join(timeout=30)
+
+    endpoints, event_lag = recorder.summary(elapsed, server_cpu_stats(base_url))
+    result = {
+        "duration": elapsed,
+        "actors": len(actors),
+        "endpoints": endpoints,
+        "client_cpu_percent": 100 * client_cpu / elapsed,
+    }
+    if monitor.available:
+        result["server"] = {
+            "cpu_percent": 100 * (cpu_after - cpu_before) / elapsed,
+            "rss_mib": rss / 2 ** 20,
+            "rss_peak_mib": max(monitor.rss_peak, rss) / 2 ** 20,
+        }
+    if event_lag:
+        result["event_lag"] = event_lag
+    return result
+
+
+def print_phase(name, result):
+    print(f"\n== {name}: {result['actors']} clients for {result['duration']:.0f} s")
+    print(f"{'endpoint':<24}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+          f"{'max ms':>9}{'errors':>8}{'cpu ms':>8}")
+    for endpoint, stats in result["endpoints"].items():
+        cpu = f"{stats['cpu_ms']:.2f}" if stats["cpu_ms"] is not None else "-"
+        print(f"{endpoint:<24}{stats['requests']:>9}{stats['rps']:>9.1f}{stats['p50_ms']:>9.1f}{stats['p90_ms']:>9.1f}"
+              f"{stats['p99_ms']:>9.1f}{stats['max_ms']:>9.1f}{stats['errors']:>8}{cpu:>8}")
+    line = f"client cpu {result['client_cpu_percent']:.0f}%"
+    if "server" in result:
+        server = result["server"]
+        line = (f"server cpu {server['cpu_percent']:.0f}%, rss {server['rss_mib']:.1f} MiB"
+                f" (peak {server['rss_peak_mib']:.1f}), " + line)
+    print(line)
+    if "event_lag" in result:
+        lag = result["event_lag"]
+        print(f"fix to tab: {lag['events']} events, p50 {lag['p50_ms']:.1f} ms, p99 {lag['p99_ms']:.1f} ms")
+
+
+def git_revision():
+    def git(*command):
+        return subprocess.run(["git", *command], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+
+    try:
+        return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except OSError:
+        return {"commit": None, "dirty": None}
+
+
+def parse_overrides(pairs):
+    overrides = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+def run(args):
+    stub = StubRouter(delay=args.stub_delay)
+    server = None
+    try:
+        if args.url:
+            base_url, pid = args.url.rstrip("/"), args.pid
+        else:
+            server = LocalServer(args.server, stub.url, parse_overrides(args.config))
+            base_url, pid = server.url, server.process.pid
+        monitor = ProcessMonitor(pid)
+        phases = {}
+        for name in args.phases:
+            phases[name] = run_phase(name, args, base_url, monitor)
+            print_phase(name, phases[name])
+        monitor.close()
+    finally:
+        if server is not None:
+            server.close()
+        stub.close()
+
+    revision = git_revision()
+    results = {
+        "version": 1,
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "label": args.label,
+        "git": revision,
+        "python": sys.version.split()[0],
+        "settings": {name: getattr(args, name) for name in (
+            "phones", "tabs", "duration", "speed", "phone_endpoint", "tab_mode", "route_rate", "stub_delay",
+            "server", "config",
+        )},
+        "phases": phases,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    name = "-".join(part for part in (stamp, (revision["commit"] or "")[:8], args.label) if part)
+    path = os.path.join(args.output, name + ".json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved {path}")
+
+
+# ----------------------------------------------------------------- compare
+
+# (statistic, True when a larger value is worse)
+COMPARED = (("p50_ms", True), ("p99_ms", True), ("rps", False), ("cpu_ms", True))
+
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if old.get("settings") != new.get("settings"):
+        print("Warning: the runs used different settings, so differences may not mean much")
+
+    regressions = 0
+    for phase, new_phase in new["phases"].items():
+        old_phase = old["phases"].get(phase)
+        if old_phase is None:
+            continue
+        print(f"\n== {phase}")
+        print(f"{'endpoint':<24}{'statistic':<10}{'old':>10}{'new':>10}{'change':>9}")
+        for endpoint, new_stats in new_phase["endpoints"].items():
+            old_stats = old_phase["endpoints"].get(endpoint)
+            if old_stats is None:
+                continue
+            for statistic, larger_is_worse in COMPARED:
+                before, after = old_stats.get(statistic), new_stats.get(statistic)
+                if before is None or after is None or before == 0:
+                    continue
+                change = (after - before) / before
+                worse = change > args.threshold if larger_is_worse else change < -args.threshold
+                # Sub-millisecond latencies are mostly noise
+                if worse and statistic.endswith("_ms") and after - before < args.min_ms:
+                    worse = False
+                regressions += worse
+                print(f"{endpoint:<24}{statistic:<10}{before:>10.2f}{after:>10.2f}{change:>+8.0%}"
+                      f"{'  REGRESSION' if worse else ''}")
+        for name, key in (("server cpu %", "cpu_percent"), ("server rss MiB", "rss_peak_mib")):
+            before = old_phase.get("server", {}).get(key)
+            after = new_phase.get("server", {}).get(key)
+            if before and after is not None:
+                print(f"{name:<34}{before:>10.1f}{after:>10.1f}{(after - before) / before:>+8.0%}")
+    print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the server with simulated phones and map tabs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the phases and save the results")
+    run_parser.add_argument("--phones", type=int, default=50)
+    run_parser.add_argument("--tabs", type=int, default=20)
+    run_parser.add_argument("--duration", type=float, default=30, help="seconds per phase")
+    run_parser.add_argument("--phases", nargs="+", choices=PHASES, default=list(PHASES))
+    run_parser.add_argument("--speed", type=float, default=1.4, help="phone speed in m/s; sets the fix interval")
+    run_parser.add_argument("--phone-endpoint", choices=("batch", "single"), default="batch",
+                            help="packed batches to /update_locations, or JSON to /update_location")
+    run_parser.add_argument("--tab-mode", choices=("poll", "sse"), default="poll")
+    run_parser.add_argument("--route-rate", type=float, default=0.5, help="new routes per second")
+    run_parser.add_argument("--stub-delay", type=float, default=0.2, help="seconds the routing stub takes")
+    run_parser.add_argument("--server", choices=("flask", "gunicorn"), default="flask")
+    run_parser.add_argument("--config", nargs="*", default=[], metavar="KEY=VALUE",
+                            help="config.json overrides for the local server, values as JSON")
+    run_parser.add_argument("--url", help="load an already running server instead of starting one")
+    run_parser.add_argument("--pid", type=int, help="with --url, the server process to measure")
+    run_parser.add_argument("--label", help="added to the results file name")
+    run_parser.add_argument("--output", default=os.path.join(BENCH_DIR, "results"))
+
+    compare_parser = commands.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="relative change that counts")
+    compare_parser.add_argument("--min-ms", type=float, default=1.0, help="ignore latency changes below this")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
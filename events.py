@@ -0,0 +1,74 @@
+import json
+import queue
+import threading
+
+
+class EventBus:
+    """Fan-out of change events to connected Server-Sent Events clients.
+
+    Every subscriber gets its own bounded queue. If a client falls so far
+    behind that its queue fills up, its backlog is dropped and replaced with
+    a single ``resync`` event, which tells it to reload everything.
+    """
+
+    def __init__(self, max_queue=256, heartbeat=15.0):
+        self.max_queue = max_queue
+        self.heartbeat = heartbeat
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event, data=None):
+        """Send ``event`` with an optional JSON payload to every subscriber"""
+        message = format_event(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                _drain(q)
+                try:
+                    q.put_nowait(format_event("resync"))
+                except queue.Full:
+                    pass
+
+    def stream(self):
+        """Generator yielding SSE frames for one client until it disconnects"""
+        q = self.subscribe()
+        try:
+            # Tell the browser to reconnect quickly if the server restarts
+            yield "retry: 2000\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(q)
+
+
+def format_event(event, data=None):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def _drain(q):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
@@ -0,0 +1,233 @@
+import math
+import threading
+import time
+from collections import deque
+
+from locator.geodesy import distance, from_local_xy, local_xy
+from spatial import CELL_SIZE, Area, GridIndex
+
+# Collections whose items can become fences; notes have no position
+FENCE_COLLECTIONS = ("drawings", "pois")
+
+
+class CircleFence:
+    """A radius around a POI"""
+
+    def __init__(self, fence_id, kind, name, lat, lng, radius):
+        self.id = fence_id
+        self.kind = kind
+        self.name = name
+        self.lat = lat
+        self.lng = lng
+        self.radius = radius
+
+    def envelope(self, margin):
+        area = Area.around(self.lat, self.lng, self.radius + margin)
+        return area.south, area.west, area.north, area.east
+
+    def distance(self, lat, lng):
+        """Meters outside the fence, negative inside"""
+        return distance(self.lat, self.lng, lat, lng) - self.radius
+
+
+class PolygonFence:
+    """A closed drawn stroke, as a ring of (lat, lng) points"""
+
+    def __init__(self, fence_id, kind, name, ring):
+        self.id = fence_id
+        self.kind = kind
+        self.name = name
+        lats = [lat for lat, _ in ring]
+        lngs = [lng for _, lng in ring]
+        self._bounds = min(lats), min(lngs), max(lats), max(lngs)
+        # Flat projection around the middle of the ring; fences are at most a few km across
+        self._lat0 = (self._bounds[0] + self._bounds[2]) / 2
+        self._lng0 = (self._bounds[1] + self._bounds[3]) / 2
+        self._points = [local_xy(lat, lng, self._lat0, self._lng0) for lat, lng in ring]
+
+    def envelope(self, margin):
+        south, west, north, east = self._bounds
+        lat, lng = from_local_xy(margin, margin, self._lat0, self._lng0)
+        dlat, dlng = lat - self._lat0, lng - self._lng0
+        return south - dlat, west - dlng, north + dlat, east + dlng
+
+    def distance(self, lat, lng):
+        """Meters outside the fence, negative inside"""
+        px, py = local_xy(lat, lng, self._lat0, self._lng0)
+        points = self._points
+        inside = False
+        nearest = math.inf
+        x1, y1 = points[-1]
+        for x2, y2 in points:
+            # Ray casting for containment, and the distance to this edge
+            if (y1 > py) != (y2 > py) and px < (x2 - x1) * (py - y1) / (y2 - y1) + x1:
+                inside = not inside
+            dx, dy = x2 - x1, y2 - y1
+            length2 = dx * dx + dy * dy
+            t = 0.0 if length2 == 0 else max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length2))
+            nearest = min(nearest, math.hypot(px - x1 - t * dx, py - y1 - t * dy))
+            x1, y1 = x2, y2
+        return -nearest if inside else nearest
+
+
+def build_fence(collection, key, item, poi_radius, closing_distance):
+    """Turn a stored item into a fence, or None if it doesn't describe an area.
+
+    POIs become circles of their own ``radius`` or
+    ``poi_radius`` meters; a radius of 0 turns the fence off. A drawn stroke
+    becomes a polygon when it ends within ``closing_distance`` meters of
+    where it started.
+    """
+    if not isinstance(item, dict):
+        return None
+    fence_id = f"{collection}/{key}"
+    if collection == "drawings":
+        geometry = item.get("geometry") or {}
+        properties = item.get("properties") or {}
+        coordinates = geometry.get("coordinates") or []
+        if geometry.get("type") == "Polygon":
+            coordinates = coordinates[0] if coordinates else []
+        elif geometry.get("type") != "LineString":
+            return None
+        ring = [(c[1], c[0]) for c in coordinates if isinstance(c, (list, tuple)) and len(c) >= 2]
+        if len(ring) < 4 or distance(*ring[0], *ring[-1]) > closing_distance:
+            return None
+        return PolygonFence(fence_id, "drawing", properties.get("name") or "Drawn area", ring)
+
+    lat, lng = item.get("lat"), item.get("lng")
+    if not isinstance(lat, (int, float)) or not isinstance(lng, (int, float)):
+        return None
+    radius = item.get("radius", poi_radius)
+    if not isinstance(radius, (int, float)) or radius <= 0:
+        return None
+    name = item.get("name") or item.get("title") or item.get("text") or "POI"
+    return CircleFence(fence_id, "poi", str(name)[:80], lat, lng, radius)
+
+
+class GeofenceEngine:
+    """Checks phone positions against fences and reports enter and exit events.
+
+    Fences are rebuilt from the POI and drawing collections through
+    their change feeds. ``submit`` only records a phone's latest position;
+    a background thread does the checking, so ingest never waits on it and a
+    burst of fixes from one phone costs one check. A phone enters a fence
+    when it is inside it, and only exits once it is ``hysteresis`` meters
+    outside, so GPS jitter on the boundary doesn't flap. The first position
+    seen for a phone only sets its state, so a restart doesn't re-announce
+    every phone that is already inside a fence.
+    """
+
+    def __init__(self, storage, on_event, poi_radius=50.0, hysteresis=10.0, closing_distance=30.0,
+                 cell_size=CELL_SIZE, history=200):
+        self.storage = storage
+        self.on_event = on_event
+        self.poi_radius = poi_radius
+        self.hysteresis = hysteresis
+        self.closing_distance = closing_distance
+
+        self._index = GridIndex(cell_size)
+        self._fences = {}
+        self._revisions = {}
+        self._inside = {}
+        self._recent = deque(maxlen=history)
+        self._checks = 0
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="geofence", daemon=True)
+        self._thread.start()
+
+    def submit(self, phone_id, lat, lng, timestamp=None):
+        with self._lock:
+            self._pending[phone_id] = (lat, lng, timestamp if timestamp is not None else time.time())
+        self._wake.set()
+
+    def recent_events(self):
+        with self._lock:
+            return list(self._recent)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "fences": len(self._fences),
+                "phones": len(self._inside),
+                "inside": {phone_id: sorted(fences) for phone_id, fences in self._inside.items() if fences},
+                "checks": self._checks,
+                "pending": len(self._pending),
+            }
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            try:
+                self._sync()
+                for phone_id, (lat, lng, timestamp) in batch.items():
+                    self._check(phone_id, lat, lng, timestamp)
+            except Exception as e:
+                print(f"Geofence check failed: {e}")
+
+    def _sync(self):
+        for collection in FENCE_COLLECTIONS:
+            since = self._revisions.get(collection)
+            if since is not None and since == self.storage.revision(collection):
+                continue
+            delta = self.storage.changes_since(collection, since or 0)
+            if delta["full"]:
+                for fence_id in [f for f in self._fences if f.startswith(collection + "/")]:
+                    self._remove(fence_id)
+            for key in delta["deleted"]:
+                self._remove(f"{collection}/{key}")
+            for key, item in delta["changed"]:
+                self._remove(f"{collection}/{key}")
+                fence = build_fence(collection, key, item, self.poi_radius, self.closing_distance)
+                if fence is not None:
+                    with self._lock:
+                        self._fences[fence.id] = fence
+                    self._index.set(fence.id, fence, fence.envelope(self.hysteresis))
+            self._revisions[collection] = delta["rev"]
+
+    def _remove(self, fence_id):
+        with self._lock:
+            if self._fences.pop(fence_id, None) is None:
+                return
+            # A deleted fence is left silently, without an exit event
+            for fences in self._inside.values():
+                fences.discard(fence_id)
+        self._index.remove(fence_id)
+
+    def _check(self, phone_id, lat, lng, timestamp):
+        was_inside = self._inside.get(phone_id)
+        inside = set()
+        for fence_id, fence in self._index.query(Area(lat, lng, lat, lng)):
+            distance = fence.distance(lat, lng)
+            if distance <= 0 or (was_inside is not None and fence_id in was_inside and distance < self.hysteresis):
+                inside.add(fence_id)
+
+        events = []
+        if was_inside is not None:
+            for fence_id in sorted(inside - was_inside):
+                events.append(self._event("enter", phone_id, self._fences[fence_id], lat, lng, timestamp))
+            for fence_id in sorted(was_inside - inside):
+                events.append(self._event("exit", phone_id, self._fences[fence_id], lat, lng, timestamp))
+        with self._lock:
+            self._inside[phone_id] = inside
+            self._checks += 1
+            self._recent.extend(events)
+        for event in events:
+            self.on_event(event)
+
+    def _event(self, kind, phone_id, fence, lat, lng, timestamp):
+        return {
+            "event": kind,
+            "phone": phone_id,
+            "fence": fence.id,
+            "fence_kind": fence.kind,
+            "name": fence.name,
+            "lat": lat,
+            "lng": lng,
+            "timestamp": timestamp,
+        }
@@ -0,0 +1,336 @@
+"""The map's global reference grid.
+
+Cells are GRID_SIZE degrees square. A cell's reference is its column, as
+letters counting cells east from 180 W (A..Z, AA..AZ, BA.. and so on),
+followed by its row, counting cells north from 90 S. So every place on
+Earth has one fixed reference that phones and people can read out over the
+radio.
+
+The grid is drawn as ordinary 256 px map tiles rendered here, in pure
+Python, and cached on disk. The browser shows it as one more tile layer
+instead of building a marker per cell. At zooms where cells would be
+closer together than MIN_LINE_SPACING pixels, only every 10th (100th,
+...) line is drawn, and each block is labelled with its south-west cell.
+"""
+import math
+import os
+import re
+import struct
+import zlib
+from functools import lru_cache
+
+from tile_cache import TileStore
+
+# Same cell size as spatial.CELL_SIZE, so index cells line up with the map grid
+GRID_SIZE = 0.005
+COLUMNS = round(360 / GRID_SIZE)
+ROWS = round(180 / GRID_SIZE)
+TILE_SIZE = 256
+MAX_ZOOM = 22
+MAX_LATITUDE = 85.0511287798
+# Bump when the drawing changes, so tiles cached by an older version are not reused
+RENDER_VERSION = 1
+
+MIN_LINE_SPACING = 8  # pixels
+LINE_COLOR = bytes((0, 0, 0, 128))
+DASH = 2  # pixels on, then pixels off
+TEXT_COLOR = bytes((0, 0, 0, 255))
+HALO_COLOR = bytes((255, 255, 255, 170))
+LABEL_PADDING = 2  # pixels of halo around the text
+# Longest reference on land: four letters and five digits
+LABEL_LENGTH = 9
+
+_REF = re.compile(r"^\s*([A-Za-z]+)\s*(\d+)\s*$")
+
+
+# ----------------------------------------------------------------- references
+
+@lru_cache(maxsize=None)
+def column_letters(column):
+    """Letters of a column index: 0 is A, 25 is Z, 26 is AA"""
+    letters = ""
+    while True:
+        letters = chr(65 + column % 26) + letters
+        column = column // 26 - 1
+        if column < 0:
+            return letters
+
+
+def letters_column(letters):
+    column = 0
+    for letter in letters.upper():
+        column = column * 26 + ord(letter) - 64
+    return column - 1
+
+
+def cell_of(lat, lng):
+    """(column, row) of the cell containing a point"""
+    if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        raise ValueError(f"({lat}, {lng}) is not a valid position")
+    # The same arithmetic the browser used, so existing references stay valid; 90 N and
+    # 180 E themselves fall in the last row and column instead of one past the grid
+    return (
+        min(math.floor((lng + 180) / GRID_SIZE), COLUMNS - 1),
+        min(math.floor((lat + 90) / GRID_SIZE), ROWS - 1),
+    )
+
+
+def grid_ref(lat, lng):
+    column, row = cell_of(lat, lng)
+    return column_letters(column) + str(row)
+
+
+def parse_grid_ref(ref):
+    """(column, row) of a reference like "BDKI29982"; raises ValueError"""
+    match = _REF.match(ref) if isinstance(ref, str) else None
+    if match is None:
+        raise ValueError(f"{ref!r} is not a grid reference")
+    column, row = letters_column(match.group(1)), int(match.group(2))
+    if column >= COLUMNS or row >= ROWS:
+        raise ValueError(f"{ref!r} is outside the grid")
+    return column, row
+
+
+def cell_bounds(column, row):
+    """(south, west, north, east) of a cell"""
+    south = row * GRID_SIZE - 90
+    west = column * GRID_SIZE - 180
+    return south, west, south + GRID_SIZE, west + GRID_SIZE
+
+
+def describe_cell(ref):
+    """Normalized reference, center and bounds of a cell, as sent to clients"""
+    column, row = parse_grid_ref(ref)
+    south, west, north, east = cell_bounds(column, row)
+    return {
+        "ref": column_letters(column) + str(row),
+        "lat": (south + north) / 2,
+        "lng": (west + east) / 2,
+        "bounds": [south, west, north, east],
+    }
+
+
+def grid_refs(points):
+    """Reference for each [lat, lng] point; None for points that aren't positions"""
+    refs = []
+    for point in points:
+        try:
+            refs.append(grid_ref(float(point[0]), float(point[1])))
+        except (TypeError, ValueError, IndexError, KeyError):
+            refs.append(None)
+    return refs
+
+
+def describe_cells(refs):
+    """``describe_cell`` for each reference; None for ones that don't parse"""
+    cells = []
+    for ref in refs:
+        try:
+            cells.append(describe_cell(ref))
+        except ValueError:
+            cells.append(None)
+    return cells
+
+
+# --------------------------------------------------------------------- tiles
+
+# 5x7 bitmap glyphs, one string of five pixels per row
+FONT = {
+    "A": (".###.", "#...#", "#...#", "#####", "#...#", "#...#", "#...#"),
+    "B": ("####.", "#...#", "#...#", "####.", "#...#", "#...#", "####."),
+    "C": (".###.", "#...#", "#....", "#....", "#....", "#...#", ".###."),
+    "D": ("####.", "#...#", "#...#", "#...#", "#...#", "#...#", "####."),
+    "E": ("#####", "#....", "#....", "####.", "#....", "#....", "#####"),
+    "F": ("#####", "#....", "#....", "####.", "#....", "#....", "#...."),
+    "G": (".###.", "#...#", "#....", "#.###", "#...#", "#...#", ".####"),
+    "H": ("#...#", "#...#", "#...#", "#####", "#...#", "#...#", "#...#"),
+    "I": (".###.", "..#..", "..#..", "..#..", "..#..", "..#..", ".###."),
+    "J": ("..###", "...#.", "...#.", "...#.", "...#.", "#..#.", ".##.."),
+    "K": ("#...#", "#..#.", "#.#..", "##...", "#.#..", "#..#.", "#...#"),
+    "L": ("#....", "#....", "#....", "#....", "#....", "#....", "#####"),
+    "M": ("#...#", "##.##", "#.#.#", "#.#.#", "#...#", "#...#", "#...#"),
+    "N": ("#...#", "#...#", "##..#", "#.#.#", "#..##", "#...#", "#...#"),
+    "O": (".###.", "#...#", "#...#", "#...#", "#...#", "#...#", ".###."),
+    "P": ("####.", "#...#", "#...#", "####.", "#....", "#....", "#...."),
+    "Q": (".###.", "#...#", "#...#", "#...#", "#.#.#", "#..#.", ".##.#"),
+    "R": ("####.", "#...#", "#...#", "####.", "#.#..", "#..#.", "#...#"),
+    "S": (".####", "#....", "#....", ".###.", "....#", "....#", "####."),
+    "T": ("#####", "..#..", "..#..", "..#..", "..#..", "..#..", "..#.."),
+    "U": ("#...#", "#...#", "#...#", "#...#", "#...#", "#...#", ".###."),
+    "V": ("#...#", "#...#", "#...#", "#...#", "#...#", ".#.#.", "..#.."),
+    "W": ("#...#", "#...#", "#...#", "#.#.#", "#.#.#", "#.#.#", ".#.#."),
+    "X": ("#...#", "#...#", ".#.#.", "..#..", ".#.#.", "#...#", "#...#"),
+    "Y": ("#...#", "#...#", ".#.#.", "..#..", "..#..", "..#..", "..#.."),
+    "Z": ("#####", "....#", "...#.", "..#..", ".#...", "#....", "#####"),
+    "0": (".###.", "#...#", "#..##", "#.#.#", "##..#", "#...#", ".###."),
+    "1": ("..#..", ".##..", "..#..", "..#..", "..#..", "..#..", ".###."),
+    "2": (".###.", "#...#", "....#", "...#.", "..#..", ".#...", "#####"),
+    "3": ("#####", "...#.", "..#..", "...#.", "....#", "#...#", ".###."),
+    "4": ("...#.", "..##.", ".#.#.", "#..#.", "#####", "...#.", "...#."),
+    "5": ("#####", "#....", "####.", "....#", "....#", "#...#", ".###."),
+    "6": ("..##.", ".#...", "#....", "####.", "#...#", "#...#", ".###."),
+    "7": ("#####", "....#", "...#.", "..#..", ".#...", ".#...", ".#..."),
+    "8": (".###.", "#...#", "#...#", ".###.", "#...#", "#...#", ".###."),
+    "9": (".###.", "#...#", "#...#", ".####", "....#", "...#.", ".##.."),
+}
+GLYPH_WIDTH, GLYPH_HEIGHT = 5, 7
+GLYPH_ADVANCE = GLYPH_WIDTH + 1
+# (x, y) of the lit pixels of each glyph
+_GLYPH_PIXELS = {
+    char: [(x, y) for y, row in enumerate(rows) for x, pixel in enumerate(row) if pixel == "#"]
+    for char, rows in FONT.items()
+}
+
+
+def encode_png(pixels, width, height):
+    """PNG of straight RGBA pixel bytes"""
+    stride = width * 4
+    raw = b"".join(b"\x00" + bytes(pixels[row * stride:(row + 1) * stride]) for row in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 9))
+        + chunk(b"IEND", b"")
+    )
+
+
+class _Canvas:
+    """RGBA pixels of one tile, drawn in the tile's own pixel coordinates and clipped to it"""
+
+    def __init__(self, size=TILE_SIZE):
+        self.size = size
+        self.pixels = bytearray(size * size * 4)
+
+    def fill(self, x0, y0, x1, y1, color):
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.size), min(y1, self.size)
+        if x0 >= x1:
+            return
+        span = color * (x1 - x0)
+        for y in range(y0, y1):
+            offset = (y * self.size + x0) * 4
+            self.pixels[offset:offset + len(span)] = span
+
+    def vertical_dashes(self, x, phase):
+        if 0 <= x < self.size:
+            for y in range(self.size):
+                if (y + phase) // DASH % 2 == 0:
+                    self.pixels[(y * self.size + x) * 4:(y * self.size + x + 1) * 4] = LINE_COLOR
+
+    def horizontal_dashes(self, y, phase):
+        if 0 <= y < self.size:
+            row = y * self.size
+            for x in range(self.size):
+                if (x + phase) // DASH % 2 == 0:
+                    self.pixels[(row + x) * 4:(row + x + 1) * 4] = LINE_COLOR
+
+    def text(self, x, y, text, scale):
+        for char in text:
+            for gx, gy in _GLYPH_PIXELS.get(char, ()):
+                self.fill(x + gx * scale, y + gy * scale, x + (gx + 1) * scale, y + (gy + 1) * scale, TEXT_COLOR)
+            x += GLYPH_ADVANCE * scale
+
+
+def _mercator_y(lat):
+    """Fraction of the way down the Web Mercator world (0 at the top)"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    return (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2
+
+
+def _label_size(text, scale):
+    width = (len(text) * GLYPH_ADVANCE - 1) * scale + 2 * LABEL_PADDING
+    return width, GLYPH_HEIGHT * scale + 2 * LABEL_PADDING
+
+
+def render_tile(z, x, y):
+    """PNG of the grid lines and labels on tile z/x/y"""
+    world = TILE_SIZE * (1 << z)
+    left, top = x * TILE_SIZE, y * TILE_SIZE
+    cell = GRID_SIZE / 360 * world  # cell width in pixels, and the least cell height
+    step = 1
+    while cell * step < MIN_LINE_SPACING and step < COLUMNS:
+        step *= 10
+
+    def column_x(column):
+        return math.floor(column * cell) - left
+
+    def row_y(row):
+        return math.floor(_mercator_y(row * GRID_SIZE - 90) * world) - top
+
+    south_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (top + TILE_SIZE) / world))))
+    north_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * top / world))))
+    # Blocks of step x step cells touching the tile, plus one on each side for labels that overhang
+    first_column = (math.floor(left / cell) // step - 1) * step
+    last_column = (math.floor((left + TILE_SIZE) / cell) // step + 1) * step
+    first_row = max((math.floor((south_lat + 90) / GRID_SIZE) // step - 1) * step, 0)
+    last_row = min((math.floor((north_lat + 90) / GRID_SIZE) // step + 1) * step, ROWS)
+
+    canvas = _Canvas()
+    for column in range(max(first_column, 0), min(last_column, COLUMNS) + 1, step):
+        canvas.vertical_dashes(column_x(column), top)
+    for row in range(first_row, last_row + 1, step):
+        canvas.horizontal_dashes(row_y(row), left)
+
+    # Label every block if a label fits in one, else every 2nd, 5th or 10th; the
+    # layout only depends on the zoom, so labels line up across tile edges
+    block = cell * step
+    for scale, every in ((2, 1), (1, 1), (1, 2), (1, 5), (1, 10)):
+        width, height = _label_size("W" * LABEL_LENGTH, scale)
+        if width + 2 <= block * every:
+            break
+    spacing = step * every
+    # A label overhangs its block, so look that much further out
+    reach = (math.ceil(width / block) // every + 1) * spacing
+    for row in range((first_row - reach) // spacing * spacing, last_row + reach, spacing):
+        if not 0 <= row < ROWS:
+            continue
+        y_center = (row_y(row) + row_y(row + step)) // 2
+        for column in range((first_column - reach) // spacing * spacing, last_column + reach, spacing):
+            if not 0 <= column < COLUMNS:
+                continue
+            text = column_letters(column) + str(row)
+            width, _ = _label_size(text, scale)
+            x0 = (column_x(column) + column_x(column + step) - width) // 2
+            y0 = y_center - height // 2
+            if x0 >= TILE_SIZE or y0 >= TILE_SIZE or x0 + width <= 0 or y0 + height <= 0:
+                continue
+            canvas.fill(x0, y0, x0 + width, y0 + height, HALO_COLOR)
+            canvas.text(x0 + LABEL_PADDING, y0 + LABEL_PADDING, text, scale)
+    return encode_png(canvas.pixels, TILE_SIZE, TILE_SIZE)
+
+
+class GridTiles:
+    """Grid tiles rendered on first request and kept in an MBTiles file"""
+
+    def __init__(self, directory="tiles", max_bytes=64 * 1024 ** 2):
+        self._store = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._store = TileStore(os.path.join(directory, f"grid-v{RENDER_VERSION}.mbtiles"), "Grid", max_bytes)
+        self._rendered = 0
+        self._hits = 0
+
+    def tile(self, z, x, y):
+        """PNG bytes, or None for a tile that doesn't exist"""
+        if not 0 <= z <= MAX_ZOOM or not 0 <= x < (1 << z) or not 0 <= y < (1 << z):
+            return None
+        if self._store is not None:
+            cached = self._store.get(z, x, y)
+            if cached is not None:
+                self._hits += 1
+                return cached[0]
+        data = render_tile(z, x, y)
+        self._rendered += 1
+        if self._store is not None:
+            self._store.put(z, x, y, data)
+        return data
+
+    def stats(self):
+        stats = {"hits": self._hits, "rendered": self._rendered}
+        if self._store is not None:
+            stats.update(self._store.stats())
+        return stats
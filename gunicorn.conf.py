@@ -0,0 +1,26 @@
+# Production settings: gunicorn -c gunicorn.conf.py wsgi:app
+import os
+
+bind = os.environ.get("LOCATOR_BIND", "0.0.0.0:5050")
+
+# One process by default: phones, /events subscribers and caches are shared in
+# memory. More workers need "phones_table" in config.json so they share phone
+# positions through a memory-mapped file. Every open map holds one thread for
+# its /events stream, so size threads for the number of browsers plus headroom
+# for ordinary requests.
+workers = int(os.environ.get("LOCATOR_WORKERS", "1"))
+worker_class = "gthread"
+threads = int(os.environ.get("LOCATOR_THREADS", "256"))
+
+# Seconds without a heartbeat before the worker is restarted. Streams and slow
+# routing calls run on request threads and do not block the heartbeat.
+timeout = 60
+graceful_timeout = 10
+keepalive = 5
+
+# Protect against oversized request lines and headers
+limit_request_line = 8190
+limit_request_fields = 100
+
+accesslog = os.environ.get("LOCATOR_ACCESS_LOG", "-")
+errorlog = "-"
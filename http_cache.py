@@ -0,0 +1,143 @@
+import gzip
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from flask import Response, request
+
+from locking import FileLock, atomic_write
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Revisions of in-memory state restart at zero, so tags from a previous run must not match
+BOOT_ID = uuid.uuid4().hex[:8]
+BOOT_ID_FILE = "boot_id"
+
+
+def shared_boot_id(directory="."):
+    """Boot id kept in ``directory``, the same in every worker process that uses it.
+
+    Only for revisions that are themselves shared and survive restarts
+    (storage, the shared phone table); the file is created by whichever
+    process gets there first.
+    """
+    path = os.path.join(directory, BOOT_ID_FILE)
+    with FileLock(path + ".lock"):
+        try:
+            with open(path, "r") as f:
+                boot_id = f.read().strip()
+            if boot_id:
+                return boot_id
+        except FileNotFoundError:
+            pass
+        boot_id = uuid.uuid4().hex[:8]
+        atomic_write(path, boot_id)
+        return boot_id
+
+
+class ResponseCache:
+    """Serialized and precompressed JSON bodies keyed by request path and content revision.
+
+    A body is only built the first time a revision is requested; later polls
+    either get the stored bytes or, when the browser already holds that
+    revision, a bodiless ``304 Not Modified``.
+    """
+
+    def __init__(self, max_entries=256, min_compress_size=1024, boot_id=None):
+        self.boot_id = boot_id or BOOT_ID
+        self.max_entries = max_entries
+        self.min_compress_size = min_compress_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def json_response(self, revision, producer):
+        """Return ``producer()`` as JSON, reusing the cached body while ``revision`` is unchanged"""
+        key = request.full_path
+        version = f"{self.boot_id}-{revision}"
+
+        # Any encoding of this revision is still current; answer with the tag the client holds
+        held = _matching_etag(request.headers.get("If-None-Match"), version)
+        if held is not None:
+            return self._not_modified(held)
+
+        entry = self._get(key, version)
+        if entry is None:
+            body = json.dumps(producer(), separators=(",", ":")).encode()
+            entry = {"version": version, "identity": body}
+            self._put(key, entry)
+
+        encoding = self._choose_encoding(len(entry["identity"]))
+        if encoding and encoding not in entry:
+            # Compressed lazily, once per revision and encoding
+            entry[encoding] = _compress(entry["identity"], encoding)
+
+        response = Response(entry[encoding or "identity"], mimetype="application/json")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["ETag"] = _etag(version, encoding)
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    def _not_modified(self, etag):
+        response = Response(status=304)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    def _choose_encoding(self, size):
+        if size < self.min_compress_size:
+            return None
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            return "br"
+        if accepted["gzip"]:
+            return "gzip"
+        return None
+
+    def _get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["version"] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def _etag(version, encoding=None):
+    """Strong tag of one encoding of a revision; each encoding is different bytes, so a different tag"""
+    return f'"{version}-{encoding}"' if encoding else f'"{version}"'
+
+
+def _matching_etag(header, version):
+    """The tag in If-None-Match that names any encoding of ``version``, or None"""
+    if not header:
+        return None
+    if header.strip() == "*":
+        return _etag(version)
+    current = {_etag(version, encoding) for encoding in (None, "gzip", "br")}
+    for tag in header.split(","):
+        # Proxies may weaken the tag in transit; the revision is still the same
+        tag = tag.strip()
+        if tag.removeprefix("W/") in current:
+            return tag
+    return None
@@ -0,0 +1,82 @@
+import json
+import math
+import numbers
+import time
+
+from locator import fixcodec
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+# Seconds a fix may claim to be ahead of the server clock before its time is clamped
+MAX_CLOCK_SKEW = 60
+
+
+class IngestError(ValueError):
+    """The request body could not be decoded into fixes"""
+
+
+def decode_batch(content_type, body):
+    """Decode a batch of fixes sent as JSON, MessagePack or the packed binary format"""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    try:
+        if content_type == fixcodec.CONTENT_TYPE:
+            return fixcodec.decode_fixes(body)
+        if content_type in MSGPACK_TYPES:
+            if msgpack is None:
+                raise IngestError("MessagePack support requires the msgpack package")
+            payload = msgpack.unpackb(body, raw=False)
+        else:
+            payload = json.loads(body)
+    except (ValueError, TypeError) as e:
+        if isinstance(e, IngestError):
+            raise
+        raise IngestError(f"Could not decode fixes: {e}")
+
+    # Either a bare list of fixes or {"fixes": [...]}; a single fix object is also accepted
+    if isinstance(payload, dict):
+        payload = payload.get("fixes", [payload])
+    if not isinstance(payload, list):
+        raise IngestError("Expected a list of fixes")
+    return payload
+
+
+def normalize_fix(fix, now=None):
+    """Validate one fix, returning a clean dict or None if it is unusable"""
+    if not isinstance(fix, dict):
+        return None
+    phone_id = fix.get("id")
+    lat = fix.get("lat")
+    lng = fix.get("lng")
+    if not phone_id or not _is_number(lat) or not _is_number(lng):
+        return None
+    if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        return None
+
+    now = now or time.time()
+    timestamp = fix.get("timestamp")
+    if _is_number(timestamp):
+        if not math.isfinite(timestamp):
+            return None
+        # A fix from the future would make every real fix after it look stale
+        timestamp = min(timestamp, now + MAX_CLOCK_SKEW)
+    else:
+        timestamp = now
+    heading = fix.get("heading")
+    alt = fix.get("alt")
+    return {
+        "id": str(phone_id),
+        "lat": lat,
+        "lng": lng,
+        "alt": alt if _is_number(alt) else None,
+        "heading": heading if _is_number(heading) else None,
+        # Buffered fixes keep the time they were taken, not the time they arrived
+        "timestamp": timestamp,
+    }
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool) and value == value
@@ -0,0 +1,3 @@
+#!/bin/bash
+# Start the server under gunicorn with the production settings in gunicorn.conf.py
+gunicorn -c gunicorn.conf.py wsgi:app
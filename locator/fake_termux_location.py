@@ -0,0 +1,53 @@
+"""Stand-in for termux-location, for running py.py without a phone.
+
+    TERMUX_LOCATION_CMD="python fake_termux_location.py" python py.py
+
+Prints a pretty-printed JSON fix like termux-location does. With
+``-r updates`` it keeps printing one every FAKE_GPS_INTERVAL seconds
+(default 1). The position walks east at FAKE_GPS_SPEED meters per second
+(default 1.4) from FAKE_GPS_START ("lat,lng"), following the wall clock, so
+polled and streamed fixes agree.
+"""
+import json
+import math
+import os
+import sys
+import time
+
+START = [float(v) for v in os.environ.get("FAKE_GPS_START", "59.9139,10.7522").split(",")]
+SPEED = float(os.environ.get("FAKE_GPS_SPEED", "1.4"))
+INTERVAL = float(os.environ.get("FAKE_GPS_INTERVAL", "1"))
+EARTH_RADIUS = 6371000  # meters
+
+
+def location(now):
+    lat, lng = START
+    travelled = SPEED * (now % 3600)
+    lng += math.degrees(travelled / (EARTH_RADIUS * math.cos(math.radians(lat))))
+    return {
+        "latitude": lat,
+        "longitude": lng,
+        "altitude": 12.0,
+        "accuracy": 5.0,
+        "vertical_accuracy": 3.0,
+        "bearing": 90.0,
+        "speed": SPEED,
+        "elapsedMs": 40,
+        "provider": "gps",
+    }
+
+
+def emit():
+    print(json.dumps(location(time.time()), indent=2), flush=True)
+
+
+if __name__ == "__main__":
+    if "updates" in sys.argv[1:]:
+        try:
+            while True:
+                emit()
+                time.sleep(INTERVAL)
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
+    else:
+        emit()
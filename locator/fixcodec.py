@@ -0,0 +1,69 @@
+"""Compact binary encoding for batches of GPS fixes.
+
+Shared by the phone-side sender and the server's /update_locations endpoint.
+A batch is a 4-byte header followed by fixed-size little-endian records:
+
+    header:  b"LF" | version (uint8) | reserved (uint8)
+    record:  id (8 bytes, UTF-8, NUL padded) | timestamp (float64)
+             | lat (float64) | lng (float64) | alt (float32) | heading (float32)
+
+Missing altitude or heading is sent as NaN.
+"""
+import math
+import struct
+
+CONTENT_TYPE = "application/x-locator-fixes"
+MAGIC = b"LF"
+VERSION = 1
+HEADER = struct.Struct("<2sBx")
+RECORD = struct.Struct("<8sdddff")
+MAX_ID_BYTES = 8
+
+
+def encode_fixes(fixes):
+    """Pack an iterable of fix dicts (id, lat, lng, alt, heading, timestamp) into bytes"""
+    parts = [HEADER.pack(MAGIC, VERSION)]
+    for fix in fixes:
+        phone_id = str(fix["id"]).encode("utf-8")
+        if len(phone_id) > MAX_ID_BYTES:
+            raise ValueError(f"Phone id {fix['id']!r} is longer than {MAX_ID_BYTES} bytes")
+        try:
+            parts.append(RECORD.pack(
+                phone_id,
+                fix["timestamp"],
+                fix["lat"],
+                fix["lng"],
+                _optional(fix.get("alt")),
+                _optional(fix.get("heading")),
+            ))
+        except struct.error as e:
+            raise ValueError(f"Fix for {fix['id']!r} can't be packed: {e}")
+    return b"".join(parts)
+
+
+def decode_fixes(data):
+    """Unpack bytes produced by ``encode_fixes`` into a list of fix dicts"""
+    if len(data) < HEADER.size:
+        raise ValueError("Packed fixes are missing their header")
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a version 1 packed fix batch")
+    body = memoryview(data)[HEADER.size:]
+    if len(body) % RECORD.size:
+        raise ValueError("Packed fixes are truncated")
+
+    fixes = []
+    for phone_id, timestamp, lat, lng, alt, heading in RECORD.iter_unpack(body):
+        fixes.append({
+            "id": phone_id.rstrip(b"\0").decode("utf-8"),
+            "timestamp": timestamp,
+            "lat": lat,
+            "lng": lng,
+            "alt": None if math.isnan(alt) else alt,
+            "heading": None if math.isnan(heading) else heading,
+        })
+    return fixes
+
+
+def _optional(value):
+    return math.nan if value is None else value
@@ -0,0 +1,171 @@
+"""Distances, bearings and bounding boxes on a spherical Earth.
+
+Shared by the phone-side sender and the server. The scalar functions use
+only ``math``, so they run on a phone without numpy, and are the fast path
+for one pair of points. The array functions take sequences or numpy arrays
+and handle every point in one pass. Arguments broadcast against each other,
+so one point can be compared with many. They need numpy, which the server
+always has.
+
+Latitudes and longitudes are in degrees, distances in meters, bearings in
+degrees clockwise from north.
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS = 6371000  # meters
+METERS_PER_DEGREE = math.pi / 180 * EARTH_RADIUS
+
+
+# ------------------------------------------------------------ single points
+
+def distance(lat1, lng1, lat2, lng2):
+    """Great-circle (haversine) distance"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bearing(lat1, lng1, lat2, lng2):
+    """Initial bearing from the first point towards the second, 0 to 360"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dlmb = math.radians(lng2 - lng1)
+    x = math.sin(dlmb) * math.cos(phi2)
+    y = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(dlmb)
+    return math.degrees(math.atan2(x, y)) % 360
+
+
+def destination(lat, lng, heading, meters):
+    """(lat, lng) reached by going ``meters`` along a great circle starting on ``heading``"""
+    phi, theta, delta = math.radians(lat), math.radians(heading), meters / EARTH_RADIUS
+    phi2 = math.asin(math.sin(phi) * math.cos(delta) + math.cos(phi) * math.sin(delta) * math.cos(theta))
+    lmb2 = math.radians(lng) + math.atan2(
+        math.sin(theta) * math.sin(delta) * math.cos(phi), math.cos(delta) - math.sin(phi) * math.sin(phi2)
+    )
+    return math.degrees(phi2), (math.degrees(lmb2) + 540) % 360 - 180
+
+
+def bbox_around(lat, lng, radius):
+    """(south, west, north, east) containing every point within ``radius`` meters"""
+    dlat = math.degrees(radius / EARTH_RADIUS)
+    # Past the poles the longitude span covers everything
+    cos_lat = math.cos(math.radians(lat))
+    dlng = 180.0 if cos_lat < 1e-6 else min(180.0, dlat / cos_lat)
+    return lat - dlat, lng - dlng, lat + dlat, lng + dlng
+
+
+def local_xy(lat, lng, lat0, lng0):
+    """(x, y) meters east and north of (lat0, lng0) on a flat equirectangular plane.
+
+    Off by well under a meter within a few km of the reference point, which
+    is all strokes, fences and route snapping need. ``lat`` and ``lng`` may
+    also be numpy arrays.
+    """
+    return (lng - lng0) * METERS_PER_DEGREE * math.cos(math.radians(lat0)), (lat - lat0) * METERS_PER_DEGREE
+
+
+def from_local_xy(x, y, lat0, lng0):
+    """Inverse of ``local_xy``: (lat, lng) of a point on the plane around (lat0, lng0)"""
+    return lat0 + y / METERS_PER_DEGREE, lng0 + x / (METERS_PER_DEGREE * math.cos(math.radians(lat0)))
+
+
+def heading_change(a, b):
+    """Smallest angle between two headings"""
+    diff = abs(a - b) % 360
+    return 360 - diff if diff > 180 else diff
+
+
+# ------------------------------------------------------------------- arrays
+
+def _arrays(*values):
+    if np is None:
+        raise ImportError("the array functions in geodesy need numpy")
+    return [np.asarray(value, dtype=float) for value in values]
+
+
+def distances(lat1, lng1, lat2, lng2):
+    """``distance`` for every pair of points"""
+    lat1, lng1, lat2, lng2 = _arrays(lat1, lng1, lat2, lng2)
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def bearings(lat1, lng1, lat2, lng2):
+    """``bearing`` for every pair of points"""
+    lat1, lng1, lat2, lng2 = _arrays(lat1, lng1, lat2, lng2)
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dlmb = np.radians(lng2 - lng1)
+    x = np.sin(dlmb) * np.cos(phi2)
+    y = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(dlmb)
+    return np.degrees(np.arctan2(x, y)) % 360
+
+
+def destinations(lat, lng, heading, meters):
+    """``destination`` for every point, as a (lats, lngs) pair of arrays"""
+    lat, lng, heading, meters = _arrays(lat, lng, heading, meters)
+    phi, theta, delta = np.radians(lat), np.radians(heading), meters / EARTH_RADIUS
+    phi2 = np.arcsin(np.sin(phi) * np.cos(delta) + np.cos(phi) * np.sin(delta) * np.cos(theta))
+    lmb2 = np.radians(lng) + np.arctan2(
+        np.sin(theta) * np.sin(delta) * np.cos(phi), np.cos(delta) - np.sin(phi) * np.sin(phi2)
+    )
+    return np.degrees(phi2), (np.degrees(lmb2) + 540) % 360 - 180
+
+
+def segment_lengths(lats, lngs):
+    """Length of each step along a path of points"""
+    lats, lngs = _arrays(lats, lngs)
+    return distances(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+
+
+def path_length(lats, lngs):
+    """Total length of a path of points; 0 for fewer than two"""
+    if len(lats) < 2:
+        return 0.0
+    return float(segment_lengths(lats, lngs).sum())
+
+
+def bounds(lats, lngs):
+    """(south, west, north, east) of a set of points, or None if there are none"""
+    lats, lngs = _arrays(lats, lngs)
+    if not lats.size:
+        return None
+    return float(lats.min()), float(lngs.min()), float(lats.max()), float(lngs.max())
+
+
+def nearest(lat, lng, lats, lngs):
+    """(index, distance) of the point nearest to (lat, lng), or (None, inf) if there are none"""
+    lats, lngs = _arrays(lats, lngs)
+    if not lats.size:
+        return None, math.inf
+    found = distances(lat, lng, lats, lngs)
+    index = int(np.argmin(found))
+    return index, float(found[index])
+
+
+def nearest_each(query_lats, query_lngs, lats, lngs, chunk=1 << 20):
+    """(indices, distances) of the nearest point for every query point.
+
+    Compares every query with every point, in blocks of about ``chunk``
+    pairs so memory stays bounded. That is the quickest way for up to tens
+    of thousands of points; beyond that, narrow the candidates first with
+    a spatial index.
+    """
+    query_lats, query_lngs, lats, lngs = _arrays(query_lats, query_lngs, lats, lngs)
+    if not lats.size:
+        raise ValueError("no points to search")
+    indices = np.empty(query_lats.size, dtype=np.int64)
+    found = np.empty(query_lats.size)
+    rows = max(1, chunk // lats.size)
+    for start in range(0, query_lats.size, rows):
+        block = distances(
+            query_lats[start:start + rows, None], query_lngs[start:start + rows, None], lats[None, :], lngs[None, :]
+        )
+        best = np.argmin(block, axis=1)
+        indices[start:start + rows] = best
+        found[start:start + rows] = block[np.arange(len(best)), best]
+    return indices, found
@@ -0,0 +1,157 @@
+"""Constant-velocity Kalman filter for GPS fixes.
+
+Shared by the phone-side sender and, optionally, the server. Positions are
+tracked in meters on a local plane around a reference point that follows
+the phone. Each axis has a position and velocity state. The process noise
+is white acceleration, so the filter assumes the phone keeps its speed and
+direction and adapts as fixes disagree. Pure Python, so it runs on a phone
+without numpy.
+"""
+import math
+
+try:
+    from locator.geodesy import from_local_xy, local_xy
+except ImportError:
+    # On the phone, py.py runs from inside locator/
+    from geodesy import from_local_xy, local_xy
+
+
+class _Axis:
+    """Position and velocity along one axis, with their 2x2 covariance"""
+
+    def __init__(self, position, variance, velocity_variance):
+        self.x = position
+        self.v = 0.0
+        self.pxx = variance
+        self.pxv = 0.0
+        self.pvv = velocity_variance
+
+    def predicted(self, dt, q):
+        """State and covariance ``dt`` seconds ahead, as a tuple"""
+        x = self.x + self.v * dt
+        pxx = self.pxx + 2 * dt * self.pxv + dt * dt * self.pvv + q * dt ** 3 / 3
+        pxv = self.pxv + dt * self.pvv + q * dt * dt / 2
+        pvv = self.pvv + q * dt
+        return x, self.v, pxx, pxv, pvv
+
+    def predict(self, dt, q):
+        self.x, self.v, self.pxx, self.pxv, self.pvv = self.predicted(dt, q)
+
+    def correct(self, measured, r):
+        s = self.pxx + r
+        gain_x = self.pxx / s
+        gain_v = self.pxv / s
+        innovation = measured - self.x
+        self.x += gain_x * innovation
+        self.v += gain_v * innovation
+        self.pvv -= gain_v * self.pxv
+        self.pxv -= gain_v * self.pxx
+        self.pxx -= gain_x * self.pxx
+
+
+class PositionFilter:
+    """Smooths one phone's fixes into position, speed, heading and their uncertainty.
+
+    ``accel_noise`` is the typical unmodelled acceleration in m/s^2: about
+    0.3 for walking and 2 for driving. Fixes without an accuracy are assumed
+    good to ``default_accuracy`` meters. A fix more than ``gate`` standard
+    deviations from the prediction is treated as a GPS jump and ignored.
+    After ``max_rejects`` of those in a row, or a gap longer than
+    ``max_gap`` seconds, the filter starts over from the new fix.
+    """
+
+    def __init__(self, accel_noise=0.3, default_accuracy=10.0, gate=5.0, max_rejects=3, max_gap=120.0):
+        self.q = accel_noise ** 2
+        self.default_accuracy = default_accuracy
+        self.gate = gate
+        self.max_rejects = max_rejects
+        self.max_gap = max_gap
+        self.timestamp = None
+        self._rejects = 0
+
+    def reset(self):
+        self.timestamp = None
+        self._rejects = 0
+
+    def update(self, lat, lng, timestamp, accuracy=None):
+        """Add a fix and return the new estimate (see ``estimate``).
+
+        A fix older than the last one does not change the filter.
+        """
+        r = (accuracy if accuracy and accuracy > 0 else self.default_accuracy) ** 2
+        if self.timestamp is None or timestamp - self.timestamp > self.max_gap:
+            self._start(lat, lng, timestamp, r)
+            return self.estimate()
+        dt = timestamp - self.timestamp
+        if dt < 0:
+            return self.estimate()
+
+        x, y = self._to_local(lat, lng)
+        east, north = self._east.predicted(dt, self.q), self._north.predicted(dt, self.q)
+        distance2 = (x - east[0]) ** 2 / (east[2] + r) + (y - north[0]) ** 2 / (north[2] + r)
+        if distance2 > self.gate ** 2:
+            self._rejects += 1
+            if self._rejects >= self.max_rejects:
+                self._start(lat, lng, timestamp, r)
+            return self.estimate()
+
+        self._rejects = 0
+        self._east.predict(dt, self.q)
+        self._north.predict(dt, self.q)
+        self._east.correct(x, r)
+        self._north.correct(y, r)
+        self.timestamp = timestamp
+        self._recenter()
+        return self.estimate()
+
+    def estimate(self, timestamp=None):
+        """Estimate at ``timestamp`` (default: the last fix), extrapolated at constant velocity.
+
+        Returns a dict with lat, lng, speed (m/s), heading (degrees, None
+        while the speed is within noise), accuracy (meters, one standard
+        deviation), speed_accuracy, heading_accuracy and timestamp, or None
+        before the first fix.
+        """
+        if self.timestamp is None:
+            return None
+        dt = max(0.0, timestamp - self.timestamp) if timestamp is not None else 0.0
+        x, vx, pxx, _, pvx = self._east.predicted(dt, self.q)
+        y, vy, pyy, _, pvy = self._north.predicted(dt, self.q)
+        lat, lng = self._to_geo(x, y)
+        speed = math.hypot(vx, vy)
+        speed_accuracy = math.sqrt((pvx + pvy) / 2)
+        heading = heading_accuracy = None
+        # While the speed is within its own noise the direction is meaningless
+        if speed > speed_accuracy:
+            heading = math.degrees(math.atan2(vx, vy)) % 360
+            heading_accuracy = math.degrees(speed_accuracy / speed)
+        return {
+            "lat": lat,
+            "lng": lng,
+            "speed": speed,
+            "heading": heading,
+            "accuracy": math.sqrt((pxx + pyy) / 2),
+            "speed_accuracy": speed_accuracy,
+            "heading_accuracy": heading_accuracy,
+            "timestamp": self.timestamp + dt,
+        }
+
+    def _start(self, lat, lng, timestamp, r):
+        self._lat0, self._lng0 = lat, lng
+        # Velocity starts unknown: allow up to about 30 m/s
+        self._east = _Axis(0.0, r, 30.0 ** 2)
+        self._north = _Axis(0.0, r, 30.0 ** 2)
+        self.timestamp = timestamp
+        self._rejects = 0
+
+    def _recenter(self):
+        # Keep the local plane small so the flat-earth projection stays accurate
+        if abs(self._east.x) > 1000 or abs(self._north.x) > 1000:
+            self._lat0, self._lng0 = self._to_geo(self._east.x, self._north.x)
+            self._east.x = self._north.x = 0.0
+
+    def _to_local(self, lat, lng):
+        return local_xy(lat, lng, self._lat0, self._lng0)
+
+    def _to_geo(self, x, y):
+        return from_local_xy(x, y, self._lat0, self._lng0)
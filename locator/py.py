@@ -1,18 +1,49 @@
-from flask import Flask
-from flask_cors import CORS
 import subprocess
 import requests
 import json
+import logging
+import shlex
+import threading
 import time
 import sys
 import os
-import math
+from queue import Empty, Queue
+
+from fixcodec import CONTENT_TYPE, HEADER, MAGIC, MAX_ID_BYTES, RECORD, VERSION, encode_fixes
+from geodesy import distance, heading_change
+from kalman import PositionFilter
 
 # Configuration file for storing server settings
 CONFIG_FILE = "server_config.json"
 
-app = Flask(__name__)
-CORS(app)
+# DEBUG logs every fix; the default INFO only logs a summary every LOG_SUMMARY_INTERVAL
+log = logging.getLogger("locator")
+LOG_LEVEL = os.environ.get("LOCATOR_LOG_LEVEL", "INFO").upper()
+LOG_SUMMARY_INTERVAL = 60  # seconds
+# Optional packed log of every raw fix (locator/fixcodec.py format) for later analysis
+FIX_LOG_FILE = os.environ.get("LOCATOR_FIX_LOG")
+
+# Location command; point TERMUX_LOCATION_CMD at a fake script to test without a phone
+LOCATION_CMD = shlex.split(os.environ.get("TERMUX_LOCATION_CMD", "termux-location"))
+# "stream" keeps one `termux-location -r updates` running; "poll" starts one process per fix
+GPS_MODE = os.environ.get("LOCATOR_GPS_MODE", "stream")
+GPS_TIMEOUT = 10  # seconds for a single polled fix
+GPS_RESTART_MAX = 30  # seconds between restarts of a failed location stream
+
+# Fixes waiting to be uploaded, kept on disk so they survive dead zones and restarts
+QUEUE_FILE = "pending_fixes.bin"
+MAX_QUEUED_FIXES = 5000  # about 200 KB; the oldest fixes are dropped beyond this
+BATCH_SIZE = 200  # fixes per /update_locations request
+REQUEST_TIMEOUT = 5  # seconds
+UPLOAD_RETRY_MIN = 1  # seconds before the first retry after a failed upload
+UPLOAD_RETRY_MAX = 60  # retries back off up to this
+
+# Adaptive sampling: aim for one fix every TARGET_FIX_SPACING meters of travel
+MIN_SAMPLE_INTERVAL = 2  # seconds, also used while turning
+MAX_SAMPLE_INTERVAL = 30  # seconds, reached while standing still
+TARGET_FIX_SPACING = 10  # meters
+TURN_ANGLE = 25  # degrees of heading change that count as a turn
+HEARTBEAT_INTERVAL = 60  # seconds; a stationary phone still reports this often
 
 def load_config():
     """Load server configuration from JSON file"""
@@ -46,7 +77,7 @@ def get_input_with_default(prompt, default_value=None):
 
 def get_gps_coords():
     try:
-        result = subprocess.run(["termux-location"], capture_output=True, text=True, timeout=10)
+        result = subprocess.run(LOCATION_CMD, capture_output=True, text=True, timeout=GPS_TIMEOUT)
         if result.returncode == 0:
             data = json.loads(result.stdout)
             lat = data.get("latitude")
@@ -55,74 +86,92 @@ def get_gps_coords():
             if lat is not None and lon is not None:
                 return lat, lon, alt
     except Exception as e:
-        print("Error getting location:", e)
+        log.warning("Error getting location: %s", e)
     return None, None, None
 
-# GPS tracking for movement direction
-gps_history = []
-MAX_GPS_HISTORY = 5  # Keep last 5 GPS positions
-MIN_MOVEMENT_DISTANCE = 3  # Minimum movement in meters to calculate direction
-
-def calculate_gps_heading(lat1, lon1, lat2, lon2):
-    """Calculate heading (direction of travel) between two GPS points"""
-    try:
-        import math
-        
-        print(f"DEBUG: Calculating heading from ({lat1:.6f}, {lon1:.6f}) to ({lat2:.6f}, {lon2:.6f})")
-        
-        # Convert to radians
-        lat1_rad = math.radians(lat1)
-        lat2_rad = math.radians(lat2)
-        lon1_rad = math.radians(lon1)
-        lon2_rad = math.radians(lon2)
-        
-        # Calculate difference in longitude
-        dlon = lon2_rad - lon1_rad
-        
-        # Calculate bearing
-        y = math.sin(dlon) * math.cos(lat2_rad)
-        x = (math.cos(lat1_rad) * math.sin(lat2_rad) - 
-             math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(dlon))
-        
-        bearing = math.atan2(y, x)
-        
-        # Convert to degrees and normalize to 0-360
-        bearing_deg = math.degrees(bearing)
-        if bearing_deg < 0:
-            bearing_deg += 360
-        
-        print(f"DEBUG: Calculated raw bearing: {math.degrees(bearing):.2f}°, normalized: {bearing_deg:.2f}°")
-            
-        return bearing_deg
-    except Exception as e:
-        print(f"Error calculating GPS heading: {e}")
+def parse_location(data, timestamp):
+    """Turn one termux-location JSON object into a fix dict, or None if it has no position"""
+    if not isinstance(data, dict) or data.get("latitude") is None or data.get("longitude") is None:
         return None
+    return {
+        "lat": data["latitude"],
+        "lon": data["longitude"],
+        "alt": data.get("altitude"),
+        "accuracy": data.get("accuracy"),
+        "timestamp": timestamp,
+    }
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two GPS points in meters"""
-    try:
-        import math
-        
-        # Radius of the Earth in meters
-        R = 6371000
-        
-        # Convert to radians
-        lat1_rad = math.radians(lat1)
-        lat2_rad = math.radians(lat2)
-        dlat = math.radians(lat2 - lat1)
-        dlon = math.radians(lon2 - lon1)
-        
-        # Haversine formula
-        a = (math.sin(dlat/2) * math.sin(dlat/2) + 
-             math.cos(lat1_rad) * math.cos(lat2_rad) * 
-             math.sin(dlon/2) * math.sin(dlon/2))
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        
-        distance = R * c
-        return distance
-    except Exception as e:
-        print(f"Error calculating distance: {e}")
-        return None
+class GpsReader(threading.Thread):
+    """Producer: acquires fixes and hands them to ``on_fix`` as soon as they arrive.
+
+    Each fix is stamped when it is read, so queueing or upload delays never
+    shift its time. In "stream" mode one long-lived location process
+    reports continuously and is restarted with backoff if it dies. In
+    "poll" mode a new process is started every ``interval()`` seconds,
+    measured from the start of the previous one.
+    """
+
+    def __init__(self, on_fix, interval, mode=GPS_MODE, cmd=LOCATION_CMD):
+        super().__init__(name="gps-reader", daemon=True)
+        self.on_fix = on_fix
+        self.interval = interval
+        self.mode = mode
+        self.cmd = cmd
+        self._stopping = threading.Event()
+        self._process = None
+
+    def stop(self):
+        self._stopping.set()
+        if self._process is not None:
+            self._process.terminate()
+
+    def run(self):
+        if self.mode == "poll":
+            self._poll()
+        else:
+            self._stream()
+
+    def _poll(self):
+        while not self._stopping.is_set():
+            started = time.time()
+            lat, lon, alt = get_gps_coords()
+            if lat is not None and lon is not None:
+                self.on_fix({"lat": lat, "lon": lon, "alt": alt, "timestamp": time.time()})
+            self._stopping.wait(max(0, self.interval() - (time.time() - started)))
+
+    def _stream(self):
+        delay = 1
+        while not self._stopping.is_set():
+            got_fix = False
+            try:
+                self._process = subprocess.Popen(self.cmd + ["-r", "updates"], stdout=subprocess.PIPE, text=True)
+                decoder = json.JSONDecoder()
+                buffer = ""
+                # termux-location prints one pretty-printed JSON object per update
+                for line in self._process.stdout:
+                    buffer += line
+                    try:
+                        data, end = decoder.raw_decode(buffer.lstrip())
+                    except ValueError:
+                        continue
+                    buffer = buffer.lstrip()[end:]
+                    fix = parse_location(data, time.time())
+                    if fix is not None:
+                        got_fix = True
+                        self.on_fix(fix)
+                self._process.wait()
+            except Exception as e:
+                log.warning("Error reading location stream: %s", e)
+            if self._stopping.is_set():
+                break
+            # Restart quickly after a stream that worked, back off while it keeps failing
+            delay = 1 if got_fix else min(delay * 2, GPS_RESTART_MAX)
+            log.warning("Location stream ended, restarting in %ss", delay)
+            self._stopping.wait(delay)
+
+# Smoothed position, speed and heading from the raw fixes
+position_filter = PositionFilter()
+MIN_MOVEMENT_DISTANCE = 3  # Dead-band in meters: smaller moves are not uploaded
 
 def get_cardinal_direction(heading):
     """Convert heading degrees to cardinal direction"""
@@ -134,136 +183,254 @@ def get_cardinal_direction(heading):
     index = round(heading / 45) % 8
     return directions[index]
 
-def get_movement_heading(lat, lon):
-    """Calculate heading based on GPS movement history"""
-    global gps_history
-    
-    # Add current position to history
-    current_time = time.time()
-    gps_history.append({
-        'lat': lat,
-        'lon': lon,
-        'time': current_time
-    })
-    
-    print(f"DEBUG: Added GPS point #{len(gps_history)}: {lat:.6f}, {lon:.6f}")
-    
-    # Keep only recent history
-    if len(gps_history) > MAX_GPS_HISTORY:
-        gps_history = gps_history[-MAX_GPS_HISTORY:]
-        print(f"DEBUG: Trimmed GPS history to {MAX_GPS_HISTORY} points")
-    
-    # Need at least 2 points to calculate direction
-    if len(gps_history) < 2:
-        print("DEBUG: Not enough GPS points for direction calculation")
-        return None
-    
-    # Find the best pair of points for direction calculation
-    # Use the oldest and newest points that are far enough apart
-    best_heading = None
-    max_distance = 0
-    
-    current_pos = gps_history[-1]
-    print(f"DEBUG: Analyzing {len(gps_history)} GPS points for direction...")
-    
-    for i in range(len(gps_history) - 1):
-        old_pos = gps_history[i]
-        distance = calculate_distance(old_pos['lat'], old_pos['lon'], 
-                                    current_pos['lat'], current_pos['lon'])
-        
-        print(f"DEBUG: Point {i} -> current: distance = {distance:.2f}m")
-        
-        if distance and distance >= MIN_MOVEMENT_DISTANCE and distance > max_distance:
-            heading = calculate_gps_heading(old_pos['lat'], old_pos['lon'],
-                                          current_pos['lat'], current_pos['lon'])
-            if heading is not None:
-                cardinal = get_cardinal_direction(heading)
-                print(f"DEBUG: Valid movement found! Distance: {distance:.2f}m, Heading: {heading:.1f}° ({cardinal})")
-                best_heading = heading
-                max_distance = distance
-    
-    if best_heading is None:
-        print(f"DEBUG: No movement >= {MIN_MOVEMENT_DISTANCE}m detected. Max distance: {max_distance:.2f}m")
-    else:
-        print(f"DEBUG: Final heading: {best_heading:.1f}° ({get_cardinal_direction(best_heading)}) based on {max_distance:.2f}m movement")
-    
-    return best_heading
-    """Calculate compass heading from magnetometer and accelerometer data"""
-    try:
-        import math
-        
-        # Extract values
-        mx, my, mz = magnetometer
-        ax, ay, az = accelerometer
-        
-        # Normalize accelerometer values
-        norm = math.sqrt(ax*ax + ay*ay + az*az)
-        if norm == 0:
-            return None
-        ax, ay, az = ax/norm, ay/norm, az/norm
-        
-        # Calculate roll and pitch from accelerometer
-        roll = math.atan2(ay, az)
-        pitch = math.atan2(-ax, math.sqrt(ay*ay + az*az))
-        
-        # Compensate magnetometer readings for tilt
-        cos_roll = math.cos(roll)
-        sin_roll = math.sin(roll)
-        cos_pitch = math.cos(pitch)
-        sin_pitch = math.sin(pitch)
-        
-        # Tilt compensated magnetic field components
-        mx_comp = mx * cos_pitch + mz * sin_pitch
-        my_comp = mx * sin_roll * sin_pitch + my * cos_roll - mz * sin_roll * cos_pitch
-        
-        # Calculate heading (0-360 degrees)
-        heading = math.atan2(-my_comp, mx_comp) * 180 / math.pi
-        
-        # Normalize to 0-360
-        if heading < 0:
-            heading += 360
-            
-        return heading
-    except Exception as e:
-        print(f"Error calculating compass heading: {e}")
-        return None
+class AdaptiveSampler:
+    """Decides how long to wait for the next fix and whether a fix is worth uploading.
+
+    Moving phones are sampled about every TARGET_FIX_SPACING meters, turns
+    are sampled at the fastest rate, and a phone standing still backs off
+    to MAX_SAMPLE_INTERVAL. Fixes within MIN_MOVEMENT_DISTANCE of the last
+    uploaded one are dropped, apart from a heartbeat every HEARTBEAT_INTERVAL.
+    """
+
+    def __init__(self):
+        self.interval = MIN_SAMPLE_INTERVAL
+        self.last_fix = None
+        self.last_sent = None
+
+    def observe(self, lat, lon, heading, now):
+        """Record a fix; returns True if it should be uploaded"""
+        moved = speed = None
+        if self.last_fix is not None and now > self.last_fix['time']:
+            moved = distance(self.last_fix['lat'], self.last_fix['lon'], lat, lon)
+            speed = moved / (now - self.last_fix['time'])
+
+        turning = (
+            heading is not None and self.last_sent is not None and self.last_sent['heading'] is not None
+            and heading_change(heading, self.last_sent['heading']) >= TURN_ANGLE
+        )
+        if turning:
+            self.interval = MIN_SAMPLE_INTERVAL
+        elif moved is not None and moved >= MIN_MOVEMENT_DISTANCE:
+            self.interval = TARGET_FIX_SPACING / speed
+        elif moved is not None:
+            # Standing still: back off gradually
+            self.interval = self.interval * 2
+        self.interval = max(MIN_SAMPLE_INTERVAL, min(MAX_SAMPLE_INTERVAL, self.interval))
+
+        self.last_fix = {'lat': lat, 'lon': lon, 'time': now}
+        if self.last_sent is not None and not turning:
+            offset = distance(self.last_sent['lat'], self.last_sent['lon'], lat, lon)
+            if offset < MIN_MOVEMENT_DISTANCE and now - self.last_sent['time'] < HEARTBEAT_INTERVAL:
+                return False
+        self.last_sent = {'lat': lat, 'lon': lon, 'time': now, 'heading': heading}
+        return True
 
-def send_location(server_url, phone_id):
-    lat, lon, alt = get_gps_coords()
-    if lat is not None and lon is not None:
+class FixQueue:
+    """Bounded first-in first-out buffer of packed fixes in a file.
+
+    Records use the locator/fixcodec.py layout, so a batch is uploaded by
+    prefixing the header to the stored bytes without decoding anything.
+    """
+
+    def __init__(self, path, max_fixes=MAX_QUEUED_FIXES):
+        self.path = path
+        self.max_fixes = max_fixes
+        # The main loop appends while the uploader peeks and discards
+        self._lock = threading.Lock()
+        self._data = b""
+        # Records ever dropped off the front by a full queue, so discard() skips ones already gone
+        self._dropped = 0
         try:
-            print(f"\nDEBUG: Got GPS coordinates: {lat:.6f}, {lon:.6f}, Alt: {alt}")
-            
-            # Calculate movement-based heading
-            heading = get_movement_heading(lat, lon)
-            
-            payload = {
-                "id": phone_id,
-                "lat": lat,
-                "lng": lon,
-                "alt": alt
-            }
-            
-            # Add heading data if available
-            if heading is not None:
-                cardinal = get_cardinal_direction(heading)
-                payload["heading"] = heading
-                payload["accuracy"] = 10  # GPS-based heading accuracy
-                print(f"DEBUG: Sending heading data: {heading:.1f}° ({cardinal})")
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Drop a record cut short by a crash mid-append
+            self._data = data[:len(data) - len(data) % RECORD.size]
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self._data) // RECORD.size
+
+    def append(self, fix):
+        """Queue one fix; returns False if it can't be packed and was dropped"""
+        try:
+            record = encode_fixes([fix])[HEADER.size:]
+        except ValueError as e:
+            log.error("Dropping fix that can't be queued: %s", e)
+            return False
+        with self._lock:
+            if len(self) >= self.max_fixes:
+                # Full after a long dead zone: keep the most recent fixes
+                drop = len(self) - self.max_fixes + 1
+                log.warning("Fix queue full, dropping %d oldest fix(es)", drop)
+                self._data = self._data[drop * RECORD.size:] + record
+                self._dropped += drop
+                self._rewrite()
+                return True
+            self._data += record
+            with open(self.path, 'ab') as f:
+                f.write(record)
+        return True
+
+    def peek(self, count):
+        """Packed /update_locations body for up to ``count`` of the oldest fixes, and a mark for discard()"""
+        with self._lock:
+            return HEADER.pack(MAGIC, VERSION) + self._data[:count * RECORD.size], self._dropped
+
+    def discard(self, count, mark):
+        """Remove ``count`` fixes returned by the peek() that gave ``mark``.
+
+        Fixes dropped by a full queue since that peek were among them, so
+        only the ones still queued are removed.
+        """
+        with self._lock:
+            count = max(0, count - (self._dropped - mark))
+            self._data = self._data[count * RECORD.size:]
+            self._rewrite()
+
+    def _rewrite(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self._data)
+        os.replace(tmp_path, self.path)
+
+class FixLog:
+    """Append-only packed log of raw fixes; the file is a valid fixcodec batch"""
+
+    def __init__(self, path):
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'ab')
+        if new:
+            self._file.write(HEADER.pack(MAGIC, VERSION))
+
+    def append(self, phone_id, fix):
+        try:
+            record = encode_fixes([{
+                "id": phone_id, "lat": fix["lat"], "lng": fix["lon"], "alt": fix["alt"], "timestamp": fix["timestamp"],
+            }])[HEADER.size:]
+        except ValueError as e:
+            log.error("Not logging fix: %s", e)
+            return
+        self._file.write(record)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class SenderStats:
+    """Counters behind the periodic summary line; each is only written by one thread"""
+
+    def __init__(self):
+        self.sampled = 0
+        self.queued = 0
+        self.skipped = 0
+        self.uploaded = 0
+        self.failed_uploads = 0
+        self._since = time.time()
+
+    def log_if_due(self, queue, sampler, fix_log=None):
+        now = time.time()
+        if now - self._since < LOG_SUMMARY_INTERVAL:
+            return
+        log.info(
+            "%d fix(es) sampled, %d queued, %d inside the dead-band, %d uploaded, %d failed upload(s), "
+            "%d waiting; sampling every %.0fs",
+            self.sampled, self.queued, self.skipped, self.uploaded, self.failed_uploads, len(queue), sampler.interval,
+        )
+        self.sampled = self.queued = self.skipped = self.uploaded = self.failed_uploads = 0
+        self._since = now
+        if fix_log is not None:
+            fix_log.flush()
+
+stats = SenderStats()
+
+# Keep-alive connection reused by every upload
+session = requests.Session()
+
+def flush_queue(batch_url, queue):
+    """Upload queued fixes oldest first; stops at the first failure and keeps the rest"""
+    while len(queue):
+        count = min(BATCH_SIZE, len(queue))
+        body, mark = queue.peek(count)
+        try:
+            response = session.post(batch_url, data=body,
+                                     headers={"Content-Type": CONTENT_TYPE}, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            log.debug("Offline, %d fix(es) queued: %s", len(queue), e)
+            stats.failed_uploads += 1
+            return False
+        if response.status_code == 400:
+            # The server will never accept this batch, so don't retry it forever
+            log.error("Server rejected %d queued fix(es): %s", count, response.text)
+        elif not response.ok:
+            log.debug("Upload failed with status %d, %d fix(es) queued", response.status_code, len(queue))
+            stats.failed_uploads += 1
+            return False
+        else:
+            stats.uploaded += count
+        queue.discard(count, mark)
+        log.debug("Uploaded %d fix(es) - Status: %d", count, response.status_code)
+    return True
+
+class Uploader(threading.Thread):
+    """Consumer: uploads the fix queue in the background, retrying with exponential backoff"""
+
+    def __init__(self, batch_url, queue):
+        super().__init__(name="uploader", daemon=True)
+        self.batch_url = batch_url
+        self.queue = queue
+        self._wake = threading.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def run(self):
+        delay = None
+        while True:
+            if delay is None:
+                self._wake.wait()
             else:
-                print("DEBUG: No heading data to send (building movement history or insufficient movement)")
-            
-            print(f"DEBUG: Payload: {payload}")
-            response = requests.post(server_url, json=payload)
-            
-            if heading is not None:
-                cardinal = get_cardinal_direction(heading)
-                print(f"✓ Sent location for {phone_id}: {lat:.6f}, {lon:.6f}, Alt: {alt}, heading: {heading:.1f}° ({cardinal}) - Status: {response.status_code}")
+                # New fixes don't cut a backoff short; they wait in the queue
+                time.sleep(delay)
+            self._wake.clear()
+            if flush_queue(self.batch_url, self.queue):
+                delay = None
             else:
-                print(f"✓ Sent location for {phone_id}: {lat:.6f}, {lon:.6f}, Alt: {alt} (building movement history) - Status: {response.status_code}")
-                
-        except Exception as e:
-            print("Error sending location:", e)
+                delay = UPLOAD_RETRY_MIN if delay is None else min(delay * 2, UPLOAD_RETRY_MAX)
+                log.debug("Retrying upload in %ss", delay)
+
+def send_location(fix, phone_id, sampler, queue, fix_log=None):
+    """Queue a fix if it is worth uploading; returns True if it was queued.
+
+    Log calls pass their arguments unformatted, so at the default level no
+    per-fix string is ever built.
+    """
+    stats.sampled += 1
+    if fix_log is not None:
+        fix_log.append(phone_id, fix)
+    log.debug("Got GPS coordinates: %.6f, %.6f, Alt: %s, accuracy: %s", fix["lat"], fix["lon"], fix["alt"], fix.get("accuracy"))
+
+    # Jitter is filtered out here, so a phone standing still stays inside the dead-band
+    estimate = position_filter.update(fix["lat"], fix["lon"], fix["timestamp"], accuracy=fix.get("accuracy"))
+    lat, lon, heading = estimate["lat"], estimate["lng"], estimate["heading"]
+    log.debug("Filtered: %.6f, %.6f, speed %.1f m/s, ±%.1f m", lat, lon, estimate["speed"], estimate["accuracy"])
+    if not sampler.observe(lat, lon, heading, fix["timestamp"]):
+        stats.skipped += 1
+        log.debug("Moved less than %sm, not uploading", MIN_MOVEMENT_DISTANCE)
+        return False
+
+    if not queue.append({"id": phone_id, "lat": lat, "lng": lon, "alt": fix["alt"], "heading": heading, "timestamp": fix["timestamp"]}):
+        return False
+    stats.queued += 1
+    if heading is not None and log.isEnabledFor(logging.DEBUG):
+        log.debug("Queued fix with heading %.1f° (%s)", heading, get_cardinal_direction(heading))
+    elif heading is None:
+        log.debug("Queued fix without heading (not moving fast enough to tell direction)")
+    log.debug("Next fix in %.1fs", sampler.interval)
+    return True
 
 if __name__ == "__main__":
     print("GPS Location Sender with Movement Direction")
@@ -291,7 +458,7 @@ if __name__ == "__main__":
         print("Error: Server IP:port is required.")
         sys.exit(1)
     
-    SERVER_URL = f"http://{server_ip_port}/update_location"
+    SERVER_URL = f"http://{server_ip_port}/update_locations"
     
     # Get phone ID, limited to 5 characters
     while True:
@@ -300,6 +467,9 @@ if __name__ == "__main__":
             print("Error: Phone ID cannot be empty.")
         elif len(PHONE_ID) > 5:
             print("Error: Phone ID must be 5 characters or less.")
+        elif len(PHONE_ID.encode("utf-8")) > MAX_ID_BYTES:
+            # Fixes carry the id in MAX_ID_BYTES bytes; emoji and many letters take several each
+            print(f"Error: Phone ID must fit in {MAX_ID_BYTES} bytes; use fewer non-ASCII characters.")
         else:
             break
     
@@ -309,8 +479,8 @@ if __name__ == "__main__":
         test_lat, test_lon, test_alt = get_gps_coords()
         if test_lat is not None and test_lon is not None:
             print(f"✓ GPS test successful! Current location: {test_lat:.6f}, {test_lon:.6f}, Altitude: {test_alt}m")
-            print("Direction will be calculated based on movement between GPS positions.")
-            print(f"Minimum movement distance for direction: {MIN_MOVEMENT_DISTANCE} meters")
+            print("Position and direction are smoothed with a Kalman filter over the GPS fixes.")
+            print(f"Moves under {MIN_MOVEMENT_DISTANCE} meters are not uploaded")
         else:
             print("⚠ GPS test failed. Please check location permissions.")
     except Exception as e:
@@ -322,12 +492,45 @@ if __name__ == "__main__":
     print("Press Ctrl+C to exit")
     print("----------------------------------")
     
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(message)s", datefmt="%H:%M:%S")
+    fix_log = FixLog(FIX_LOG_FILE) if FIX_LOG_FILE else None
+    if fix_log is not None:
+        print(f"Logging raw fixes to {FIX_LOG_FILE}")
+
+    sampler = AdaptiveSampler()
+    pending = FixQueue(QUEUE_FILE)
+    uploader = Uploader(SERVER_URL, pending)
+    uploader.start()
+    if len(pending):
+        print(f"{len(pending)} fix(es) from an earlier run are waiting to be uploaded")
+        uploader.wake()
+
+    # GPS reader -> fixes -> sampler -> disk queue -> uploader; neither side waits for the other
+    fixes = Queue()
+    reader = GpsReader(fixes.put, lambda: sampler.interval)
+    reader.start()
+    print(f"Reading GPS in {reader.mode} mode")
+
     try:
+        last_considered = None
         while True:
-            # Send location data with movement-based heading
-            send_location(SERVER_URL, PHONE_ID)
-            time.sleep(2)  # Send location every 2 seconds
+            stats.log_if_due(pending, sampler, fix_log)
+            try:
+                fix = fixes.get(timeout=LOG_SUMMARY_INTERVAL)
+            except Empty:
+                log.warning("No GPS fix for %ds", LOG_SUMMARY_INTERVAL)
+                continue
+            # A stream reports about once a second; sample faster while moving or turning,
+            # slower while standing still
+            if reader.mode != "poll" and last_considered is not None and fix["timestamp"] - last_considered < sampler.interval:
+                continue
+            last_considered = fix["timestamp"]
+            if send_location(fix, PHONE_ID, sampler, pending, fix_log):
+                uploader.wake()
             
     except KeyboardInterrupt:
+        reader.stop()
+        if fix_log is not None:
+            fix_log.close()
         print("\nGPS location sender stopped")
         sys.exit(0)
@@ -0,0 +1,203 @@
+"""Counters, gauges and histograms served at /metrics in the Prometheus text format.
+
+Metrics live in memory in this process. Modules create theirs on the
+shared REGISTRY when imported. Values that other objects already track
+(phone count, cache hits) are read at scrape time through collectors,
+instead of being copied on every change. With several gunicorn workers,
+each scrape reaches one worker, so scrape them separately (or run one
+worker) when exact totals matter.
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; from a cached load (~1 ms) to a slow routing service (~10 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _labels(self, key, **extra):
+        labels = dict(zip(self.label_names, key))
+        labels.update(extra)
+        return labels
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((self.name + "_bucket", self._labels(key, le=_format_value(bound)), cumulative))
+                samples.append((self.name + "_bucket", self._labels(key, le="+Inf"), count))
+                samples.append((self.name + "_sum", self._labels(key), total))
+                samples.append((self.name + "_count", self._labels(key), count))
+        return samples
+
+
+class Registry:
+    """Metrics of this process, and collectors that report values owned by other objects"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+        self._collector_errors = self.counter(
+            "locator_metrics_collector_errors_total", "Scrapes where a collector raised, by collector", ("collector",),
+        )
+
+    def _add(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Modules imported twice (tests, reloads) get the metric they made the first time
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, collect):
+        """``collect()`` returns (name, kind, help, [(labels, value), ...]) tuples, read at every scrape"""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        # Collectors first, so a failure shows up in this scrape's error count
+        collected = []
+        for collect in collectors:
+            try:
+                # Listed first so a collector failing halfway adds nothing
+                collected.extend([
+                    (name, kind, help_text, [(name, labels, value) for labels, value in values])
+                    for name, kind, help_text, values in collect()
+                ])
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                self._collector_errors.inc(collector=getattr(collect, "__name__", repr(collect)))
+        families = [(m.name, m.kind, m.help, m.samples()) for m in metrics] + collected
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                if value is not None:
+                    lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Reads and writes of the JSON files behind storage, phones and the route cache
+FILE_IO_SECONDS = REGISTRY.histogram(
+    "locator_file_io_seconds", "Time spent reading or writing a data file", ("op", "file"),
+)
+FILE_IO_BYTES = REGISTRY.counter(
+    "locator_file_io_bytes_total", "Bytes read from or written to a data file", ("op", "file"),
+)
+
+
+def record_file_io(op, path, size, seconds):
+    """Account one read or write of ``path``; files are labelled by name, not by directory"""
+    name = os.path.basename(path)
+    FILE_IO_SECONDS.observe(seconds, op=op, file=name)
+    FILE_IO_BYTES.inc(size, op=op, file=name)
@@ -0,0 +1,602 @@
+"""Routing without network access over a road graph imported from OpenStreetMap.
+
+``python offline_router.py import extract.osm offline_graph`` reads an OSM XML
+extract (or .osm.pbf when the optional ``osmium`` package is installed) and
+writes a compact graph to the ``offline_graph`` directory:
+
+- intersections and dead ends become vertices; the nodes in between are kept
+  only as edge shape points
+- edges are stored in CSR form (``offsets``/``targets``) as .npy files that
+  are memory-mapped when the graph is opened
+- every directed edge has a length, a road class and a bit mask of the modes
+  (walking, driving, cycling) allowed to use it in that direction
+
+Queries run A* on travel time. The heuristic is the larger of the
+straight-line time at the mode's top speed and the ALT bound from a few
+landmark vertices whose travel times to and from every vertex are computed
+at import, which keeps the search narrow on grid-like street networks.
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from locator.geodesy import bearing, distances, nearest
+
+FORMAT_VERSION = 1
+
+MODES = ("walking", "driving", "cycling")
+MODE_BITS = {"walking": 1, "driving": 2, "cycling": 4}
+
+# Speeds in km/h per road class; classes missing from a mode are closed to it
+SPEEDS = {
+    "motorway": {"driving": 100},
+    "motorway_link": {"driving": 60},
+    "trunk": {"driving": 80, "cycling": 16},
+    "trunk_link": {"driving": 50, "cycling": 16},
+    "primary": {"driving": 60, "walking": 5, "cycling": 16},
+    "primary_link": {"driving": 40, "walking": 5, "cycling": 16},
+    "secondary": {"driving": 50, "walking": 5, "cycling": 16},
+    "secondary_link": {"driving": 40, "walking": 5, "cycling": 16},
+    "tertiary": {"driving": 40, "walking": 5, "cycling": 16},
+    "tertiary_link": {"driving": 30, "walking": 5, "cycling": 16},
+    "unclassified": {"driving": 30, "walking": 5, "cycling": 16},
+    "residential": {"driving": 25, "walking": 5, "cycling": 16},
+    "living_street": {"driving": 10, "walking": 5, "cycling": 12},
+    "service": {"driving": 15, "walking": 5, "cycling": 14},
+    "road": {"driving": 30, "walking": 5, "cycling": 14},
+    "track": {"driving": 15, "walking": 5, "cycling": 12},
+    "pedestrian": {"walking": 5, "cycling": 8},
+    "footway": {"walking": 5, "cycling": 8},
+    "path": {"walking": 4.5, "cycling": 12},
+    "cycleway": {"walking": 5, "cycling": 18},
+    "bridleway": {"walking": 4.5},
+    "steps": {"walking": 3},
+}
+ROAD_CLASSES = list(SPEEDS)
+LANDMARKS = 8
+
+# Access tags that open or close a way to each mode, most specific last
+ACCESS_TAGS = {
+    "walking": ("access", "foot"),
+    "driving": ("access", "vehicle", "motor_vehicle", "motorcar"),
+    "cycling": ("access", "vehicle", "bicycle"),
+}
+OPEN_VALUES = {"yes", "designated", "permissive", "destination", "official"}
+CLOSED_VALUES = {"no", "private"}
+
+
+def _access(tags, road_class):
+    """Bit mask of modes allowed on a way, before oneway rules"""
+    mask = 0
+    for mode in MODES:
+        allowed = mode in SPEEDS[road_class]
+        for tag in ACCESS_TAGS[mode]:
+            value = tags.get(tag)
+            if value in OPEN_VALUES:
+                allowed = True
+            elif value in CLOSED_VALUES:
+                allowed = False
+        if allowed:
+            mask |= MODE_BITS[mode]
+    return mask
+
+
+def _directions(tags, mask):
+    """(forward mask, backward mask) after applying oneway rules"""
+    oneway = tags.get("oneway")
+    if oneway is None and (tags.get("junction") == "roundabout" or tags.get("highway") == "motorway"):
+        oneway = "yes"
+    if oneway not in ("yes", "1", "true", "-1"):
+        return mask, mask
+    # Oneway applies to vehicles; cyclists are exempt where tagged so
+    restricted = MODE_BITS["driving"]
+    if tags.get("oneway:bicycle") != "no":
+        restricted |= MODE_BITS["cycling"]
+    if oneway == "-1":
+        return mask & ~restricted, mask
+    return mask, mask & ~restricted
+
+
+def edge_costs(length, road_class, mode_mask, road_classes, mode):
+    """Travel time in seconds along each edge for ``mode``; inf where the mode may not use it"""
+    speeds = np.array([SPEEDS.get(c, {}).get(mode, 0.0) for c in road_classes]) / 3.6
+    speed = speeds[np.asarray(road_class)]
+    allowed = ((np.asarray(mode_mask) & MODE_BITS[mode]) != 0) & (speed > 0)
+    cost = np.full(len(speed), np.inf)
+    cost[allowed] = np.asarray(length)[allowed] / speed[allowed]
+    return cost
+
+
+def usable_vertices(offsets, targets, cost):
+    """Vertices with at least one edge the mode can use, in either direction"""
+    sources = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    allowed = np.isfinite(cost)
+    usable = np.zeros(len(offsets) - 1, dtype=bool)
+    usable[sources[allowed]] = True
+    usable[np.asarray(targets)[allowed]] = True
+    return usable
+
+
+def _dijkstra(offsets, targets, cost, source):
+    """Travel time from ``source`` to every vertex over list-based CSR arrays"""
+    distance = [math.inf] * (len(offsets) - 1)
+    distance[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        d, v = heapq.heappop(heap)
+        if d > distance[v]:
+            continue
+        for e in range(offsets[v], offsets[v + 1]):
+            total = d + cost[e]
+            w = targets[e]
+            if total < distance[w]:
+                distance[w] = total
+                heapq.heappush(heap, (total, w))
+    return distance
+
+
+def _choose_landmarks(lats, lngs, usable, count):
+    """The usable vertex farthest from the center in each of ``count`` equal compass sectors"""
+    candidates = np.flatnonzero(usable)
+    if not len(candidates):
+        return []
+    lat0, lng0 = float(np.mean(lats[candidates])), float(np.mean(lngs[candidates]))
+    dx = (lngs[candidates] - lng0) * math.cos(math.radians(lat0))
+    dy = lats[candidates] - lat0
+    sector = ((np.arctan2(dy, dx) + math.pi) / (2 * math.pi) * count).astype(int) % count
+    reach = dx * dx + dy * dy
+    landmarks = []
+    for k in range(count):
+        members = np.flatnonzero(sector == k)
+        if len(members):
+            landmarks.append(int(candidates[members[np.argmax(reach[members])]]))
+    return landmarks
+
+
+def build_landmarks(arrays, road_classes, count=LANDMARKS):
+    """Per mode, travel times from each landmark to every vertex and from every vertex back"""
+    offsets = arrays["offsets"]
+    n = len(offsets) - 1
+    # The reverse graph gives times *to* a landmark with the same forward search
+    sources = np.repeat(np.arange(n), np.diff(offsets))
+    reverse_order = np.argsort(arrays["targets"], kind="stable")
+    reverse_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(arrays["targets"], minlength=n), out=reverse_offsets[1:])
+    forward_lists = (offsets.tolist(), arrays["targets"].tolist())
+    reverse_lists = (reverse_offsets.tolist(), sources[reverse_order].tolist())
+
+    landmarks = {}
+    for mode in MODES:
+        cost = edge_costs(arrays["length"], arrays["road_class"], arrays["mode_mask"], road_classes, mode)
+        chosen = _choose_landmarks(arrays["node_lat"], arrays["node_lng"], usable_vertices(offsets, arrays["targets"], cost), count)
+        cost_list = cost.tolist()
+        reverse_cost = cost[reverse_order].tolist()
+        landmarks[f"landmarks_{mode}_from"] = np.array(
+            [_dijkstra(*forward_lists, cost_list, v) for v in chosen], dtype=np.float32).reshape(len(chosen), n)
+        landmarks[f"landmarks_{mode}_to"] = np.array(
+            [_dijkstra(*reverse_lists, reverse_cost, v) for v in chosen], dtype=np.float32).reshape(len(chosen), n)
+    return landmarks
+
+
+# ------------------------------------------------------------------ import
+
+def read_osm_xml(path):
+    """Yield ("node", id, lat, lng) and ("way", tags, node ids) from an OSM XML file"""
+    tags = {}
+    refs = []
+    root = None
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        if root is None:
+            root = element
+        if event == "start":
+            continue
+        if element.tag == "tag":
+            tags[element.get("k")] = element.get("v")
+        elif element.tag == "nd":
+            refs.append(int(element.get("ref")))
+        elif element.tag in ("node", "way", "relation"):
+            if element.tag == "node":
+                yield "node", int(element.get("id")), float(element.get("lat")), float(element.get("lon"))
+            elif element.tag == "way" and "highway" in tags:
+                yield "way", tags, refs
+            tags, refs = {}, []
+            # Drop finished elements so memory stays flat on large extracts
+            root.clear()
+
+
+def read_osm_pbf(path):
+    """Same records as ``read_osm_xml`` from a .osm.pbf file (requires osmium)"""
+    try:
+        import osmium
+    except ImportError:
+        raise SystemExit("Reading .pbf extracts requires the osmium package (pip install osmium)")
+
+    records = []
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            records.append(("node", n.id, n.location.lat, n.location.lon))
+
+        def way(self, w):
+            if "highway" in w.tags:
+                records.append(("way", {t.k: t.v for t in w.tags}, [n.ref for n in w.nodes]))
+
+    Handler().apply_file(path)
+    return records
+
+
+def import_osm(source, output_dir):
+    """Build the routing graph for an OSM extract and write it to ``output_dir``"""
+    started = time.time()
+    records = read_osm_pbf(source) if source.endswith(".pbf") else read_osm_xml(source)
+
+    node_ids, node_lats, node_lngs = [], [], []
+    ways = []
+    for record in records:
+        if record[0] == "node":
+            node_ids.append(record[1])
+            node_lats.append(record[2])
+            node_lngs.append(record[3])
+        else:
+            _, tags, refs = record
+            road_class = tags.get("highway")
+            if road_class not in SPEEDS or len(refs) < 2:
+                continue
+            mask = _access(tags, road_class)
+            forward, backward = _directions(tags, mask)
+            if forward or backward:
+                ways.append((refs, ROAD_CLASSES.index(road_class), tags.get("name") or tags.get("ref") or "", forward, backward))
+
+    # Look node coordinates up by OSM id without a dict of millions of entries
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    order = np.argsort(node_ids)
+    node_ids = node_ids[order]
+    node_lats = np.asarray(node_lats, dtype=np.float64)[order]
+    node_lngs = np.asarray(node_lngs, dtype=np.float64)[order]
+
+    def locate(refs):
+        refs = np.asarray(refs, dtype=np.int64)
+        index = np.searchsorted(node_ids, refs)
+        index[index >= len(node_ids)] = 0
+        found = node_ids[index] == refs
+        return index, found
+
+    # A node shared by two ways, or ending one, is an intersection and becomes a vertex
+    usage = {}
+    resolved = []
+    for refs, road_class, name, forward, backward in ways:
+        index, found = locate(refs)
+        index = index[found]
+        if len(index) < 2:
+            continue
+        resolved.append((index, road_class, name, forward, backward))
+        for position, node in enumerate(index.tolist()):
+            end = position == 0 or position == len(index) - 1
+            usage[node] = usage.get(node, 0) + (2 if end else 1)
+
+    vertex_of = {}
+    names = [""]
+    name_index = {"": 0}
+    sources, targets, lengths, classes, masks, name_ids, shape_offsets = [], [], [], [], [], [], [0]
+    shape_lat, shape_lng = [], []
+
+    def vertex(node):
+        if node not in vertex_of:
+            vertex_of[node] = len(vertex_of)
+        return vertex_of[node]
+
+    def add_edge(u, v, length, road_class, mask, name_id, shape):
+        sources.append(u)
+        targets.append(v)
+        lengths.append(length)
+        classes.append(road_class)
+        masks.append(mask)
+        name_ids.append(name_id)
+        shape_lat.extend(node_lats[shape].tolist())
+        shape_lng.extend(node_lngs[shape].tolist())
+        shape_offsets.append(len(shape_lat))
+
+    for index, road_class, name, forward, backward in resolved:
+        if name not in name_index:
+            name_index[name] = len(names)
+            names.append(name)
+        name_id = name_index[name]
+        lats, lngs = node_lats[index], node_lngs[index]
+        step = distances(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+        cumulative = np.concatenate(([0.0], np.cumsum(step)))
+
+        start = 0
+        for position in range(1, len(index)):
+            node = int(index[position])
+            if position != len(index) - 1 and usage[node] < 2:
+                continue
+            u, v = vertex(int(index[start])), vertex(node)
+            length = float(cumulative[position] - cumulative[start])
+            inner = index[start + 1:position]
+            if forward and u != v:
+                add_edge(u, v, length, road_class, forward, name_id, inner)
+            if backward and u != v:
+                add_edge(v, u, length, road_class, backward, name_id, inner[::-1])
+            start = position
+
+    vertices = np.empty(len(vertex_of), dtype=np.int64)
+    for node, v in vertex_of.items():
+        vertices[v] = node
+
+    # CSR: edges sorted by source vertex, offsets[v]:offsets[v + 1] are v's edges
+    sources = np.asarray(sources, dtype=np.int32)
+    order = np.argsort(sources, kind="stable")
+    offsets = np.zeros(len(vertices) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(vertices)), out=offsets[1:])
+    shape_offsets = np.asarray(shape_offsets, dtype=np.int64)
+
+    os.makedirs(output_dir, exist_ok=True)
+    arrays = {
+        "node_lat": node_lats[vertices],
+        "node_lng": node_lngs[vertices],
+        "offsets": offsets,
+        "targets": np.asarray(targets, dtype=np.int32)[order],
+        "length": np.asarray(lengths, dtype=np.float32)[order],
+        "road_class": np.asarray(classes, dtype=np.uint8)[order],
+        "mode_mask": np.asarray(masks, dtype=np.uint8)[order],
+        "name_id": np.asarray(name_ids, dtype=np.int32)[order],
+        "shape_start": shape_offsets[:-1][order],
+        "shape_end": shape_offsets[1:][order],
+        "shape_lat": np.asarray(shape_lat, dtype=np.float64),
+        "shape_lng": np.asarray(shape_lng, dtype=np.float64),
+    }
+    arrays.update(build_landmarks(arrays, ROAD_CLASSES))
+    for name, array in arrays.items():
+        np.save(os.path.join(output_dir, name + ".npy"), array)
+    meta = {
+        "version": FORMAT_VERSION,
+        "source": os.path.basename(source),
+        "vertices": len(vertices),
+        "edges": len(targets),
+        "road_classes": ROAD_CLASSES,
+        "landmarks": LANDMARKS,
+        "names": names,
+        "imported": time.time(),
+    }
+    with open(os.path.join(output_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    print(f"Imported {len(vertices)} vertices and {len(targets)} edges in {time.time() - started:.1f}s")
+    return meta
+
+
+# ------------------------------------------------------------------ routing
+
+class OfflineRouter:
+    """A* over a graph written by ``import_osm``; the arrays stay memory-mapped"""
+
+    def __init__(self, directory, max_snap_distance=2000.0):
+        self.directory = directory
+        self.max_snap_distance = max_snap_distance
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{directory} was built by a different version of offline_router.py")
+        self.names = self.meta["names"]
+        self.road_classes = self.meta["road_classes"]
+        for name in ("node_lat", "node_lng", "offsets", "targets", "length", "road_class", "mode_mask",
+                     "name_id", "shape_start", "shape_end", "shape_lat", "shape_lng"):
+            setattr(self, name, np.load(os.path.join(directory, name + ".npy"), mmap_mode="r"))
+        self.landmarks = {}
+        for mode in MODES:
+            paths = [os.path.join(directory, f"landmarks_{mode}_{side}.npy") for side in ("from", "to")]
+            if all(os.path.exists(path) for path in paths):
+                self.landmarks[mode] = tuple(np.load(path, mmap_mode="r") for path in paths)
+        self._adjacency = None
+        self._mode_data = {}
+
+    @classmethod
+    def open(cls, directory, **kwargs):
+        """The router for ``directory``, or None when no graph has been imported there"""
+        if not directory or not os.path.exists(os.path.join(directory, "meta.json")):
+            return None
+        return cls(directory, **kwargs)
+
+    def _graph(self, mode):
+        """Per-mode edge costs and vertex mask, built on first use.
+
+        The search loop reads Python lists because indexing a NumPy array
+        one scalar at a time costs several times more than a list lookup.
+        """
+        if self._adjacency is None:
+            self._adjacency = (self.offsets.tolist(), self.targets.tolist())
+        if mode not in self._mode_data:
+            cost = edge_costs(self.length, self.road_class, self.mode_mask, self.road_classes, mode)
+            top_speed = max(SPEEDS.get(c, {}).get(mode, 0.0) for c in self.road_classes) / 3.6
+            self._mode_data[mode] = (cost.tolist(), usable_vertices(self.offsets, self.targets, cost), top_speed)
+        return self._adjacency, self._mode_data[mode]
+
+    def _heuristic(self, mode, goal, top_speed):
+        """Lower bound on the travel time from every vertex to ``goal``, as a list"""
+        bound = distances(self.node_lat, self.node_lng, self.node_lat[goal], self.node_lng[goal]) / top_speed
+        if mode in self.landmarks:
+            from_landmark, to_landmark = self.landmarks[mode]
+            # Triangle inequality both ways round each landmark; inf - inf gives NaN, which fmax skips
+            with np.errstate(invalid="ignore"):
+                ahead = np.fmax.reduce(from_landmark[:, goal:goal + 1] - from_landmark, axis=0)
+                behind = np.fmax.reduce(to_landmark - to_landmark[:, goal:goal + 1], axis=0)
+            bound = np.fmax(bound, np.fmax(ahead, behind))
+        return bound.tolist()
+
+    def nearest_vertex(self, lat, lng, usable):
+        candidates = np.flatnonzero(usable)
+        if not len(candidates):
+            return None, math.inf
+        best, gap = nearest(lat, lng, self.node_lat[candidates], self.node_lng[candidates])
+        return int(candidates[best]), gap
+
+    def route(self, start_lat, start_lng, end_lat, end_lng, mode="walking"):
+        """Return a GeoJSON FeatureCollection shaped like the online services' routes, or None"""
+        if mode not in MODE_BITS:
+            mode = "walking"
+        (offsets, targets), (cost, usable, top_speed) = self._graph(mode)
+        source, source_gap = self.nearest_vertex(start_lat, start_lng, usable)
+        goal, goal_gap = self.nearest_vertex(end_lat, end_lng, usable)
+        if source is None or max(source_gap, goal_gap) > self.max_snap_distance:
+            return None
+
+        estimate = self._heuristic(mode, goal, top_speed)
+        edges = self._search(source, goal, offsets, targets, cost, estimate)
+        if edges is None:
+            return None
+        return self._feature_collection(edges, source, (start_lat, start_lng), (end_lat, end_lng), mode, cost)
+
+    def _search(self, source, goal, offsets, targets, cost, estimate):
+        best = {source: 0.0}
+        via = {source: -1}
+        # Ties on the estimate go to the entry that has travelled furthest, which keeps
+        # the search from fanning out across equally good blocks of a street grid
+        heap = [(estimate[source], -0.0, source)]
+        done = set()
+        while heap:
+            _, spent, v = heapq.heappop(heap)
+            spent = -spent
+            if v == goal:
+                break
+            if v in done:
+                continue
+            done.add(v)
+            for e in range(offsets[v], offsets[v + 1]):
+                c = cost[e]
+                w = targets[e]
+                total = spent + c
+                if total < best.get(w, math.inf) and estimate[w] != math.inf:
+                    best[w] = total
+                    via[w] = e
+                    heapq.heappush(heap, (total + estimate[w], -total, w))
+        else:
+            return None
+
+        edges = []
+        v = goal
+        while via[v] != -1:
+            e = via[v]
+            edges.append(e)
+            v = self._source_of(e)
+        edges.reverse()
+        return edges
+
+    def _source_of(self, edge):
+        return int(np.searchsorted(self.offsets, edge, side="right")) - 1
+
+    def _feature_collection(self, edges, source, start, end, mode, cost):
+        coordinates = [[float(self.node_lng[source]), float(self.node_lat[source])]]
+        steps = []
+        distance = duration = 0.0
+        for e in edges:
+            shape = slice(int(self.shape_start[e]), int(self.shape_end[e]))
+            target = int(self.targets[e])
+            edge_coordinates = [[lng, lat] for lat, lng in zip(self.shape_lat[shape].tolist(), self.shape_lng[shape].tolist())]
+            edge_coordinates.append([float(self.node_lng[target]), float(self.node_lat[target])])
+            length = float(self.length[e])
+            name = self.names[int(self.name_id[e])]
+
+            if not steps or steps[-1]["name"] != name:
+                steps.append(_step(name, coordinates[-1], coordinates[-2] if len(coordinates) > 1 else None,
+                                   edge_coordinates[0], first=not steps))
+            steps[-1]["distance"] += length
+            steps[-1]["duration"] += cost[e]
+            coordinates.extend(edge_coordinates)
+            distance += length
+            duration += cost[e]
+
+        # Join the requested points to the graph so the line starts and ends where asked
+        coordinates.insert(0, [start[1], start[0]])
+        coordinates.append([end[1], end[0]])
+        steps.append({
+            "distance": 0.0,
+            "duration": 0.0,
+            "name": "",
+            "maneuver": {"type": "arrive", "location": coordinates[-1], "instruction": "Arrive at your destination"},
+        })
+        for step in steps:
+            step["distance"] = round(step["distance"], 1)
+            step["duration"] = round(step["duration"], 1)
+
+        return {
+            "type": "FeatureCollection",
+            "features": [{
+                "type": "Feature",
+                "geometry": {"type": "LineString", "coordinates": coordinates},
+                "properties": {
+                    "distance": round(distance, 1),
+                    "duration": round(duration, 1),
+                    "steps": steps,
+                    "mode": mode,
+                    "service": "offline",
+                },
+            }],
+        }
+
+
+def _step(name, location, previous, following, first):
+    road = name or "the road"
+    after = bearing(location[1], location[0], following[1], following[0])
+    if first or previous is None:
+        compass = ("north", "northeast", "east", "southeast", "south", "southwest", "west", "northwest")[int((after + 22.5) // 45) % 8]
+        maneuver = {"type": "depart", "instruction": f"Head {compass} on {road}"}
+    else:
+        turn = (after - bearing(previous[1], previous[0], location[1], location[0]) + 540) % 360 - 180
+        if abs(turn) < 20:
+            modifier, instruction = "straight", f"Continue onto {road}"
+        elif abs(turn) > 150:
+            modifier, instruction = "uturn", f"Make a U-turn onto {road}"
+        else:
+            side = "right" if turn > 0 else "left"
+            modifier = f"slight {side}" if abs(turn) < 60 else side
+            instruction = f"Turn {modifier} onto {road}"
+        maneuver = {"type": "turn", "modifier": modifier, "instruction": instruction}
+    maneuver["location"] = location
+    maneuver["bearing_after"] = round(after)
+    return {"distance": 0.0, "duration": 0.0, "name": name, "maneuver": maneuver}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline OSM routing for the locator map server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="build a routing graph from an .osm or .osm.pbf extract")
+    importer.add_argument("source")
+    importer.add_argument("output", nargs="?", default="offline_graph")
+    query = commands.add_parser("route", help="route between two lat,lng points")
+    query.add_argument("start")
+    query.add_argument("end")
+    query.add_argument("--graph", default="offline_graph")
+    query.add_argument("--mode", choices=MODES, default="walking")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        import_osm(args.source, args.output)
+        return 0
+
+    router = OfflineRouter.open(args.graph)
+    if router is None:
+        print(f"No graph in {args.graph}; run the import command first")
+        return 1
+    start = [float(v) for v in args.start.split(",")]
+    end = [float(v) for v in args.end.split(",")]
+    started = time.perf_counter()
+    route = router.route(start[0], start[1], end[0], end[1], args.mode)
+    elapsed = (time.perf_counter() - started) * 1000
+    if route is None:
+        print("No route found")
+        return 1
+    properties = route["features"][0]["properties"]
+    print(f"{properties['distance']:.0f} m, {properties['duration'] / 60:.1f} min ({elapsed:.1f} ms)")
+    for step in properties["steps"]:
+        print(f"  {step['maneuver']['instruction']} ({step['distance']:.0f} m)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+from locking import atomic_write
+from metrics import record_file_io
+
+
+class PhoneStore:
+    """Process-resident phone registry backed by a write-ahead log and periodic snapshots.
+
+    Updates only touch the in-memory dict under a lock and queue a small log
+    record. A background thread appends queued records to the WAL file every
+    ``wal_interval`` seconds and rewrites the full snapshot every
+    ``snapshot_interval`` seconds, after which the WAL is truncated.
+
+    With a ``shared_table`` (phone_table.SharedPhoneTable) the registry lives
+    in a memory-mapped file that every worker process reads and writes
+    instead. The table file itself survives a process crash, so no WAL is
+    kept; whichever process is due writes the JSON snapshot.
+    """
+
+    def __init__(self, snapshot_file, wal_file=None, wal_interval=1.0, snapshot_interval=30.0, shared_table=None):
+        self.snapshot_file = snapshot_file
+        self.wal_file = wal_file or snapshot_file + ".wal"
+        self.wal_interval = wal_interval
+        self.snapshot_interval = snapshot_interval
+
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._phones = {}
+        self._version = 0
+        self._pending = []
+        self._dirty = False
+        self._last_snapshot = time.time()
+        self._stop = threading.Event()
+        self._table = shared_table
+
+        if shared_table is None:
+            self._recover()
+        else:
+            # The first process to open the table fills it from the snapshot and WAL
+            shared_table.open(self._recovered_phones)
+            self._phones = None
+
+        self._thread = threading.Thread(target=self._run, name="phone-store-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ----------------------------------------------------------------- reads
+
+    def all(self):
+        """Return a copy of every phone record"""
+        if self._table is not None:
+            return self._table.all()
+        with self._lock:
+            return {phone_id: dict(data) for phone_id, data in self._phones.items()}
+
+    def get(self, phone_id):
+        if self._table is not None:
+            return self._table.get(phone_id)
+        with self._lock:
+            data = self._phones.get(phone_id)
+            return dict(data) if data is not None else None
+
+    def revision(self):
+        """Counter bumped by every change, used to tag cached responses"""
+        if self._table is not None:
+            return self._table.revision()
+        with self._lock:
+            return self._version
+
+    def __len__(self):
+        return len(self.all())
+
+    def _write_lock(self):
+        return self._table.lock if self._table is not None else self._lock
+
+    def _current(self, phone_id):
+        if self._table is not None:
+            return self._table.get(phone_id) or {}
+        return self._phones.get(phone_id, {})
+
+    def _commit(self, changed, skip_invalid=False):
+        """Store changed records and log them; the caller holds the write lock"""
+        if self._table is not None:
+            for phone_id, data in list(changed.items()):
+                try:
+                    self._table.set(phone_id, data)
+                except ValueError as e:
+                    if not skip_invalid:
+                        raise
+                    print(f"Dropping fix for {phone_id}: {e}")
+                    del changed[phone_id]
+            self._table.bump_revision()
+            return
+        self._phones.update(changed)
+        self._version += 1
+        # One log record per phone, not per fix
+        self._pending.extend({"op": "set", "id": phone_id, "data": data} for phone_id, data in changed.items())
+        self._dirty = True
+
+    # ---------------------------------------------------------------- writes
+
+    def update(self, phone_id, lat, lng, alt=None, heading=None, timestamp=None):
+        """Record a new fix for one phone, keeping the last known heading if none is given"""
+        phone_id = str(phone_id)
+        with self._write_lock():
+            phone_data = dict(self._current(phone_id))
+            phone_data["lat"] = lat
+            phone_data["lng"] = lng
+            phone_data["alt"] = alt
+            if heading is not None:
+                phone_data["heading"] = heading
+            phone_data["timestamp"] = timestamp if timestamp is not None else time.time()
+            self._commit({phone_id: phone_data})
+            return dict(phone_data)
+
+    def update_many(self, fixes):
+        """Apply a batch of normalised fixes under one lock.
+
+        Fixes are applied in timestamp order and anything older than the
+        phone's current position is ignored, so late-arriving buffered fixes
+        never move a marker backwards. Returns the new record of every phone
+        that changed.
+        """
+        changed = {}
+        with self._write_lock():
+            for fix in sorted(fixes, key=lambda f: f["timestamp"]):
+                phone_id = fix["id"]
+                current = changed.get(phone_id) or self._current(phone_id)
+                if current.get("timestamp", 0) > fix["timestamp"]:
+                    continue
+                phone_data = dict(current)
+                phone_data["lat"] = fix["lat"]
+                phone_data["lng"] = fix["lng"]
+                phone_data["alt"] = fix.get("alt")
+                if fix.get("heading") is not None:
+                    phone_data["heading"] = fix["heading"]
+                phone_data["timestamp"] = fix["timestamp"]
+                changed[phone_id] = phone_data
+
+            if changed:
+                self._commit(changed, skip_invalid=True)
+        return {phone_id: dict(data) for phone_id, data in changed.items()}
+
+    def replace_all(self, phones):
+        """Replace the whole registry (used by /save_phones when devices are removed)"""
+        phones = {str(phone_id): dict(data) for phone_id, data in (phones or {}).items()}
+        if self._table is not None:
+            with self._table.lock:
+                self._table.replace_all(phones)
+                self._table.bump_revision()
+            return
+        with self._lock:
+            self._phones = phones
+            self._version += 1
+            self._pending.append({"op": "replace", "phones": phones})
+            self._dirty = True
+
+    # ----------------------------------------------------------- persistence
+
+    def flush(self, snapshot=False):
+        """Append pending records to the WAL, or write a full snapshot and truncate the WAL"""
+        if self._table is not None:
+            self._flush_table(snapshot)
+            return
+        with self._io_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = []
+                dirty = self._dirty
+                if snapshot:
+                    phones = {phone_id: dict(data) for phone_id, data in self._phones.items()}
+                    self._dirty = False
+
+            if snapshot:
+                if dirty:
+                    try:
+                        self._write_snapshot(phones)
+                    except OSError:
+                        with self._lock:
+                            self._dirty = True
+                        raise
+                self._last_snapshot = time.time()
+            elif pending:
+                started = time.perf_counter()
+                lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in pending)
+                with open(self.wal_file, "a") as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                record_file_io("append", self.wal_file, len(lines.encode()), time.perf_counter() - started)
+
+    def _flush_table(self, snapshot):
+        self._table.flush()
+        if not snapshot:
+            return
+        with self._table.lock:
+            revision = self._table.revision()
+            # Another worker may already have written this revision
+            if revision != self._table.snapshot_revision():
+                self._write_snapshot(self._table.all())
+                self._table.set_snapshot_revision(revision)
+        self._last_snapshot = time.time()
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.flush(snapshot=True)
+
+    def _run(self):
+        while not self._stop.wait(self.wal_interval):
+            try:
+                due = time.time() - self._last_snapshot >= self.snapshot_interval
+                self.flush(snapshot=due)
+            except OSError as e:
+                print(f"Phone store flush failed: {e}")
+
+    def _write_snapshot(self, phones):
+        atomic_write(self.snapshot_file, json.dumps(phones))
+        # Everything in the WAL is now covered by the snapshot
+        open(self.wal_file, "w").close()
+
+    def _recovered_phones(self):
+        self._recover()
+        return self._phones
+
+    def _recover(self):
+        phones = {}
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r") as f:
+                try:
+                    phones = json.load(f)
+                except json.JSONDecodeError:
+                    print(f"Phone snapshot {self.snapshot_file} is corrupt, rebuilding from WAL")
+                    phones = {}
+
+        replayed = 0
+        if os.path.exists(self.wal_file):
+            with open(self.wal_file, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from a crash mid-append
+                        continue
+                    if record.get("op") == "set":
+                        phones[record["id"]] = record["data"]
+                    elif record.get("op") == "replace":
+                        phones = record["phones"]
+                    replayed += 1
+
+        self._phones = phones
+        if replayed:
+            self._write_snapshot(phones)
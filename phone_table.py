@@ -0,0 +1,183 @@
+import math
+import mmap
+import struct
+import time
+
+from locking import FileLock
+
+MAGIC = b"LPT1"
+# magic | slot count | reserved (8 bytes) | revision | revision last written to the JSON snapshot
+HEADER = struct.Struct("<4sI8xQQ")
+# seq | reserved | id (UTF-8, NUL padded) | lat | lng | alt | heading | timestamp
+SLOT = struct.Struct("<I4x32s5d")
+SEQ = struct.Struct("<I")
+REVISION = struct.Struct("<Q")
+REVISION_OFFSET = 16
+SNAPSHOT_OFFSET = 24
+MAX_ID_BYTES = 32
+
+
+class SharedPhoneTable:
+    """Fixed-slot phone table in a memory-mapped file shared by every worker process.
+
+    Readers never lock or do I/O: each slot carries a sequence number that
+    is odd while a writer is mid-update, and a reader that sees it odd or
+    changed retries. Writers serialise on a cross-process file lock.
+    """
+
+    def __init__(self, path, slots=1024):
+        self.path = path
+        self.slots = slots
+        self.lock = FileLock(path + ".lock")
+        self._mmap = None
+        self._slot_of = {}
+
+    def open(self, load_phones):
+        """Map the table, first creating it from ``load_phones()`` if no process has finished doing so.
+
+        Laying out, filling and marking the table happen in one hold of the
+        file lock, so a process starting meanwhile waits for the table
+        instead of finding it half built and laying it out again.
+        """
+        with self.lock:
+            open(self.path, "ab").close()
+            with open(self.path, "r+b") as f:
+                header = f.read(HEADER.size)
+                if len(header) == HEADER.size and header[:4] == MAGIC:
+                    self.slots = HEADER.unpack(header)[1]
+                    self._mmap = mmap.mmap(f.fileno(), 0)
+                    return
+                # New, or a crash before it was finished: lay out empty slots, magic last
+                f.truncate(0)
+                f.truncate(HEADER.size + self.slots * SLOT.size)
+                f.seek(0)
+                f.write(HEADER.pack(b"\0" * 4, self.slots, 0, 0))
+                f.flush()
+                self._mmap = mmap.mmap(f.fileno(), 0)
+            self.replace_all(load_phones())
+            self._mmap.flush()
+            self._mmap[:4] = MAGIC
+
+    # ----------------------------------------------------------------- reads
+
+    def revision(self):
+        return REVISION.unpack_from(self._mmap, REVISION_OFFSET)[0]
+
+    def snapshot_revision(self):
+        return REVISION.unpack_from(self._mmap, SNAPSHOT_OFFSET)[0]
+
+    def _offset(self, slot):
+        return HEADER.size + slot * SLOT.size
+
+    def _read_slot(self, slot):
+        offset = self._offset(slot)
+        while True:
+            seq, raw_id, lat, lng, alt, heading, timestamp = SLOT.unpack_from(self._mmap, offset)
+            if seq % 2 == 0 and SEQ.unpack_from(self._mmap, offset)[0] == seq:
+                break
+            time.sleep(0)
+        phone_id = raw_id.rstrip(b"\0").decode("utf-8", "replace")
+        if not phone_id:
+            return None, None
+        data = {
+            "lat": lat,
+            "lng": lng,
+            "alt": None if math.isnan(alt) else alt,
+            "timestamp": None if math.isnan(timestamp) else timestamp,
+        }
+        if not math.isnan(heading):
+            data["heading"] = heading
+        return phone_id, data
+
+    def all(self):
+        phones = {}
+        for slot in range(self.slots):
+            phone_id, data = self._read_slot(slot)
+            if phone_id is not None:
+                phones[phone_id] = data
+        return phones
+
+    def get(self, phone_id):
+        slot = self._find(phone_id)
+        if slot is None:
+            return None
+        found_id, data = self._read_slot(slot)
+        return data if found_id == phone_id else None
+
+    def _find(self, phone_id):
+        slot = self._slot_of.get(phone_id)
+        if slot is not None and self._slot_id(slot) == phone_id:
+            return slot
+        # Another process may have added, moved or removed it
+        self._slot_of = {}
+        for slot in range(self.slots):
+            slot_id = self._slot_id(slot)
+            if slot_id:
+                self._slot_of[slot_id] = slot
+        return self._slot_of.get(phone_id)
+
+    def _slot_id(self, slot):
+        offset = self._offset(slot) + 8
+        return bytes(self._mmap[offset:offset + MAX_ID_BYTES]).rstrip(b"\0").decode("utf-8", "replace")
+
+    # ---------------------------------------------------------------- writes
+    # Callers hold ``self.lock``.
+
+    def set(self, phone_id, data):
+        encoded = phone_id.encode("utf-8")
+        if len(encoded) > MAX_ID_BYTES:
+            raise ValueError(f"Phone id {phone_id!r} is longer than {MAX_ID_BYTES} bytes")
+        slot = self._find(phone_id)
+        if slot is None:
+            slot = self._free_slot()
+        self._write_slot(slot, encoded, data)
+        self._slot_of[phone_id] = slot
+
+    def replace_all(self, phones):
+        for phone_id in phones:
+            if len(phone_id.encode("utf-8")) > MAX_ID_BYTES:
+                raise ValueError(f"Phone id {phone_id!r} is longer than {MAX_ID_BYTES} bytes")
+        if len(phones) > self.slots:
+            raise ValueError(f"The phone table only has {self.slots} slots")
+        for slot in range(self.slots):
+            self._write_slot(slot, b"", {})
+        self._slot_of = {}
+        for slot, (phone_id, data) in enumerate(phones.items()):
+            self._write_slot(slot, phone_id.encode("utf-8"), data)
+            self._slot_of[phone_id] = slot
+
+    def bump_revision(self):
+        revision = self.revision() + 1
+        REVISION.pack_into(self._mmap, REVISION_OFFSET, revision)
+        return revision
+
+    def set_snapshot_revision(self, revision):
+        REVISION.pack_into(self._mmap, SNAPSHOT_OFFSET, revision)
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        self._mmap.close()
+
+    def _free_slot(self):
+        for slot in range(self.slots):
+            if not self._slot_id(slot):
+                return slot
+        raise ValueError(f"The phone table is full ({self.slots} phones)")
+
+    def _write_slot(self, slot, encoded_id, data):
+        offset = self._offset(slot)
+        # Odd while the slot is being written; wraps around at 2**32 and stays even afterwards
+        seq = (SEQ.unpack_from(self._mmap, offset)[0] + 1) & 0xFFFFFFFF
+        SEQ.pack_into(self._mmap, offset, seq)
+        SLOT.pack_into(
+            self._mmap, offset, seq, encoded_id,
+            _number(data.get("lat")), _number(data.get("lng")), _number(data.get("alt")),
+            _number(data.get("heading")), _number(data.get("timestamp")),
+        )
+        SEQ.pack_into(self._mmap, offset, (seq + 1) & 0xFFFFFFFF)
+
+
+def _number(value):
+    return math.nan if value is None else float(value)
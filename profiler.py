@@ -0,0 +1,127 @@
+"""Sampling profiler for the running server, with output ready for flame graphs.
+
+While running, a background thread takes every other thread's Python stack
+``interval`` seconds apart and counts identical stacks. ``folded()``
+returns them in the collapsed format read by flamegraph.pl, speedscope and
+inferno: one line per distinct stack, frames from the root down separated
+by semicolons, then the sample count. Threads parked in a wait (idle
+request threads, background writers between runs) are left out unless
+``include_idle`` is set, so the graph shows where the work goes.
+"""
+import os
+import sys
+import threading
+import time
+
+# Leaf frames that mean a thread is blocked waiting, as (file name, function)
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("socket.py", "accept"),
+    ("socket.py", "readinto"),
+    ("socketserver.py", "serve_forever"),
+    ("queue.py", "get"),
+}
+# Distinct stacks kept; further new stacks are counted under one line
+MAX_STACKS = 50000
+# Shortest time between samples, so a tiny interval can't spin a core
+MIN_INTERVAL = 0.001
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.01, include_idle=False):
+        self.interval = max(MIN_INTERVAL, interval)
+        self.include_idle = include_idle
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._labels = {}
+        self._samples = 0
+        self._started = None
+        self._elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None, include_idle=None, reset=True):
+        """Start sampling; returns False if already running. Intervals below MIN_INTERVAL are raised to it"""
+        with self._lock:
+            if self.running:
+                return False
+            if interval is not None:
+                self.interval = max(MIN_INTERVAL, interval)
+            if include_idle is not None:
+                self.include_idle = include_idle
+            if reset:
+                self._counts = {}
+                self._samples = 0
+                self._elapsed = 0.0
+            self._started = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling; the collected stacks stay available"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout=5)
+        with self._lock:
+            if self._started is not None:
+                self._elapsed += time.time() - self._started
+                self._started = None
+            self._thread = None
+
+    def folded(self):
+        with self._lock:
+            counts = sorted(self._counts.items())
+        return "".join(f"{stack} {count}\n" for stack, count in counts)
+
+    def stats(self):
+        with self._lock:
+            elapsed = self._elapsed + (time.time() - self._started if self._started is not None else 0.0)
+            return {
+                "running": self.running,
+                "interval": self.interval,
+                "include_idle": self.include_idle,
+                "samples": self._samples,
+                "stacks": len(self._counts),
+                "seconds": round(elapsed, 1),
+            }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _sample(self):
+        me = threading.get_ident()
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            code = frame.f_code
+            if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stacks.append(";".join(reversed(labels)))
+        with self._lock:
+            self._samples += 1
+            for stack in stacks:
+                if stack not in self._counts and len(self._counts) >= MAX_STACKS:
+                    stack = "[too many distinct stacks]"
+                self._counts[stack] = self._counts.get(stack, 0) + 1
@@ -0,0 +1,232 @@
+import atexit
+import copy
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from locator.geodesy import local_xy
+from locking import atomic_write
+
+
+class RouteCache:
+    """LRU + TTL cache of /get_route responses, persisted to a JSON file.
+
+    Routes are keyed by mode and by start and end rounded to ``precision``
+    decimal places (4 places is about 11 m). When the exact key misses, a
+    cached route to the same destination whose line passes within
+    ``reuse_distance`` meters of the new start is trimmed and reused, so a
+    phone walking its route keeps hitting the cache.
+    """
+
+    def __init__(self, path=None, max_entries=512, ttl=3600, precision=4, reuse_distance=30.0, save_interval=30.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.precision = precision
+        self.reuse_distance = reuse_distance
+        self.save_interval = save_interval
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # (mode, end) -> keys of routes to that destination, for along-route reuse
+        self._by_destination = {}
+        self._hits = 0
+        self._reuses = 0
+        self._misses = 0
+        self._dirty = False
+        self._stop = threading.Event()
+
+        if path:
+            self._load()
+            self._thread = threading.Thread(target=self._run, name="route-cache-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _point(self, lat, lng):
+        return round(float(lat), self.precision), round(float(lng), self.precision)
+
+    def key(self, mode, start_lat, start_lng, end_lat, end_lng):
+        return (mode,) + self._point(start_lat, start_lng) + self._point(end_lat, end_lng)
+
+    # ---------------------------------------------------------------- lookups
+
+    def get(self, mode, start_lat, start_lng, end_lat, end_lng):
+        """Return ``(route, "hit" | "reuse")`` or ``(None, "miss")``; routes are copies"""
+        key = self.key(mode, start_lat, start_lng, end_lat, end_lng)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry["stored"] < self.ttl:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return copy.deepcopy(entry["route"]), "hit"
+
+            for other_key in list(self._by_destination.get(key[:1] + key[3:], ())):
+                other = self._entries[other_key]
+                if now - other["stored"] >= self.ttl:
+                    continue
+                trimmed = trim_route(other["route"], start_lat, start_lng, self.reuse_distance)
+                if trimmed is not None:
+                    self._entries.move_to_end(other_key)
+                    self._reuses += 1
+                    return trimmed, "reuse"
+
+            self._misses += 1
+            return None, "miss"
+
+    def put(self, mode, start_lat, start_lng, end_lat, end_lng, route):
+        key = self.key(mode, start_lat, start_lng, end_lat, end_lng)
+        with self._lock:
+            self._store(key, {"stored": time.time(), "route": copy.deepcopy(route)})
+            self._dirty = True
+
+    def _store(self, key, entry):
+        self._discard(key)
+        self._entries[key] = entry
+        self._by_destination.setdefault(key[:1] + key[3:], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        if self._entries.pop(key, None) is None:
+            return
+        destination = key[:1] + key[3:]
+        keys = self._by_destination.get(destination)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_destination[destination]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_destination.clear()
+            self._dirty = True
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._reuses + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "precision": self.precision,
+                "hits": self._hits,
+                "reuses": self._reuses,
+                "misses": self._misses,
+                "hit_rate": (self._hits + self._reuses) / lookups if lookups else 0.0,
+            }
+
+    # ----------------------------------------------------------- persistence
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            entries = [
+                {"key": list(key), "stored": entry["stored"], "route": entry["route"]}
+                for key, entry in self._entries.items()
+                if now - entry["stored"] < self.ttl
+            ]
+            self._dirty = False
+        try:
+            atomic_write(self.path, json.dumps(entries, separators=(",", ":")), fsync=False)
+        except OSError:
+            with self._lock:
+                self._dirty = True
+            raise
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.save()
+
+    def _run(self):
+        while not self._stop.wait(self.save_interval):
+            try:
+                self.save()
+            except OSError as e:
+                print(f"Route cache save failed: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ignoring unreadable route cache {self.path}: {e}")
+            return
+        now = time.time()
+        for entry in entries:
+            if now - entry["stored"] < self.ttl:
+                self._store(tuple(entry["key"]), {"stored": entry["stored"], "route": entry["route"]})
+
+
+def trim_route(route, lat, lng, max_offset):
+    """Cut a cached route so it starts at the point on it nearest to (lat, lng).
+
+    Returns None unless the route passes within ``max_offset`` meters of the
+    point. The remainder of a best route is itself the best route from any
+    point on it, so only the part already travelled is dropped. Distance and
+    duration are scaled by the remaining length, and steps or instructions
+    already completed are removed.
+    """
+    features = route.get("features") or []
+    if len(features) != 1:
+        return None
+    geometry = features[0].get("geometry") or {}
+    coords = geometry.get("coordinates") or []
+    if geometry.get("type") != "LineString" or len(coords) < 2:
+        return None
+
+    # Flat meters around the point; accurate where it matters, within max_offset of it
+    px, py = 0.0, 0.0
+    points = [local_xy(c[1], c[0], lat, lng) for c in coords]
+    best = None
+    travelled = 0.0
+    for i in range(len(points) - 1):
+        (ax, ay), (bx, by) = points[i], points[i + 1]
+        dx, dy = bx - ax, by - ay
+        seg_len = math.hypot(dx, dy)
+        t = 0.0 if seg_len == 0 else max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / (seg_len * seg_len)))
+        offset = math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+        if offset <= max_offset and (best is None or offset < best[0]):
+            best = (offset, i, travelled + t * seg_len)
+        travelled += seg_len
+    if best is None:
+        return None
+
+    _, index, done = best
+    total = travelled
+    fraction = (total - done) / total if total else 0.0
+
+    trimmed = copy.deepcopy(route)
+    feature = trimmed["features"][0]
+    feature["geometry"]["coordinates"] = [[lng, lat]] + coords[index + 1:]
+    properties = feature.setdefault("properties", {})
+    for name in ("distance", "duration", "time"):
+        if isinstance(properties.get(name), (int, float)):
+            properties[name] = properties[name] * fraction
+    for name in ("steps", "instructions"):
+        steps = properties.get(name)
+        if isinstance(steps, list):
+            properties[name] = _remaining_steps(steps, done)
+    return trimmed
+
+
+def _remaining_steps(steps, done):
+    """Drop leading steps whose whole length lies in the travelled part"""
+    covered = 0.0
+    for i, step in enumerate(steps):
+        length = step.get("distance") if isinstance(step, dict) else None
+        if not isinstance(length, (int, float)) or covered + length > done:
+            return steps[i:]
+        covered += length
+    return steps[-1:]
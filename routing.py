@@ -0,0 +1,319 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import REGISTRY
+
+# Provider profile names for each travel mode
+PROFILES = {
+    "mapbox": {"walking": "walking", "driving": "driving", "cycling": "cycling"},
+    "osrm": {"walking": "foot", "driving": "car", "cycling": "bike"},
+    "ors": {"walking": "foot-walking", "driving": "driving-car", "cycling": "cycling-regular"},
+    "graphhopper": {"walking": "foot", "driving": "car", "cycling": "bike"},
+}
+
+PROVIDER_SECONDS = REGISTRY.histogram(
+    "locator_route_provider_seconds",
+    "Routing service response time; outcome is ok, empty (no route) or failed",
+    ("provider", "outcome"),
+)
+
+
+class CircuitBreaker:
+    """Skips a provider for ``cooldown`` seconds after ``threshold`` failures in a row.
+
+    Once the cooldown has passed a single trial request is let through; if
+    it fails the breaker opens again straight away.
+    """
+
+    def __init__(self, threshold=3, cooldown=60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class RouteProvider:
+    """One routing service: builds its request and converts the answer to a GeoJSON FeatureCollection"""
+
+    name = None
+    label = None
+
+    def __init__(self, base_url, api_key=None, timeout=10.0, breaker=None, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        # Keep-alive connections shared by every request to this provider
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._failures = 0
+        self._empty = 0
+        self._wins = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._latency_last = None
+
+    def enabled(self):
+        return True
+
+    def fetch(self, start_lat, start_lng, end_lat, end_lng, mode):
+        """Return a route or None, raising on transport errors and bad statuses"""
+        raise NotImplementedError
+
+    def route(self, start_lat, start_lng, end_lat, end_lng, mode):
+        """``fetch`` with timing, failure counting and the circuit breaker"""
+        started = time.monotonic()
+        try:
+            route_data = self.fetch(start_lat, start_lng, end_lat, end_lng, mode)
+        except Exception as e:
+            self._record(time.monotonic() - started, failed=True)
+            self.breaker.record_failure()
+            print(f"{self.label} routing failed: {e}")
+            return None
+        self._record(time.monotonic() - started, empty=route_data is None)
+        self.breaker.record_success()
+        return route_data
+
+    def _record(self, latency, failed=False, empty=False):
+        PROVIDER_SECONDS.observe(latency, provider=self.name, outcome="failed" if failed else "empty" if empty else "ok")
+        with self._lock:
+            self._requests += 1
+            self._failures += failed
+            self._empty += empty
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+            self._latency_last = latency
+
+    def record_win(self):
+        with self._lock:
+            self._wins += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled(),
+                "breaker": self.breaker.state,
+                "requests": self._requests,
+                "failures": self._failures,
+                "empty": self._empty,
+                "wins": self._wins,
+                "latency_avg_ms": round(1000 * self._latency_total / self._requests, 1) if self._requests else None,
+                "latency_max_ms": round(1000 * self._latency_max, 1),
+                "latency_last_ms": round(1000 * self._latency_last, 1) if self._latency_last is not None else None,
+            }
+
+    def _get(self, url, params):
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+def _feature_collection(geometry, properties):
+    return {
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "geometry": geometry, "properties": properties}],
+    }
+
+
+class MapBoxProvider(RouteProvider):
+    name = "mapbox"
+    label = "MapBox"
+
+    def enabled(self):
+        return bool(self.api_key)
+
+    def fetch(self, start_lat, start_lng, end_lat, end_lng, mode):
+        profile = PROFILES["mapbox"].get(mode, "cycling")
+        data = self._get(
+            f"{self.base_url}/directions/v5/mapbox/{profile}/{start_lng},{start_lat};{end_lng},{end_lat}",
+            {"access_token": self.api_key, "geometries": "geojson", "overview": "full", "steps": "true"},
+        )
+        return _osrm_style_route(data, "mapbox")
+
+
+class OSRMProvider(RouteProvider):
+    name = "osrm"
+    label = "OSRM"
+
+    def fetch(self, start_lat, start_lng, end_lat, end_lng, mode):
+        profile = PROFILES["osrm"].get(mode, "bike")
+        data = self._get(
+            f"{self.base_url}/route/v1/{profile}/{start_lng},{start_lat};{end_lng},{end_lat}",
+            {"overview": "full", "geometries": "geojson", "steps": "true"},
+        )
+        return _osrm_style_route(data, "osrm")
+
+
+def _osrm_style_route(data, service):
+    """MapBox and OSRM share a response format"""
+    if not data.get("routes"):
+        return None
+    route = data["routes"][0]
+    return _feature_collection(route["geometry"], {
+        "distance": route.get("distance", 0),
+        "duration": route.get("duration", 0),
+        "steps": route.get("legs", [{}])[0].get("steps", []),
+        "service": service,
+    })
+
+
+class OpenRouteServiceProvider(RouteProvider):
+    name = "ors"
+    label = "OpenRouteService"
+
+    def enabled(self):
+        return bool(self.api_key)
+
+    def fetch(self, start_lat, start_lng, end_lat, end_lng, mode):
+        profile = PROFILES["ors"].get(mode, "cycling-regular")
+        response = self.session.post(
+            f"{self.base_url}/v2/directions/{profile}",
+            json={
+                "coordinates": [[start_lng, start_lat], [end_lng, end_lat]],
+                "format": "geojson",
+                "instructions": True,
+            },
+            headers={
+                "Accept": "application/json, application/geo+json",
+                "Authorization": self.api_key,
+                "Content-Type": "application/json",
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        route_data = response.json()
+        if not route_data.get("features"):
+            return None
+        route_data["features"][0]["properties"]["service"] = "openrouteservice"
+        return route_data
+
+
+class GraphHopperProvider(RouteProvider):
+    name = "graphhopper"
+    label = "GraphHopper"
+
+    def fetch(self, start_lat, start_lng, end_lat, end_lng, mode):
+        params = {
+            "point": [f"{start_lat},{start_lng}", f"{end_lat},{end_lng}"],
+            "vehicle": PROFILES["graphhopper"].get(mode, "bike"),
+            "locale": "en",
+            "instructions": "true",
+            "calc_points": "true",
+            "debug": "false",
+            "elevation": "false",
+            "points_encoded": "false",
+        }
+        if self.api_key:
+            params["key"] = self.api_key
+        data = self._get(f"{self.base_url}/api/1/route", params)
+        if not data.get("paths"):
+            return None
+        path = data["paths"][0]
+        coordinates = [[point[1], point[0]] for point in path["points"]["coordinates"]]
+        return _feature_collection({"type": "LineString", "coordinates": coordinates}, {
+            "distance": path.get("distance", 0),
+            "time": path.get("time", 0),
+            "instructions": path.get("instructions", []),
+            "service": "graphhopper",
+        })
+
+
+class RouteRacer:
+    """Queries every enabled provider at once and returns the first usable route.
+
+    Slower providers keep running in the background so their latency and
+    failures still feed the metrics and circuit breakers.
+    """
+
+    def __init__(self, providers, max_workers=16):
+        self.providers = providers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="route-provider")
+
+    def route(self, start_lat, start_lng, end_lat, end_lng, mode):
+        """Return ``(route, service label)``, or ``(None, None)`` if no provider answered"""
+        pending = {}
+        for provider in self.providers:
+            if provider.enabled() and provider.breaker.allow():
+                future = self._executor.submit(provider.route, start_lat, start_lng, end_lat, end_lng, mode)
+                pending[future] = provider
+        if not pending:
+            return None, None
+
+        deadline = time.monotonic() + max(provider.timeout for provider in pending.values())
+        while pending:
+            done, _ = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                provider = pending.pop(future)
+                route_data = future.result()
+                if route_data is not None:
+                    provider.record_win()
+                    return route_data, provider.label
+        return None, None
+
+    def stats(self):
+        return {provider.name: provider.stats() for provider in self.providers}
+
+
+def providers_from_config(config):
+    """Build the provider list; base URLs can point at local stubs for testing"""
+    timeout = config.get("routing_timeout", 10.0)
+    threshold = config.get("routing_breaker_failures", 3)
+    cooldown = config.get("routing_breaker_cooldown", 60.0)
+
+    def breaker():
+        return CircuitBreaker(threshold, cooldown)
+
+    return [
+        MapBoxProvider(config.get("mapbox_url", "https://api.mapbox.com"),
+                       config.get("mapbox_token"), timeout, breaker()),
+        OSRMProvider(config.get("osrm_url", "http://router.project-osrm.org"),
+                     None, timeout, breaker()),
+        OpenRouteServiceProvider(config.get("ors_url", "https://api.openrouteservice.org"),
+                                 config.get("ors_api_key"), timeout, breaker()),
+        GraphHopperProvider(config.get("graphhopper_url", "https://graphhopper.com"),
+                            config.get("graphhopper_api_key"), timeout, breaker()),
+    ]
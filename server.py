@@ -1,8 +1,28 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, g, render_template, request, jsonify, send_from_directory
 import json
-import os
-import requests
+import math
+import threading
 import time
+import uuid
+from phone_store import PhoneStore
+from phone_table import SharedPhoneTable
+from storage import COLLECTIONS, open_storage
+from events import EventBus
+from metrics import REGISTRY
+from profiler import SamplingProfiler
+from http_cache import ResponseCache, shared_boot_id
+from ingest import IngestError, decode_batch, normalize_fix
+from locator.geodesy import distance, path_length
+from locator.kalman import PositionFilter
+from tracks import TrackStore
+from route_cache import RouteCache
+from routing import RouteRacer, providers_from_config
+from offline_router import OfflineRouter
+from spatial import Area, CollectionIndex, item_envelope
+from geofence import GeofenceEngine
+from tile_cache import TileProxy, content_type
+from grid import GridTiles, describe_cells, grid_ref, grid_refs
+from simplify import encode_polyline, simplify_feature, simplify_indices, tolerance_for_zoom, valid_lines
 
 # Load config
 with open('config.json') as config_file:
@@ -10,11 +30,149 @@ with open('config.json') as config_file:
 OPENWEATHERMAP_API_KEY = config.get('openweathermap_api_key')
 
 app = Flask(__name__)
-DATA_FILE = "drawings.json"
 PHONES_FILE = "phones.json"
-MEASUREMENTS_FILE = "measurements.json"
-NOTES_FILE = "notes.json"
-RADIO_FILE = "radio_frequencies.json"
+RADIO_CHANNELS = 40
+
+# Every fix ever received, for after-action replay
+track_store = TrackStore(
+    config.get('tracks_file', 'tracks.db'),
+    retention_days=config.get('track_retention_days'),
+)
+
+# Optional per-phone Kalman filters that smooth fixes before they are stored and pushed
+PHONE_FILTER = config.get('phone_filter', False)
+phone_filters = {}
+phone_filters_lock = threading.Lock()
+
+# Drawings, POIs, measurements, notes, radio and the shared route (SQLite by default)
+storage = open_storage(config)
+
+# Grid indexes over the located collections, for ?bbox= and ?near= loads; notes have no position
+spatial_indexes = {collection: CollectionIndex(storage, collection) for collection in ("pois", "measurements")}
+
+# Routing services raced against each other, each behind its own circuit breaker
+route_racer = RouteRacer(providers_from_config(config))
+
+# Local OSM road graph (built with `python offline_router.py import`), used when the services can't answer
+offline_router = OfflineRouter.open(config.get('offline_graph', 'offline_graph'))
+OFFLINE_ROUTING_FIRST = config.get('offline_routing_first', False)
+
+# Map tiles fetched once for every phone and kept on disk (prefetch with `python tile_cache.py prefetch`)
+tile_proxy = TileProxy(
+    config.get('tile_cache_dir', 'tiles'),
+    max_bytes=config.get('tile_cache_size_mb', 1024) * 1024 * 1024,
+    timeout=config.get('tile_timeout', 10.0),
+    openweathermap_key=OPENWEATHERMAP_API_KEY if OPENWEATHERMAP_API_KEY != "YOUR_API_KEY_HERE" else None,
+)
+
+# Map grid overlay tiles, rendered once and kept next to the map tiles
+grid_tiles = GridTiles(
+    config.get('tile_cache_dir', 'tiles'),
+    max_bytes=config.get('grid_cache_size_mb', 64) * 1024 * 1024,
+)
+
+# Routes by mode and snapped endpoints, so repeated navigation skips the routing services
+route_cache = RouteCache(
+    config.get('route_cache_file', 'route_cache.json'),
+    max_entries=config.get('route_cache_size', 512),
+    ttl=config.get('route_cache_ttl', 3600),
+    precision=config.get('route_cache_precision', 4),
+    reuse_distance=config.get('route_reuse_distance', 30.0),
+)
+
+# Change notifications pushed to browsers over /events
+events = EventBus()
+
+# Enter/exit alerts for phones crossing POI, note and closed-drawing fences, pushed over /events
+geofences = GeofenceEngine(
+    storage,
+    lambda event: events.publish("geofence", event),
+    poi_radius=config.get('geofence_poi_radius', 50),
+    hysteresis=config.get('geofence_hysteresis', 10),
+    closing_distance=config.get('geofence_closing_distance', 30),
+) if config.get('geofencing', True) else None
+
+# Serialized /load_* bodies, reused until the underlying revision changes. With a shared phone
+# table every revision is shared by the workers, so they must also agree on the ETag boot id.
+response_cache = ResponseCache(boot_id=shared_boot_id() if config.get('phones_table') else None)
+
+# Phone positions live in memory; disk writes happen on the store's own schedule.
+# With several worker processes, set phones_table so they share one memory-mapped table.
+phone_store = PhoneStore(
+    PHONES_FILE,
+    wal_interval=config.get('phones_wal_interval', 1.0),
+    snapshot_interval=config.get('phones_snapshot_interval', 30.0),
+    shared_table=SharedPhoneTable(config['phones_table'], config.get('phones_table_slots', 1024))
+    if config.get('phones_table') else None,
+)
+
+# What this process last announced over /events, so changes written by other workers stand out
+published_revisions = {}
+published_phones = {}
+
+# Prometheus metrics at /metrics; per-route timings, ingest counts and the state of the caches
+http_requests = REGISTRY.counter(
+    "locator_http_requests_total", "Requests handled, by route, method and status", ("route", "method", "status"),
+)
+http_request_seconds = REGISTRY.histogram(
+    "locator_http_request_seconds", "Time to produce a response, by route and method", ("route", "method"),
+)
+fixes_ingested = REGISTRY.counter(
+    "locator_fixes_total", "GPS fixes received; rejected ones were invalid", ("result",),
+)
+ACTIVE_PHONE_SECONDS = config.get('active_phone_seconds', 300)
+
+# Opt-in sampling profiler; /profiler answers only with "profiler": true in config.json
+PROFILER_ENABLED = config.get('profiler', False)
+profiler = SamplingProfiler(interval=config.get('profiler_interval', 0.01))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # The route pattern, not the path, so ids in URLs don't each get their own series
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        http_requests.inc(route=route, method=request.method, status=response.status_code)
+        http_request_seconds.observe(time.perf_counter() - started, route=route, method=request.method)
+    return response
+
+def collect_metrics():
+    """Values kept by the stores and caches themselves, read at scrape time"""
+    now = time.time()
+    phones = phone_store.all()
+    active = sum(1 for data in phones.values() if now - (data.get("timestamp") or 0) < ACTIVE_PHONE_SECONDS)
+    yield "locator_phones", "gauge", "Phones known to the server", [({}, len(phones))]
+    yield "locator_phones_active", "gauge", f"Phones with a fix in the last {ACTIVE_PHONE_SECONDS} s", [({}, active)]
+    yield "locator_event_subscribers", "gauge", "Open /events streams", [({}, events.subscriber_count())]
+
+    providers = route_racer.stats()
+    yield "locator_route_provider_wins_total", "counter", "Routes this service answered first", [
+        ({"provider": name}, stats["wins"]) for name, stats in providers.items()
+    ]
+    yield "locator_route_provider_available", "gauge", "1 unless the service is disabled or its circuit breaker is open", [
+        ({"provider": name}, int(stats["enabled"] and stats["breaker"] != "open")) for name, stats in providers.items()
+    ]
+    routes = route_cache.stats()
+    yield "locator_route_cache_lookups_total", "counter", "Route cache lookups by result", [
+        ({"result": result}, routes[result]) for result in ("hits", "reuses", "misses")
+    ]
+    yield "locator_route_cache_entries", "gauge", "Routes in the cache", [({}, routes["entries"])]
+    tiles = tile_proxy.stats()
+    yield "locator_tile_requests_total", "counter", "Map tile requests by cache result", [
+        ({"result": result}, tiles[result]) for result in ("hits", "stale", "misses", "failures")
+    ]
+    if geofences is not None:
+        fences = geofences.stats()
+        yield "locator_geofences", "gauge", "Fences being checked", [({}, fences["fences"])]
+        yield "locator_geofence_checks_total", "counter", "Phone positions checked against fences", [
+            ({}, fences["checks"])
+        ]
+
+REGISTRY.add_collector(collect_metrics)
 
 @app.route("/")
 def index():
@@ -25,6 +183,150 @@ def android_icon():
     # Serve the Android homescreen icon
     return send_from_directory(app.root_path + '/templates', 'android.png', mimetype='image/png')
 
+@app.route("/tiles/<source>/<int:z>/<int:x>/<int:y>", methods=["GET"])
+def tile(source, z, x, y):
+    """One map tile through the disk cache; radar frames need ?t=<frame time>"""
+    data, status = tile_proxy.tile(source, z, x, y, variant=request.args.get('t'), appid=request.args.get('appid'))
+    if data is None:
+        codes = {"upstream unavailable": 502, "this source needs ?t=": 400}
+        return jsonify({"error": status}), codes.get(status, 404)
+    response = Response(data, mimetype=content_type(data))
+    max_age = tile_proxy.sources[source]["max_age"] if status != "stale" else 60
+    response.headers['Cache-Control'] = f"public, max-age={min(max_age, 86400)}"
+    response.headers['X-Tile-Cache'] = status
+    return response
+
+@app.route("/tiles", methods=["GET"])
+def tile_stats():
+    """Hit, stale and miss counts and the size of each source's cache"""
+    return jsonify(tile_proxy.stats())
+
+@app.route("/grid/<int:z>/<int:x>/<int:y>.png", methods=["GET"])
+def grid_tile(z, x, y):
+    """One tile of the map grid overlay"""
+    data = grid_tiles.tile(z, x, y)
+    if data is None:
+        return jsonify({"error": "No such tile"}), 404
+    response = Response(data, mimetype="image/png")
+    # The grid never changes; a new drawing comes with a new RENDER_VERSION file
+    response.headers['Cache-Control'] = "public, max-age=604800"
+    return response
+
+@app.route("/grid", methods=["GET"])
+def grid_stats():
+    return jsonify(grid_tiles.stats())
+
+@app.route("/grid_ref", methods=["GET"])
+def grid_ref_at():
+    """Grid reference of ?lat=&lng="""
+    try:
+        return jsonify({"ref": grid_ref(float(request.args['lat']), float(request.args['lng']))})
+    except (KeyError, ValueError):
+        return jsonify({"error": "lat and lng must be a valid position"}), 400
+
+@app.route("/grid_refs", methods=["POST"])
+def grid_refs_for_points():
+    """{"points": [[lat, lng], ...]} to {"refs": [...]}, null for invalid points"""
+    points = (request.get_json(silent=True) or {}).get("points")
+    if not isinstance(points, list):
+        return jsonify({"error": "Expected {\"points\": [[lat, lng], ...]}"}), 400
+    return jsonify({"refs": grid_refs(points)})
+
+@app.route("/grid_cells", methods=["POST"])
+def grid_cells():
+    """{"refs": [...]} to the center and bounds of each cell, null for invalid references"""
+    refs = (request.get_json(silent=True) or {}).get("refs")
+    if not isinstance(refs, list):
+        return jsonify({"error": "Expected {\"refs\": [\"BDKI29982\", ...]}"}), 400
+    return jsonify({"cells": describe_cells(refs)})
+
+@app.route("/grid_refs/<collection>", methods=["GET"])
+def grid_refs_for_collection(collection):
+    """Grid reference of every phone, POI or note, by id"""
+    def tag(pairs):
+        pairs = [(key, item) for key, item in pairs if isinstance(item, dict)]
+        refs = grid_refs([(item.get("lat"), item.get("lng")) for _, item in pairs])
+        return {key: ref for (key, _), ref in zip(pairs, refs) if ref is not None}
+
+    if collection == "phones":
+        return response_cache.json_response(phone_store.revision(), lambda: tag(phone_store.all().items()))
+    if collection not in ("pois", "notes"):
+        return jsonify({"error": "Only phones, pois and notes have grid references"}), 404
+    return response_cache.json_response(
+        storage.revision(collection), lambda: tag(storage.changes_since(collection, 0)["changed"])
+    )
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus metrics for this process"""
+    return Response(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+PROFILER_DISABLED = "The profiler is disabled (set \"profiler\": true in config.json)"
+MAX_PROFILE_SECONDS = 300
+
+def positive_seconds(name):
+    """?<name>= as a positive number of seconds, or None if absent; raises ValueError otherwise"""
+    value = request.args.get(name, type=float)
+    if value is not None and not (math.isfinite(value) and value > 0):
+        raise ValueError(f"{name} must be a positive number of seconds")
+    return value
+
+def start_profiler_from_args():
+    """Start the profiler with ?interval= and ?idle=1; returns an error response, or None once started"""
+    try:
+        interval = positive_seconds("interval")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not profiler.start(interval=interval, include_idle=request.args.get("idle") == "1"):
+        return jsonify({"error": "The profiler is already running"}), 409
+    return None
+
+@app.route("/profiler", methods=["GET"])
+def profiler_stacks():
+    """Folded stacks for flame graphs; ?seconds=N profiles for N seconds first, ?format=json gives the status.
+
+    The profiler samples the threads of the worker process that answers, so
+    with several gunicorn workers use ?seconds= rather than separate
+    start and stop requests, which may reach different workers.
+    """
+    if not PROFILER_ENABLED:
+        return jsonify({"error": PROFILER_DISABLED}), 404
+    if request.args.get("format") == "json":
+        return jsonify(profiler.stats())
+    try:
+        seconds = positive_seconds("seconds")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if seconds:
+        error = start_profiler_from_args()
+        if error is not None:
+            return error
+        time.sleep(min(seconds, MAX_PROFILE_SECONDS))
+        profiler.stop()
+    return Response(profiler.folded(), mimetype="text/plain")
+
+@app.route("/profiler/start", methods=["POST"])
+def start_profiler():
+    """Start sampling until /profiler/stop; ?interval= seconds between samples, ?idle=1 keeps waiting threads.
+
+    Only the worker process that answers is profiled, and with several
+    workers /profiler/stop may reach a different one.
+    """
+    if not PROFILER_ENABLED:
+        return jsonify({"error": PROFILER_DISABLED}), 404
+    error = start_profiler_from_args()
+    if error is not None:
+        return error
+    return jsonify(profiler.stats())
+
+@app.route("/profiler/stop", methods=["POST"])
+def stop_profiler():
+    """Stop the profiler of the worker process that answers"""
+    if not PROFILER_ENABLED:
+        return jsonify({"error": PROFILER_DISABLED}), 404
+    profiler.stop()
+    return jsonify(profiler.stats())
+
 @app.route('/manifest.json')
 def manifest():
     # Serve PWA manifest
@@ -34,273 +336,468 @@ def manifest():
 def minimap():
     return render_template("minimap.html")
 
+@app.route("/events")
+def event_stream():
+    """Server-Sent Events stream announcing changes to every collection"""
+    return Response(
+        events.stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def request_area():
+    """The ?bbox= or ?near=&radius= filter of this request, or None"""
+    return Area.from_args(request.args)
+
+def load_collection(collection, transform=None):
+    """Return the whole collection, or only what changed after ?since=<rev>.
+
+    Collections with a spatial index also accept ?bbox= or ?near=&radius=,
+    which limit the result to items inside that area.
+    """
+    since = request.args.get("since", type=int)
+    try:
+        area = request_area() if collection in spatial_indexes else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def produce():
+        if area is not None:
+            return load_area(collection, area, since)
+        if since is None:
+            items = storage.list(collection)
+            return [transform(item) for item in items] if transform else items
+        delta = storage.changes_since(collection, since)
+        if transform:
+            delta["changed"] = [[key, transform(item)] for key, item in delta["changed"]]
+        return delta
+
+    return response_cache.json_response(storage.revision(collection), produce)
+
+def load_area(collection, area, since):
+    """The items of a collection inside an area, as a list or as a delta after ``since``"""
+    if since is not None:
+        delta = storage.changes_since(collection, since)
+        if not delta["full"]:
+            # An item that moved out of the area is gone as far as this client is concerned
+            inside = [[key, item] for key, item in delta["changed"] if area.intersects(item_envelope(item))]
+            left = [key for key, item in delta["changed"] if not area.intersects(item_envelope(item))]
+            return dict(delta, changed=inside, deleted=delta["deleted"] + left)
+    rev, matches = spatial_indexes[collection].query(area)
+    if since is None:
+        return [item for _, item in matches]
+    return {"rev": rev, "full": True, "changed": [[key, item] for key, item in matches], "deleted": []}
+
+def publish_change(collection):
+    revision = storage.revision(collection)
+    published_revisions[collection] = revision
+    events.publish(collection, {"rev": revision})
+
+def publish_phone(phone_id, phone_data):
+    published_phones[phone_id] = phone_data
+    events.publish("phone", dict(phone_data, id=phone_id))
+    if geofences is not None:
+        geofences.submit(phone_id, phone_data["lat"], phone_data["lng"], phone_data.get("timestamp"))
+
+def watch_other_workers(interval=0.5):
+    """Announce changes written by other worker processes to this worker's /events subscribers"""
+    phone_revision = phone_store.revision()
+    while True:
+        time.sleep(interval)
+        try:
+            for name in COLLECTIONS + ("current_route",):
+                if storage.revision(name) != published_revisions.get(name):
+                    publish_change(name)
+            if phone_store.revision() == phone_revision:
+                continue
+            phone_revision = phone_store.revision()
+            phones = phone_store.all()
+            for phone_id, phone_data in phones.items():
+                if published_phones.get(phone_id) != phone_data:
+                    publish_phone(phone_id, phone_data)
+            removed = set(published_phones) - set(phones)
+            if removed:
+                for phone_id in removed:
+                    del published_phones[phone_id]
+                events.publish("phones")
+        except Exception as e:
+            print(f"Watching other workers failed: {e}")
+
+if config.get('phones_table'):
+    for name in COLLECTIONS + ("current_route",):
+        published_revisions[name] = storage.revision(name)
+    published_phones.update(phone_store.all())
+    threading.Thread(target=watch_other_workers, name="worker-watch", daemon=True).start()
+
 @app.route("/save", methods=["POST"])
 def save():
     data = request.get_json()
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f)
-    return jsonify({"status": "saved"})
+    keys = storage.replace("drawings", data)
+    publish_change("drawings")
+    return jsonify({"status": "saved", "rev": storage.revision("drawings"), "keys": keys})
+
+def feature_latitude(feature):
+    """Latitude of the first point of a line feature, for scaling the tolerance"""
+    coordinates = (feature.get("geometry") or {}).get("coordinates") or []
+    while coordinates and isinstance(coordinates[0], list):
+        coordinates = coordinates[0]
+    return coordinates[1] if len(coordinates) > 1 else 0
+
+def simplify_for_zoom(feature, zoom):
+    """Drop stroke points that would be less than half a pixel apart at this zoom"""
+    if not valid_lines(feature):
+        return feature
+    return simplify_feature(feature, tolerance_for_zoom(zoom, feature_latitude(feature)))
 
 @app.route("/load", methods=["GET"])
 def load():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as f:
-            return jsonify(json.load(f))
-    return jsonify([])
+    """All drawings; ?zoom= simplifies each stroke for display at that zoom"""
+    zoom = request.args.get("zoom", type=float)
+    if zoom is None:
+        return load_collection("drawings")
+    return load_collection("drawings", lambda feature: simplify_for_zoom(feature, zoom))
+
+def new_item_id():
+    return uuid.uuid4().hex[:12]
+
+def posted_item():
+    """The JSON object in the request body, given a server-assigned id if it came without one"""
+    item = request.get_json(silent=True)
+    if not isinstance(item, dict):
+        return None
+    if item.get("id") in (None, ""):
+        item["id"] = new_item_id()
+    return item
+
+@app.route("/drawings", methods=["POST"])
+def add_drawing():
+    """Add a single stroke; the server assigns its id"""
+    feature = request.get_json()
+    if not isinstance(feature, dict) or not isinstance(feature.get("geometry"), dict):
+        return jsonify({"error": "Expected a GeoJSON feature"}), 400
+    if not valid_lines(feature):
+        return jsonify({"error": "Stroke coordinates must be [lng, lat] pairs of finite numbers"}), 400
+
+    # Freehand strokes carry every mousemove point; keep only what is visible at the zoom they were drawn at
+    zoom = request.args.get("zoom", type=float)
+    if zoom is not None:
+        feature = simplify_for_zoom(feature, zoom)
+    feature["id"] = new_item_id()
+    storage.upsert("drawings", feature["id"], feature)
+    publish_change("drawings")
+    return jsonify({"status": "saved", "id": feature["id"], "rev": storage.revision("drawings")}), 201
+
+@app.route("/drawings/<drawing_id>", methods=["PATCH"])
+def update_drawing(drawing_id):
+    """Change the geometry or properties of one stroke"""
+    changes = request.get_json(silent=True) or {}
+    if not isinstance(changes, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    feature = storage.get("drawings", drawing_id)
+    if feature is None:
+        return jsonify({"error": "Drawing not found"}), 404
+
+    properties = changes.pop("properties", None)
+    changes.pop("id", None)
+    feature.update(changes)
+    if properties is not None:
+        feature["properties"] = {**(feature.get("properties") or {}), **properties}
+    if not isinstance(feature.get("geometry"), dict) or not valid_lines(feature):
+        return jsonify({"error": "Stroke coordinates must be [lng, lat] pairs of finite numbers"}), 400
+    zoom = request.args.get("zoom", type=float)
+    if zoom is not None and "geometry" in changes:
+        feature = simplify_for_zoom(feature, zoom)
+
+    if "id" not in feature:
+        # Strokes saved through /save are keyed by content, so editing one gives it a real id
+        storage.delete("drawings", drawing_id)
+        feature["id"] = new_item_id()
+    storage.upsert("drawings", feature["id"], feature)
+    publish_change("drawings")
+    return jsonify({"status": "updated", "id": feature["id"], "rev": storage.revision("drawings")})
+
+@app.route("/drawings/<drawing_id>", methods=["DELETE"])
+def delete_drawing(drawing_id):
+    """Remove one stroke"""
+    if not storage.delete("drawings", drawing_id):
+        return jsonify({"error": "Drawing not found"}), 404
+    publish_change("drawings")
+    return jsonify({"status": "deleted", "rev": storage.revision("drawings")})
 
 @app.route("/save_phones", methods=["POST"])
 def save_phones():
-    data = request.get_json()
-    with open(PHONES_FILE, "w") as f:
-        json.dump(data, f)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not all(isinstance(phone, dict) for phone in data.values()):
+        return jsonify({"status": "error", "message": "Expected an object of phone records by id"}), 400
+    try:
+        phone_store.replace_all(data)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    published_phones.clear()
+    published_phones.update(phone_store.all())
+    events.publish("phones")
     return jsonify({"status": "phones saved"})
 
 @app.route("/load_phones", methods=["GET"])
 def load_phones():
-    if os.path.exists(PHONES_FILE):
-        with open(PHONES_FILE, "r") as f:
-            return jsonify(json.load(f))
-    return jsonify({})
+    """Every phone, or with ?bbox= or ?near=&radius= only those inside that area"""
+    try:
+        area = request_area()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if area is None:
+        return response_cache.json_response(phone_store.revision(), phone_store.all)
+
+    # Phones move on every fix, so a scan of the (small) registry beats maintaining an index
+    def produce():
+        return {
+            phone_id: data for phone_id, data in phone_store.all().items()
+            if area.intersects(item_envelope(data))
+        }
+
+    return response_cache.json_response(phone_store.revision(), produce)
+
+def smooth_fix(fix):
+    """Replace a fix's position, and a missing heading, with the phone's filtered estimate"""
+    with phone_filters_lock:
+        position_filter = phone_filters.get(fix["id"])
+        if position_filter is None:
+            position_filter = phone_filters[fix["id"]] = PositionFilter(config.get('phone_filter_accel', 0.3))
+        # Late fixes from a phone's buffer are older than the filter; keep them as they are
+        if position_filter.timestamp is not None and fix["timestamp"] < position_filter.timestamp:
+            return fix
+        position_filter.update(fix["lat"], fix["lng"], fix["timestamp"])
+        estimate = position_filter.estimate(fix["timestamp"])
+    smoothed = dict(fix, lat=estimate["lat"], lng=estimate["lng"])
+    if smoothed.get("heading") is None:
+        smoothed["heading"] = estimate["heading"]
+    return smoothed
 
 @app.route("/update_location", methods=["POST"])
 def update_location():
-    data = request.get_json()
-    phone_id = data.get("id")
-    lat = data.get("lat")
-    lng = data.get("lng")
-    heading = data.get("heading")
-    alt = data.get("alt")
-
-    if not phone_id or lat is None or lng is None:
-        return jsonify({"status": "error", "message": "Missing required data"}), 400
-
-    if os.path.exists(PHONES_FILE):
-        with open(PHONES_FILE, "r") as f:
-            try:
-                phones = json.load(f)
-            except json.JSONDecodeError:
-                phones = {}
-    else:
-        phones = {}
-
-    phone_data = phones.get(phone_id, {})
-    phone_data["lat"] = lat
-    phone_data["lng"] = lng
-    phone_data["alt"] = alt # Save altitude
-
-    # Only update heading if it's provided
-    if heading is not None:
-        phone_data["heading"] = heading
-    
-    # Persist last known heading if new update doesn't have one
-    elif "heading" in phones.get(phone_id, {}):
-        phone_data["heading"] = phones[phone_id]["heading"]
-
-
-    phones[phone_id] = phone_data
-
-    # Add a timestamp to know when the location was last updated
-    phone_data["timestamp"] = time.time()
-
-    with open(PHONES_FILE, "w") as f:
-        json.dump(phones, f)
+    now = time.time()
+    fix = normalize_fix(request.get_json(silent=True), now)
+    if fix is None:
+        fixes_ingested.inc(result="rejected")
+        return jsonify({"status": "error", "message": "Missing or invalid id, lat or lng"}), 400
+
+    # A live fix is stamped on arrival; buffered fixes carry their own time through /update_locations
+    fix["timestamp"] = now
+    if PHONE_FILTER:
+        fix = smooth_fix(fix)
+    phone_id = fix["id"]
+
+    # Last known heading is kept by the store when this fix has none
+    try:
+        phone_data = phone_store.update(phone_id, fix["lat"], fix["lng"], alt=fix["alt"], heading=fix["heading"], timestamp=now)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    track_store.append(phone_id, fix["lat"], fix["lng"], alt=fix["alt"], heading=fix["heading"], timestamp=phone_data["timestamp"])
+    publish_phone(phone_id, phone_data)
+    fixes_ingested.inc(result="accepted")
 
     return jsonify({"status": "updated"})
 
+@app.route("/update_locations", methods=["POST"])
+def update_locations():
+    """Ingest many fixes at once, from many phones or several buffered fixes from one.
+
+    Accepts JSON ({"fixes": [...]} or a list), MessagePack, or the packed
+    binary format from locator/fixcodec.py.
+    """
+    try:
+        batch = decode_batch(request.content_type, request.get_data())
+    except IngestError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    now = time.time()
+    fixes = [fix for fix in (normalize_fix(raw, now) for raw in batch) if fix is not None]
+    fixes_ingested.inc(len(fixes), result="accepted")
+    fixes_ingested.inc(len(batch) - len(fixes), result="rejected")
+    if PHONE_FILTER:
+        fixes = [smooth_fix(fix) for fix in sorted(fixes, key=lambda fix: fix["timestamp"])]
+    changed = phone_store.update_many(fixes)
+    track_store.append_many(fixes)
+    for phone_id, phone_data in changed.items():
+        publish_phone(phone_id, phone_data)
+
+    return jsonify({
+        "status": "updated",
+        "accepted": len(fixes),
+        "rejected": len(batch) - len(fixes),
+        "phones": len(changed),
+    })
+
+
+@app.route("/geofences", methods=["GET"])
+def geofence_status():
+    """Fence count and which phones are inside which fences"""
+    if geofences is None:
+        return jsonify({"error": "Geofencing is disabled"}), 404
+    return jsonify(geofences.stats())
+
+@app.route("/geofence_events", methods=["GET"])
+def geofence_events():
+    """The most recent enter and exit events, oldest first"""
+    if geofences is None:
+        return jsonify({"error": "Geofencing is disabled"}), 404
+    return jsonify(geofences.recent_events())
+
+@app.route("/phone_estimate/<phone_id>", methods=["GET"])
+def phone_estimate(phone_id):
+    """Filtered position, speed and heading, extrapolated to ?at=<unix> (default: now)"""
+    try:
+        at = float(request.args.get('at', time.time()))
+    except ValueError:
+        return jsonify({"error": "at must be a unix timestamp"}), 400
+    with phone_filters_lock:
+        position_filter = phone_filters.get(phone_id)
+        estimate = position_filter.estimate(at) if position_filter is not None else None
+    if estimate is None:
+        return jsonify({"error": "No estimate for this phone (is phone_filter enabled?)"}), 404
+    return jsonify(dict(estimate, id=phone_id))
+
+@app.route("/tracks", methods=["GET"])
+def tracks():
+    """Phones with stored history, with their first and last fix times"""
+    return jsonify(track_store.summary())
+
+@app.route("/track/<phone_id>", methods=["GET"])
+def track(phone_id):
+    """Position history for one phone as a GeoJSON LineString, limited by ?from=&to= (unix seconds).
+
+    ?tolerance= (meters) or ?zoom= simplifies the line before it is sent, and
+    ?format=polyline returns a Google encoded polyline instead of coordinates.
+    ``distance`` is the length of the track in meters. At most ?limit= fixes
+    (default 100000) are returned, the newest ones, with ``truncated`` set when
+    older fixes were left out.
+    """
+    start = request.args.get("from", type=float)
+    end = request.args.get("to", type=float)
+    limit = request.args.get("limit", default=100000, type=int)
+    tolerance = request.args.get("tolerance", type=float)
+    zoom = request.args.get("zoom", type=float)
+    # One fix past the limit tells whether older fixes were left out
+    times, lats, lngs, alts, headings = track_store.query(phone_id, start, end, limit=limit + 1 if limit > 0 else None)
+    truncated = limit > 0 and len(times) > limit
+    if truncated:
+        times, lats, lngs = times[1:], lats[1:], lngs[1:]
+    # Measured on every fix, before simplification cuts corners
+    length = round(path_length(lats, lngs), 1)
+
+    if tolerance is None and zoom is not None and lats:
+        tolerance = tolerance_for_zoom(zoom, lats[0])
+    if tolerance and len(lats) > 2:
+        keep = simplify_indices(lats, lngs, tolerance).tolist()
+        times = [times[i] for i in keep]
+        lats = [lats[i] for i in keep]
+        lngs = [lngs[i] for i in keep]
+
+    if request.args.get("format") == "polyline":
+        return jsonify({
+            "id": phone_id,
+            "count": len(times),
+            "from": times[0] if times else start,
+            "to": times[-1] if times else end,
+            "distance": length,
+            "truncated": truncated,
+            "polyline": encode_polyline(lats, lngs),
+            "times": [round(t, 1) for t in times],
+        })
+
+    return jsonify({
+        "type": "Feature",
+        "geometry": {
+            "type": "LineString",
+            "coordinates": [[round(lng, 6), round(lat, 6)] for lat, lng in zip(lats, lngs)],
+        },
+        "properties": {
+            "id": phone_id,
+            "count": len(times),
+            "from": times[0] if times else start,
+            "to": times[-1] if times else end,
+            "distance": length,
+            "truncated": truncated,
+            "times": [round(t, 1) for t in times],
+        },
+    })
 
 @app.route("/save_poi", methods=["POST"])
 def save_poi():
-    poi_data = request.get_json()
-    poi_id = poi_data.get("id")
-    
-    if not os.path.exists("pois.json"):
-        with open("pois.json", "w") as f:
-            json.dump([], f)
-    
-    # Load existing POIs
-    with open("pois.json", "r") as f:
-        try:
-            pois = json.load(f)
-        except json.JSONDecodeError:
-            pois = []
-    
-    # Update or add POI
-    found = False
-    for i, poi in enumerate(pois):
-        if poi.get("id") == poi_id:
-            pois[i] = poi_data
-            found = True
-            break
-    
-    if not found:
-        pois.append(poi_data)
-    
-    # Save back to file
-    with open("pois.json", "w") as f:
-        json.dump(pois, f)
-    
+    poi_data = posted_item()
+    if poi_data is None:
+        return jsonify({"error": "Expected a JSON object"}), 400
+    poi_id = poi_data["id"]
+    storage.upsert("pois", poi_id, poi_data)
+    publish_change("pois")
     return jsonify({"status": "saved", "id": poi_id})
 
 @app.route("/load_pois", methods=["GET"])
 def load_pois():
-    if not os.path.exists("pois.json"):
-        return jsonify([])
-    
-    with open("pois.json", "r") as f:
-        try:
-            pois = json.load(f)
-            return jsonify(pois)
-        except json.JSONDecodeError:
-            return jsonify([])
+    return load_collection("pois")
 
 @app.route("/delete_poi", methods=["POST"])
 def delete_poi():
     poi_id = request.get_json().get("id")
-    
-    if os.path.exists("pois.json"):
-        with open("pois.json", "r") as f:
-            try:
-                pois = json.load(f)
-                pois = [poi for poi in pois if poi.get("id") != poi_id]
-                
-                with open("pois.json", "w") as f:
-                    json.dump(pois, f)
-                
-                return jsonify({"status": "deleted"})
-            except json.JSONDecodeError:
-                return jsonify({"error": "Failed to parse POIs file"}), 500
-    
-    return jsonify({"error": "No POIs found"}), 404
+    storage.delete("pois", poi_id)
+    publish_change("pois")
+    return jsonify({"status": "deleted"})
 
 @app.route("/save_measurement", methods=["POST"])
 def save_measurement():
-    measurement = request.get_json()
-    
-    if not os.path.exists(MEASUREMENTS_FILE):
-        with open(MEASUREMENTS_FILE, "w") as f:
-            json.dump([], f)
-    
-    # Load existing measurements
-    with open(MEASUREMENTS_FILE, "r") as f:
-        try:
-            measurements = json.load(f)
-        except json.JSONDecodeError:
-            measurements = []
-    
-    # Update or add measurement
-    found = False
-    for i, m in enumerate(measurements):
-        if m.get("id") == measurement.get("id"):
-            measurements[i] = measurement
-            found = True
-            break
-    
-    if not found:
-        measurements.append(measurement)
-    
-    # Save back to file
-    with open(MEASUREMENTS_FILE, "w") as f:
-        json.dump(measurements, f)
-    
-    return jsonify({"status": "saved", "id": measurement.get("id")})
+    measurement = posted_item()
+    if measurement is None:
+        return jsonify({"error": "Expected a JSON object"}), 400
+    storage.upsert("measurements", measurement["id"], measurement)
+    publish_change("measurements")
+    return jsonify({"status": "saved", "id": measurement["id"]})
 
 @app.route("/load_measurements", methods=["GET"])
 def load_measurements():
-    if not os.path.exists(MEASUREMENTS_FILE):
-        return jsonify([])
-    
-    with open(MEASUREMENTS_FILE, "r") as f:
-        try:
-            measurements = json.load(f)
-            return jsonify(measurements)
-        except json.JSONDecodeError:
-            return jsonify([])
+    return load_collection("measurements")
 
 @app.route("/clear_measurements", methods=["POST"])
 def clear_measurements():
-    with open(MEASUREMENTS_FILE, "w") as f:
-        json.dump([], f)
+    storage.clear("measurements")
+    publish_change("measurements")
     return jsonify({"status": "cleared"})
 
 @app.route("/clear_pois", methods=["POST"])
 def clear_pois():
-    with open("pois.json", "w") as f:
-        json.dump([], f)
+    storage.clear("pois")
+    publish_change("pois")
     return jsonify({"status": "cleared"})
 
 @app.route("/save_note", methods=["POST"])
 def save_note():
-    note_data = request.get_json()
-    note_id = note_data.get("id")
-    
-    if not os.path.exists(NOTES_FILE):
-        with open(NOTES_FILE, "w") as f:
-            json.dump([], f)
-    
-    # Load existing notes
-    with open(NOTES_FILE, "r") as f:
-        try:
-            notes = json.load(f)
-        except json.JSONDecodeError:
-            notes = []
-    
-    # Update or add note
-    found = False
-    for i, note in enumerate(notes):
-        if note.get("id") == note_id:
-            notes[i] = note_data
-            found = True
-            break
-    
-    if not found:
-        notes.append(note_data)
-    
-    # Save back to file
-    with open(NOTES_FILE, "w") as f:
-        json.dump(notes, f)
-    
+    note_data = posted_item()
+    if note_data is None:
+        return jsonify({"error": "Expected a JSON object"}), 400
+    note_id = note_data["id"]
+    storage.upsert("notes", note_id, note_data)
+    publish_change("notes")
     return jsonify({"status": "saved", "id": note_id})
 
 @app.route("/load_notes", methods=["GET"])
 def load_notes():
-    if not os.path.exists(NOTES_FILE):
-        return jsonify([])
-    
-    with open(NOTES_FILE, "r") as f:
-        try:
-            notes = json.load(f)
-            return jsonify(notes)
-        except json.JSONDecodeError:
-            return jsonify([])
+    return load_collection("notes")
 
 @app.route("/delete_note", methods=["POST"])
 def delete_note():
     note_id = request.get_json().get("id")
-    
-    if os.path.exists(NOTES_FILE):
-        with open(NOTES_FILE, "r") as f:
-            try:
-                notes = json.load(f)
-                notes = [note for note in notes if note.get("id") != note_id]
-                
-                with open(NOTES_FILE, "w") as f:
-                    json.dump(notes, f)
-                
-                return jsonify({"status": "deleted"})
-            except json.JSONDecodeError:
-                return jsonify({"error": "Failed to parse notes file"}), 500
-    
-    return jsonify({"error": "No notes found"}), 404
+    storage.delete("notes", note_id)
+    publish_change("notes")
+    return jsonify({"status": "deleted"})
 
 @app.route("/clear_notes", methods=["POST"])
 def clear_notes():
-    with open(NOTES_FILE, "w") as f:
-        json.dump([], f)
+    storage.clear("notes")
+    publish_change("notes")
     return jsonify({"status": "cleared"})
 
 @app.route("/get_route", methods=["POST"])
 def get_route():
-    """Get routing directions between two points using multiple routing services"""
+    """Get routing directions between two points, from the route cache when possible"""
     data = request.get_json()
     start_lat = data.get("start_lat")
     start_lng = data.get("start_lng")
@@ -311,143 +808,17 @@ def get_route():
     if not all([start_lat, start_lng, end_lat, end_lng]):
         return jsonify({"error": "Missing coordinates"}), 400
     
-    # Try multiple routing services in order of preference
-    route_data = None
-    service_used = None
-    
-    # 1. Try MapBox Directions API (free tier available)
-    try:
-        mapbox_token = "YOUR_MAPBOX_TOKEN_HERE"  # Replace with your MapBox token
-        if mapbox_token != "YOUR_MAPBOX_TOKEN_HERE":
-            profile = "walking" if mode == "walking" else "driving" if mode == "driving" else "cycling"
-            url = f"https://api.mapbox.com/directions/v5/mapbox/{profile}/{start_lng},{start_lat};{end_lng},{end_lat}"
-            params = {
-                "access_token": mapbox_token,
-                "geometries": "geojson",
-                "overview": "full",
-                "steps": "true"
-            }
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                mapbox_data = response.json()
-                if mapbox_data.get("routes"):
-                    route = mapbox_data["routes"][0]
-                    route_data = {
-                        "type": "FeatureCollection",
-                        "features": [{
-                            "type": "Feature",
-                            "geometry": route["geometry"],
-                            "properties": {
-                                "distance": route.get("distance", 0),
-                                "duration": route.get("duration", 0),
-                                "steps": route.get("legs", [{}])[0].get("steps", []),
-                                "service": "mapbox"
-                            }
-                        }]
-                    }
-                    service_used = "MapBox"
-    except Exception as e:
-        print(f"MapBox routing failed: {e}")
-    
-    # 2. Try OSRM (Open Source Routing Machine) - free public instance
-    if not route_data:
-        try:
-            profile = "foot" if mode == "walking" else "car" if mode == "driving" else "bike"
-            url = f"http://router.project-osrm.org/route/v1/{profile}/{start_lng},{start_lat};{end_lng},{end_lat}"
-            params = {
-                "overview": "full",
-                "geometries": "geojson",
-                "steps": "true"
-            }
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                osrm_data = response.json()
-                if osrm_data.get("routes"):
-                    route = osrm_data["routes"][0]
-                    route_data = {
-                        "type": "FeatureCollection",
-                        "features": [{
-                            "type": "Feature",
-                            "geometry": route["geometry"],
-                            "properties": {
-                                "distance": route.get("distance", 0),
-                                "duration": route.get("duration", 0),
-                                "steps": route.get("legs", [{}])[0].get("steps", []),
-                                "service": "osrm"
-                            }
-                        }]
-                    }
-                    service_used = "OSRM"
-        except Exception as e:
-            print(f"OSRM routing failed: {e}")
-    
-    # 3. Try OpenRouteService as backup
-    if not route_data:
-        try:
-            ors_api_key = "YOUR_ORS_API_KEY_HERE"  # Get free key from openrouteservice.org
-            if ors_api_key != "YOUR_ORS_API_KEY_HERE":
-                profile = "foot-walking" if mode == "walking" else "driving-car" if mode == "driving" else "cycling-regular"
-                url = f"https://api.openrouteservice.org/v2/directions/{profile}"
-                headers = {
-                    'Accept': 'application/json, application/geo+json',
-                    'Authorization': ors_api_key,
-                    'Content-Type': 'application/json'
-                }
-                body = {
-                    "coordinates": [[start_lng, start_lat], [end_lng, end_lat]],
-                    "format": "geojson",
-                    "instructions": True
-                }
-                response = requests.post(url, json=body, headers=headers, timeout=10)
-                if response.status_code == 200:
-                    route_data = response.json()
-                    if route_data.get("features"):
-                        route_data["features"][0]["properties"]["service"] = "openrouteservice"
-                        service_used = "OpenRouteService"
-        except Exception as e:
-            print(f"OpenRouteService routing failed: {e}")
-    
-    # 4. Fallback: Use GraphHopper public API
-    if not route_data:
-        try:
-            vehicle = "foot" if mode == "walking" else "car" if mode == "driving" else "bike"
-            url = "https://graphhopper.com/api/1/route"
-            params = {
-                "point": [f"{start_lat},{start_lng}", f"{end_lat},{end_lng}"],
-                "vehicle": vehicle,
-                "locale": "en",
-                "instructions": "true",
-                "calc_points": "true",
-                "debug": "false",
-                "elevation": "false",
-                "points_encoded": "false"
-            }
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                gh_data = response.json()
-                if gh_data.get("paths"):
-                    path = gh_data["paths"][0]
-                    coordinates = [[point[1], point[0]] for point in path["points"]["coordinates"]]
-                    route_data = {
-                        "type": "FeatureCollection",
-                        "features": [{
-                            "type": "Feature",
-                            "geometry": {
-                                "type": "LineString",
-                                "coordinates": coordinates
-                            },
-                            "properties": {
-                                "distance": path.get("distance", 0),
-                                "time": path.get("time", 0),
-                                "instructions": path.get("instructions", []),
-                                "service": "graphhopper"
-                            }
-                        }]
-                    }
-                    service_used = "GraphHopper"
-        except Exception as e:
-            print(f"GraphHopper routing failed: {e}")
-    
+    route_data, cache_status = route_cache.get(mode, start_lat, start_lng, end_lat, end_lng)
+    if route_data is None and offline_router and OFFLINE_ROUTING_FIRST:
+        route_data = offline_route(start_lat, start_lng, end_lat, end_lng, mode)
+    if route_data is None:
+        route_data, service_used = route_racer.route(start_lat, start_lng, end_lat, end_lng, mode)
+        if route_data and route_data.get("features"):
+            route_data["service_used"] = service_used
+            route_cache.put(mode, start_lat, start_lng, end_lat, end_lng, route_data)
+    if not route_data and offline_router and not OFFLINE_ROUTING_FIRST:
+        route_data = offline_route(start_lat, start_lng, end_lat, end_lng, mode)
+
     # Final fallback: straight line
     if not route_data:
         route_data = {
@@ -459,72 +830,70 @@ def get_route():
                     "coordinates": [[start_lng, start_lat], [end_lng, end_lat]]
                 },
                 "properties": {
-                    "distance": calculate_distance(start_lat, start_lng, end_lat, end_lng),
+                    "distance": distance(start_lat, start_lng, end_lat, end_lng),
                     "fallback": True,
                     "service": "fallback"
                 }
             }]
         }
-        service_used = "Fallback (straight line)"
-    
-    # Add service info to response
-    if route_data and route_data.get("features"):
-        route_data["service_used"] = service_used
-    
+        # Straight lines are never cached, so the services are tried again next time
+        route_data["service_used"] = "Fallback (straight line)"
+
+    route_data["cache"] = cache_status
     return jsonify(route_data)
 
-def calculate_distance(lat1, lng1, lat2, lng2):
-    """Calculate distance between two points using Haversine formula"""
-    import math
-    
-    R = 6371000  # Earth's radius in meters
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lng = math.radians(lng2 - lng1)
-    
-    a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lng/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    return R * c
+def offline_route(start_lat, start_lng, end_lat, end_lng, mode):
+    """Route over the local road graph; not cached since it answers in milliseconds"""
+    route_data = offline_router.route(start_lat, start_lng, end_lat, end_lng, mode)
+    if route_data:
+        route_data["service_used"] = "Offline (OpenStreetMap)"
+    return route_data
+
+@app.route("/route_cache", methods=["GET"])
+def route_cache_stats():
+    """Route cache size and hit/miss counters"""
+    return jsonify(route_cache.stats())
+
+@app.route("/route_cache", methods=["DELETE"])
+def clear_route_cache():
+    route_cache.clear()
+    return jsonify({"status": "cleared"})
+
+@app.route("/route_providers", methods=["GET"])
+def route_providers():
+    """Per-provider request counts, failures, latency and circuit breaker state"""
+    return jsonify(route_racer.stats())
+
+def default_radio_frequencies():
+    """Empty channels 1-40"""
+    return {str(i): "" for i in range(1, RADIO_CHANNELS + 1)}
 
 @app.route("/save_radio_frequencies", methods=["POST"])
 def save_radio_frequencies():
     """Save all radio frequencies at once"""
     frequencies = request.get_json()
-    
-    with open(RADIO_FILE, "w") as f:
-        json.dump(frequencies, f)
-    
+    storage.set_document("radio_frequencies", frequencies)
     return jsonify({"status": "saved"})
 
 @app.route("/load_radio_frequencies", methods=["GET"])
 def load_radio_frequencies():
     """Load all radio frequencies"""
-    if not os.path.exists(RADIO_FILE):
-        # Initialize with empty channels 1-40
-        default_frequencies = {str(i): "" for i in range(1, 41)}
-        return jsonify(default_frequencies)
-    
-    with open(RADIO_FILE, "r") as f:
-        try:
-            frequencies = json.load(f)
-            # Ensure all channels 1-40 exist
-            for i in range(1, 41):
-                if str(i) not in frequencies:
-                    frequencies[str(i)] = ""
-            return jsonify(frequencies)
-        except json.JSONDecodeError:
-            # Return default if file is corrupted
-            default_frequencies = {str(i): "" for i in range(1, 41)}
-            return jsonify(default_frequencies)
+    def produce():
+        frequencies = storage.get_document("radio_frequencies")
+        if not isinstance(frequencies, dict):
+            return default_radio_frequencies()
+
+        # Ensure all channels 1-40 exist
+        for channel, value in default_radio_frequencies().items():
+            frequencies.setdefault(channel, value)
+        return frequencies
+
+    return response_cache.json_response(storage.revision("radio_frequencies"), produce)
 
 @app.route("/clear_radio_frequencies", methods=["POST"])
 def clear_radio_frequencies():
     """Clear all radio frequencies"""
-    default_frequencies = {str(i): "" for i in range(1, 41)}
-    with open(RADIO_FILE, "w") as f:
-        json.dump(default_frequencies, f)
+    storage.set_document("radio_frequencies", default_radio_frequencies())
     return jsonify({"status": "cleared"})
 
 @app.route("/save_current_route", methods=["POST"])
@@ -532,8 +901,8 @@ def save_current_route():
     """Save the current active navigation route"""
     try:
         route_data = request.get_json()
-        with open("current_route.json", "w") as f:
-            json.dump(route_data, f)
+        storage.set_document("current_route", route_data)
+        publish_change("current_route")
         return jsonify({"status": "saved"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -542,11 +911,9 @@ def save_current_route():
 def load_current_route():
     """Load the current active navigation route"""
     try:
-        if os.path.exists("current_route.json"):
-            with open("current_route.json", "r") as f:
-                route_data = json.load(f)
-            return jsonify(route_data)
-        return jsonify(None)
+        return response_cache.json_response(
+            storage.revision("current_route"), lambda: storage.get_document("current_route")
+        )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -554,12 +921,13 @@ def load_current_route():
 def clear_current_route():
     """Clear the current active navigation route"""
     try:
-        if os.path.exists("current_route.json"):
-            os.remove("current_route.json")
+        storage.delete_document("current_route")
+        publish_change("current_route")
         return jsonify({"status": "cleared"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
+    # Development server; use wsgi.py with gunicorn.conf.py in production
     print("Starting main server on port 5050...")
-    app.run(debug=True, host="0.0.0.0", port=5050)
+    app.run(debug=config.get('debug', True), host="0.0.0.0", port=5050, threaded=True)
@@ -0,0 +1,137 @@
+import math
+
+import numpy as np
+
+from locator.geodesy import local_xy
+
+# Ground resolution of one 256px Web Mercator tile pixel at zoom 0 on the equator
+METERS_PER_PIXEL_Z0 = 156543.03392
+
+
+def tolerance_for_zoom(zoom, lat=0.0, pixels=0.5):
+    """Ground distance in meters covered by ``pixels`` screen pixels at ``zoom``"""
+    return pixels * METERS_PER_PIXEL_Z0 * math.cos(math.radians(lat)) / (2 ** zoom)
+
+
+def simplify_indices(lats, lngs, tolerance):
+    """Douglas-Peucker over arrays of lat/lng, returning the sorted indices of points to keep.
+
+    ``tolerance`` is in meters. Each split computes the distance of every
+    interior point to its segment in one vectorized NumPy step.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    n = len(lats)
+    if n < 3 or tolerance <= 0:
+        return np.arange(n)
+
+    # Flat meters around the middle of the line; fine at stroke/track scale
+    x, y = local_xy(lats, lngs, float(np.mean(lats)), float(np.mean(lngs)))
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        px = x[first + 1:last]
+        py = y[first + 1:last]
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        seg_len_sq = dx * dx + dy * dy
+        if seg_len_sq == 0:
+            dist_sq = (px - x[first]) ** 2 + (py - y[first]) ** 2
+        else:
+            # Distance to the segment, not the infinite line, so loops back to the start are kept
+            t = np.clip(((px - x[first]) * dx + (py - y[first]) * dy) / seg_len_sq, 0.0, 1.0)
+            dist_sq = (px - (x[first] + t * dx)) ** 2 + (py - (y[first] + t * dy)) ** 2
+        worst = int(np.argmax(dist_sq))
+        if dist_sq[worst] > tolerance * tolerance:
+            split = first + 1 + worst
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def line_array(coordinates):
+    """A GeoJSON ``[[lng, lat], ...]`` list as an (N, 2) array, or None if it isn't one of finite numbers"""
+    try:
+        array = np.asarray(coordinates, dtype=float)
+    except (TypeError, ValueError):
+        return None
+    if array.ndim != 2 or array.shape[1] != 2 or not np.isfinite(array).all():
+        return None
+    return array
+
+
+def valid_lines(feature):
+    """False if a LineString or MultiLineString feature has a line that ``line_array`` rejects"""
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") == "LineString":
+        lines = [geometry.get("coordinates")]
+    elif geometry.get("type") == "MultiLineString":
+        lines = geometry.get("coordinates")
+        if not isinstance(lines, list):
+            return False
+    else:
+        return True
+    return all(line_array(line) is not None for line in lines)
+
+
+def simplify_coordinates(coordinates, tolerance):
+    """Simplify a GeoJSON ``[[lng, lat], ...]`` coordinate list"""
+    if len(coordinates) < 3:
+        return coordinates
+    array = line_array(coordinates)
+    if array is None:
+        return coordinates
+    indices = simplify_indices(array[:, 1], array[:, 0], tolerance)
+    return [coordinates[i] for i in indices]
+
+
+def simplify_feature(feature, tolerance):
+    """Return a copy of a LineString or MultiLineString feature with simplified geometry"""
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") == "LineString":
+        coordinates = simplify_coordinates(geometry["coordinates"], tolerance)
+    elif geometry.get("type") == "MultiLineString":
+        coordinates = [simplify_coordinates(line, tolerance) for line in geometry["coordinates"]]
+    else:
+        return feature
+    return dict(feature, geometry=dict(geometry, coordinates=coordinates))
+
+
+def encode_polyline(lats, lngs, precision=5):
+    """Google encoded polyline string for the given points"""
+    factor = 10 ** precision
+    values = np.empty(2 * len(lats), dtype=np.int64)
+    values[0::2] = np.round(np.asarray(lats, dtype=float) * factor)
+    values[1::2] = np.round(np.asarray(lngs, dtype=float) * factor)
+    # Interleaved lat/lng deltas from the previous point
+    deltas = values.copy()
+    deltas[2:] -= values[:-2]
+
+    chunks = []
+    for value in deltas.tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def decode_polyline(encoded, precision=5):
+    """Inverse of ``encode_polyline``, returning a list of (lat, lng)"""
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    coords = np.cumsum(np.asarray(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return [tuple(point) for point in coords.tolist()]
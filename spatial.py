@@ -0,0 +1,202 @@
+import itertools
+import math
+import threading
+
+from locator.geodesy import bbox_around, distance
+
+# Same cell size as grid.GRID_SIZE, so index cells line up with the map grid
+CELL_SIZE = 0.005
+# Items spanning more cells than this are kept in one list that every query checks
+MAX_ITEM_CELLS = 1024
+
+
+def _is_coordinate(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def item_envelope(item):
+    """(south, west, north, east) around an item's position, or None if it has none.
+
+    POIs and phones have ``lat``/``lng``; measurements have
+    ``start`` and ``end`` as ``[lat, lng]``.
+    """
+    if not isinstance(item, dict):
+        return None
+    points = []
+    if _is_coordinate(item.get("lat")) and _is_coordinate(item.get("lng")):
+        points.append((item["lat"], item["lng"]))
+    for name in ("start", "end"):
+        point = item.get(name)
+        if isinstance(point, (list, tuple)) and len(point) >= 2 and _is_coordinate(point[0]) and _is_coordinate(point[1]):
+            points.append((point[0], point[1]))
+    if not points:
+        return None
+    lats = [lat for lat, _ in points]
+    lngs = [lng for _, lng in points]
+    return min(lats), min(lngs), max(lats), max(lngs)
+
+
+class Area:
+    """A query region: a bounding box, optionally narrowed to a radius around a point"""
+
+    def __init__(self, south, west, north, east, center=None, radius=None):
+        if south > north or west > east:
+            raise ValueError("bbox must be south,west,north,east")
+        self.south, self.west, self.north, self.east = south, west, north, east
+        self.center = center
+        self.radius = radius
+
+    @classmethod
+    def around(cls, lat, lng, radius):
+        if radius < 0:
+            raise ValueError("radius must not be negative")
+        return cls(*bbox_around(lat, lng, radius), center=(lat, lng), radius=radius)
+
+    @classmethod
+    def from_args(cls, args):
+        """Build an area from ?bbox=south,west,north,east or ?near=lat,lng&radius=<meters>; None if neither"""
+        bbox = args.get("bbox")
+        near = args.get("near")
+        if bbox:
+            values = _parse_floats(bbox, 4, "bbox")
+            return cls(*values)
+        if near:
+            lat, lng = _parse_floats(near, 2, "near")
+            radius = args.get("radius", default=1000, type=float)
+            if radius is None:
+                raise ValueError("radius must be a number of meters")
+            return cls.around(lat, lng, radius)
+        return None
+
+    def intersects(self, envelope):
+        if envelope is None:
+            return False
+        south, west, north, east = envelope
+        if north < self.south or south > self.north or east < self.west or west > self.east:
+            return False
+        if self.center is None:
+            return True
+        # Distance from the center to the nearest point of the envelope
+        lat, lng = self.center
+        nearest_lat = min(max(lat, south), north)
+        nearest_lng = min(max(lng, west), east)
+        return distance(lat, lng, nearest_lat, nearest_lng) <= self.radius
+
+
+def _parse_floats(text, count, name):
+    try:
+        values = [float(part) for part in text.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != count or not all(math.isfinite(v) for v in values):
+        raise ValueError(f"{name} must be {count} comma-separated numbers")
+    return values
+
+
+class GridIndex:
+    """Items bucketed into fixed-size lat/lng cells, each stored with its envelope"""
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self._cells = {}
+        self._entries = {}
+        self._large = set()
+        self._order = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _cell_range(self, south, west, north, east):
+        size = self.cell_size
+        return (
+            math.floor(south / size), math.floor(west / size),
+            math.floor(north / size), math.floor(east / size),
+        )
+
+    def set(self, key, item, envelope=None):
+        """Add or move an item; items without a position are dropped from the index"""
+        self.remove(key)
+        if envelope is None:
+            envelope = item_envelope(item)
+        if envelope is None:
+            return
+        row0, col0, row1, col1 = self._cell_range(*envelope)
+        if (row1 - row0 + 1) * (col1 - col0 + 1) > MAX_ITEM_CELLS:
+            cells = None
+            self._large.add(key)
+        else:
+            cells = [(row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+            for cell in cells:
+                self._cells.setdefault(cell, set()).add(key)
+        self._entries[key] = (next(self._order), envelope, item, cells)
+
+    def remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        cells = entry[3]
+        if cells is None:
+            self._large.discard(key)
+            return
+        for cell in cells:
+            bucket = self._cells.get(cell)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._entries.clear()
+        self._large.clear()
+
+    def query(self, area):
+        """Return (key, item) pairs inside ``area``, in the order they were added"""
+        row0, col0, row1, col1 = self._cell_range(area.south, area.west, area.north, area.east)
+        candidates = set(self._large)
+        if (row1 - row0 + 1) * (col1 - col0 + 1) > len(self._cells):
+            # Wide views: walk the occupied cells rather than every cell in the box
+            for (row, col), keys in self._cells.items():
+                if row0 <= row <= row1 and col0 <= col <= col1:
+                    candidates.update(keys)
+        else:
+            for row in range(row0, row1 + 1):
+                for col in range(col0, col1 + 1):
+                    candidates.update(self._cells.get((row, col), ()))
+
+        matches = []
+        for key in candidates:
+            order, envelope, item, _ = self._entries[key]
+            if area.intersects(envelope):
+                matches.append((order, key, item))
+        matches.sort(key=lambda match: match[0])
+        return [(key, item) for _, key, item in matches]
+
+
+class CollectionIndex:
+    """A GridIndex kept in step with one storage collection through its change feed"""
+
+    def __init__(self, storage, collection, cell_size=CELL_SIZE):
+        self.storage = storage
+        self.collection = collection
+        self._index = GridIndex(cell_size)
+        self._lock = threading.Lock()
+        self._rev = None
+
+    def _sync(self):
+        if self._rev is not None and self._rev == self.storage.revision(self.collection):
+            return
+        delta = self.storage.changes_since(self.collection, self._rev or 0)
+        if delta["full"]:
+            self._index.clear()
+        for key in delta["deleted"]:
+            self._index.remove(key)
+        for key, item in delta["changed"]:
+            self._index.set(key, item)
+        self._rev = delta["rev"]
+
+    def query(self, area):
+        """Return ``(revision, [(key, item), ...])`` for the items inside ``area``"""
+        with self._lock:
+            self._sync()
+            return self._rev, self._index.query(area)
@@ -0,0 +1,476 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from locking import FileLock, atomic_write
+from metrics import record_file_io
+
+# Collections are ordered lists of items keyed by id; documents are single JSON values
+COLLECTIONS = ("drawings", "pois", "measurements", "notes")
+DOCUMENTS = ("radio_frequencies", "current_route")
+
+# Legacy flat files written by earlier versions of server.py
+JSON_FILES = {
+    "drawings": "drawings.json",
+    "pois": "pois.json",
+    "measurements": "measurements.json",
+    "notes": "notes.json",
+    "radio_frequencies": "radio_frequencies.json",
+    "current_route": "current_route.json",
+}
+
+
+def item_key(item_id):
+    """Normalise an item id to the string key used by the backends"""
+    return None if item_id is None else str(item_id)
+
+
+def item_keys(items):
+    """Keys for a list of items; items without an id (drawings) are keyed by content"""
+    keys = []
+    seen = set()
+    for item in items:
+        key = item_key(_item_id(item))
+        if key is None:
+            key = "#" + hashlib.sha1(encode(item).encode()).hexdigest()[:16]
+            # Identical strokes drawn twice still need distinct keys
+            base, n = key, 1
+            while key in seen:
+                n += 1
+                key = f"{base}-{n}"
+        seen.add(key)
+        keys.append(key)
+    return keys
+
+
+def encode(value):
+    """Canonical JSON so unchanged items compare equal byte for byte"""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def full_delta(rev, keys, items):
+    return {"rev": rev, "full": True, "changed": [[k, item] for k, item in zip(keys, items)], "deleted": []}
+
+
+class Storage:
+    """Interface shared by all storage backends.
+
+    Every collection and document has a revision number that grows by one
+    for each write that changes it. ``changes_since`` returns the items
+    added, changed or deleted after a given revision, or the whole
+    collection with ``full`` set when the backend cannot answer that.
+    """
+
+    def list(self, collection):
+        raise NotImplementedError
+
+    def get(self, collection, item_id):
+        raise NotImplementedError
+
+    def upsert(self, collection, item_id, item):
+        raise NotImplementedError
+
+    def delete(self, collection, item_id):
+        raise NotImplementedError
+
+    def replace(self, collection, items):
+        """Make ``items`` the whole collection and return the key of each item"""
+        raise NotImplementedError
+
+    def clear(self, collection):
+        self.replace(collection, [])
+
+    def revision(self, name):
+        raise NotImplementedError
+
+    def changes_since(self, collection, since):
+        items = self.list(collection)
+        return full_delta(self.revision(collection), item_keys(items), items)
+
+    def get_document(self, name, default=None):
+        raise NotImplementedError
+
+    def set_document(self, name, value):
+        raise NotImplementedError
+
+    def delete_document(self, name):
+        raise NotImplementedError
+
+
+class JsonFileStorage(Storage):
+    """The original one-file-per-collection layout, rewritten whole on every change.
+
+    Read-modify-write cycles hold a file lock shared by every process using
+    the directory, and files are replaced atomically. Each file's revision
+    is kept next to it in ``<file>.rev`` so all processes agree on it;
+    deltas always come back full.
+    """
+
+    def __init__(self, directory="."):
+        self.directory = directory
+        self._lock = FileLock(os.path.join(directory, ".storage.lock"))
+
+    def _path(self, name):
+        return os.path.join(self.directory, JSON_FILES[name])
+
+    def _read(self, name, default):
+        path = self._path(name)
+        started = time.perf_counter()
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            value = json.loads(data)
+            record_file_io("read", path, len(data), time.perf_counter() - started)
+            return value
+        except FileNotFoundError:
+            return default
+        except json.JSONDecodeError:
+            # Keep the damaged file for inspection instead of overwriting it with the next save
+            backup = f"{path}.corrupt-{int(time.time())}"
+            print(f"{path} is not valid JSON, moved to {backup}")
+            try:
+                os.replace(path, backup)
+            except OSError:
+                pass
+            return default
+
+    def _write(self, name, value):
+        atomic_write(self._path(name), json.dumps(value))
+        self._bump(name)
+
+    def _bump(self, name):
+        atomic_write(self._path(name) + ".rev", str(self.revision(name) + 1), fsync=False)
+
+    def revision(self, name):
+        # Files may already hold data at startup, so revisions start at 1 rather than "empty"
+        try:
+            with open(self._path(name) + ".rev", "r") as f:
+                return int(f.read() or 1)
+        except (FileNotFoundError, ValueError):
+            return 1
+
+    def list(self, collection):
+        return self._read(collection, [])
+
+    def get(self, collection, item_id):
+        items = self._read(collection, [])
+        key = item_key(item_id)
+        for existing_key, item in zip(item_keys(items), items):
+            if existing_key == key:
+                return item
+        return None
+
+    def upsert(self, collection, item_id, item):
+        with self._lock:
+            items = self._read(collection, [])
+            key = item_key(item_id)
+            for i, existing_key in enumerate(item_keys(items)):
+                if existing_key == key:
+                    items[i] = item
+                    break
+            else:
+                items.append(item)
+            self._write(collection, items)
+
+    def delete(self, collection, item_id):
+        with self._lock:
+            items = self._read(collection, [])
+            key = item_key(item_id)
+            remaining = [item for k, item in zip(item_keys(items), items) if k != key]
+            self._write(collection, remaining)
+            return len(remaining) != len(items)
+
+    def replace(self, collection, items):
+        with self._lock:
+            self._write(collection, items)
+        return item_keys(items or [])
+
+    def get_document(self, name, default=None):
+        return self._read(name, default)
+
+    def set_document(self, name, value):
+        with self._lock:
+            self._write(name, value)
+
+    def delete_document(self, name):
+        with self._lock:
+            path = self._path(name)
+            if os.path.exists(path):
+                os.remove(path)
+                self._bump(name)
+
+
+class SQLiteStorage(Storage):
+    """SQLite backend in WAL mode with one row per item and an indexed primary key.
+
+    Each row carries the revision that last wrote it and deletions leave a
+    tombstone, so ``changes_since`` is an index range scan. Tombstones more
+    than ``tombstone_revisions`` revisions old are purged; a client asking
+    for changes since before the purge gets the full collection instead.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS items (
+            collection TEXT NOT NULL,
+            id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            rev INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (collection, id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS items_order ON items (collection, seq);
+        CREATE TABLE IF NOT EXISTS documents (
+            name TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS tombstones (
+            collection TEXT NOT NULL,
+            id TEXT NOT NULL,
+            rev INTEGER NOT NULL,
+            PRIMARY KEY (collection, id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS tombstones_rev ON tombstones (collection, rev);
+        CREATE TABLE IF NOT EXISTS purges (
+            collection TEXT PRIMARY KEY,
+            rev INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS revisions (
+            name TEXT PRIMARY KEY,
+            rev INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path, tombstone_revisions=1000):
+        self.path = path
+        self.tombstone_revisions = tombstone_revisions
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(items)")]
+        if "rev" not in columns:
+            # Databases created before revisions were tracked
+            conn.execute("ALTER TABLE items ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS items_rev ON items (collection, rev)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connect())
+
+    def _next_seq(self, conn, collection):
+        row = conn.execute("SELECT MAX(seq) FROM items WHERE collection = ?", (collection,)).fetchone()
+        return (row[0] or 0) + 1
+
+    def _bump(self, conn, name):
+        conn.execute(
+            "INSERT INTO revisions (name, rev) VALUES (?, 1) ON CONFLICT (name) DO UPDATE SET rev = rev + 1",
+            (name,),
+        )
+        return conn.execute("SELECT rev FROM revisions WHERE name = ?", (name,)).fetchone()[0]
+
+    def _write_item(self, conn, collection, key, data, rev):
+        updated = conn.execute(
+            "UPDATE items SET data = ?, rev = ? WHERE collection = ? AND id = ?",
+            (data, rev, collection, key),
+        ).rowcount
+        if not updated:
+            conn.execute(
+                "INSERT INTO items (collection, id, seq, data, rev) VALUES (?, ?, ?, ?, ?)",
+                (collection, key, self._next_seq(conn, collection), data, rev),
+            )
+            conn.execute("DELETE FROM tombstones WHERE collection = ? AND id = ?", (collection, key))
+
+    def _delete_item(self, conn, collection, key, rev):
+        conn.execute("DELETE FROM items WHERE collection = ? AND id = ?", (collection, key))
+        conn.execute(
+            "INSERT OR REPLACE INTO tombstones (collection, id, rev) VALUES (?, ?, ?)", (collection, key, rev)
+        )
+
+    def _purge_tombstones(self, conn, collection, rev):
+        floor = rev - self.tombstone_revisions
+        if floor <= 0:
+            return
+        purged = conn.execute(
+            "DELETE FROM tombstones WHERE collection = ? AND rev <= ?", (collection, floor)
+        ).rowcount
+        if purged:
+            conn.execute("INSERT OR REPLACE INTO purges (collection, rev) VALUES (?, ?)", (collection, floor))
+
+    def _purged_through(self, conn, collection):
+        """Revision up to which tombstones are gone; deltas from before it would miss deletions"""
+        row = conn.execute("SELECT rev FROM purges WHERE collection = ?", (collection,)).fetchone()
+        return row[0] if row else 0
+
+    def revision(self, name):
+        row = self._connect().execute("SELECT rev FROM revisions WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def list(self, collection):
+        rows = self._connect().execute(
+            "SELECT data FROM items WHERE collection = ? ORDER BY seq", (collection,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get(self, collection, item_id):
+        row = self._connect().execute(
+            "SELECT data FROM items WHERE collection = ? AND id = ?", (collection, item_key(item_id))
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def changes_since(self, collection, since):
+        conn = self._connect()
+        # One read transaction so the revision and the rows agree
+        conn.execute("BEGIN")
+        try:
+            rev = self.revision(collection)
+            if since is None or since <= 0 or since > rev or since < self._purged_through(conn, collection):
+                rows = conn.execute(
+                    "SELECT id, data FROM items WHERE collection = ? ORDER BY seq", (collection,)
+                ).fetchall()
+                return {"rev": rev, "full": True, "changed": [[k, json.loads(d)] for k, d in rows], "deleted": []}
+            rows = conn.execute(
+                "SELECT id, data FROM items WHERE collection = ? AND rev > ? ORDER BY seq", (collection, since)
+            ).fetchall()
+            deleted = conn.execute(
+                "SELECT id FROM tombstones WHERE collection = ? AND rev > ?", (collection, since)
+            ).fetchall()
+            return {
+                "rev": rev,
+                "full": False,
+                "changed": [[k, json.loads(d)] for k, d in rows],
+                "deleted": [row[0] for row in deleted],
+            }
+        finally:
+            conn.execute("COMMIT")
+
+    def upsert(self, collection, item_id, item):
+        data = encode(item)
+        key = item_key(item_id)
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM items WHERE collection = ? AND id = ?", (collection, key)
+            ).fetchone()
+            if row and row[0] == data:
+                return
+            self._write_item(conn, collection, key, data, self._bump(conn, collection))
+
+    def delete(self, collection, item_id):
+        key = item_key(item_id)
+        with self._transaction() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM items WHERE collection = ? AND id = ?", (collection, key)
+            ).fetchone()
+            if not exists:
+                return False
+            rev = self._bump(conn, collection)
+            self._delete_item(conn, collection, key, rev)
+            self._purge_tombstones(conn, collection, rev)
+            return True
+
+    def replace(self, collection, items):
+        items = items or []
+        keys = item_keys(items)
+        with self._transaction() as conn:
+            existing = dict(conn.execute("SELECT id, data FROM items WHERE collection = ?", (collection,)))
+            # Only rows that actually differ are rewritten and get the new revision
+            changed = [(key, encode(item)) for key, item in zip(keys, items) if existing.get(key) != encode(item)]
+            removed = existing.keys() - set(keys)
+            if changed or removed:
+                rev = self._bump(conn, collection)
+                for key, data in changed:
+                    self._write_item(conn, collection, key, data, rev)
+                for key in removed:
+                    self._delete_item(conn, collection, key, rev)
+                if removed:
+                    self._purge_tombstones(conn, collection, rev)
+        return keys
+
+    def get_document(self, name, default=None):
+        row = self._connect().execute("SELECT data FROM documents WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_document(self, name, value):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)", (name, encode(value)))
+            self._bump(conn, name)
+
+    def delete_document(self, name):
+        with self._transaction() as conn:
+            if conn.execute("DELETE FROM documents WHERE name = ?", (name,)).rowcount:
+                self._bump(conn, name)
+
+
+class _Transaction:
+    """Context manager running a block inside BEGIN IMMEDIATE ... COMMIT"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def _item_id(item):
+    return item.get("id") if isinstance(item, dict) else None
+
+
+def migrate_json_files(storage, directory="."):
+    """Copy legacy JSON files into ``storage`` once, renaming each file to ``*.migrated``.
+
+    Every worker process runs this at startup; the shared storage lock makes
+    the first one do the work and the others find the files already moved.
+    """
+    migrated = []
+    with FileLock(os.path.join(directory, ".storage.lock")):
+        for name, filename in JSON_FILES.items():
+            path = os.path.join(directory, filename)
+            try:
+                with open(path, "r") as f:
+                    value = json.load(f)
+            except FileNotFoundError:
+                continue
+            except json.JSONDecodeError:
+                print(f"Skipping migration of {filename}: file is not valid JSON")
+                continue
+            if name in COLLECTIONS:
+                storage.replace(name, value if isinstance(value, list) else [])
+            else:
+                storage.set_document(name, value)
+            os.replace(path, path + ".migrated")
+            migrated.append(filename)
+    if migrated:
+        print(f"Migrated {', '.join(migrated)} into {type(storage).__name__}")
+    return migrated
+
+
+def open_storage(config, directory="."):
+    """Build the backend selected by ``storage_backend`` in config.json"""
+    backend = config.get("storage_backend", "sqlite")
+    if backend == "json":
+        return JsonFileStorage(directory)
+    if backend == "sqlite":
+        storage = SQLiteStorage(
+            os.path.join(directory, config.get("database_file", "locator.db")),
+            tombstone_revisions=config.get("tombstone_revisions", 1000),
+        )
+        migrate_json_files(storage, directory)
+        return storage
+    raise ValueError(f"Unknown storage_backend: {backend}")
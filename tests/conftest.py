@@ -0,0 +1,24 @@
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+# The modules are flat files at the top of the repository, imported the way server.py does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """server.py imported once, in a scratch directory; its routes are tested through app.test_client()"""
+    pytest.importorskip("flask_cors")
+    # server.py reads config.json and keeps its files in the working directory
+    directory = tmp_path_factory.mktemp("server")
+    (directory / "config.json").write_text(json.dumps({"offline_graph": str(directory / "no_graph")}))
+    previous = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield importlib.import_module("server")
+    finally:
+        os.chdir(previous)
@@ -0,0 +1,89 @@
+"""GeofenceEngine fed a short track past a POI and through a closed drawn area."""
+import math
+import time
+
+import pytest
+
+from geofence import GeofenceEngine
+from storage import SQLiteStorage
+
+# A POI with a 50 m fence, and a closed square stroke about 110 m across, 1 km to the east
+POI = {"id": "hut", "name": "Hut", "lat": 59.9100, "lng": 10.7500}
+SQUARE = [[10.7670, 59.9095], [10.7690, 59.9095], [10.7690, 59.9105], [10.7670, 59.9105], [10.7670, 59.9095]]
+DRAWING = {"id": "camp", "type": "Feature", "properties": {"name": "Camp"},
+           "geometry": {"type": "LineString", "coordinates": SQUARE}}
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "locator.db"))
+    storage.upsert("pois", POI["id"], POI)
+    storage.upsert("drawings", DRAWING["id"], DRAWING)
+    return storage
+
+
+@pytest.fixture
+def events():
+    return []
+
+
+@pytest.fixture
+def engine(storage, events):
+    return GeofenceEngine(storage, events.append, poi_radius=50.0, hysteresis=10.0)
+
+
+def drive(engine, phone_id, track):
+    """Submit each position and wait for it to be checked, so none are coalesced"""
+    for i, (lat, lng) in enumerate(track):
+        checks = engine.stats()["checks"]
+        engine.submit(phone_id, lat, lng, timestamp=1000.0 + i)
+        deadline = time.monotonic() + 5
+        while engine.stats()["checks"] == checks:
+            assert time.monotonic() < deadline, "position was never checked"
+            time.sleep(0.005)
+
+
+def summary(events):
+    return [(event["event"], event["fence"], event["fence_kind"], event["timestamp"]) for event in events]
+
+
+def test_enter_and_exit_poi(engine, events):
+    # Walking east along the POI's latitude: 200 m west, inside, 5 m past the edge, then well clear
+    drive(engine, "p1", [(59.9100, 10.7464), (59.9100, 10.7496), (59.9100, 10.7509), (59.9100, 10.7540)])
+    assert summary(events) == [
+        ("enter", "pois/hut", "poi", 1001.0),
+        ("exit", "pois/hut", "poi", 1003.0),
+    ]
+    assert events[0]["name"] == "Hut"
+    assert engine.recent_events() == events
+
+
+def test_enter_and_exit_drawn_area(engine, events):
+    drive(engine, "p1", [(59.9100, 10.7650), (59.9100, 10.7680), (59.9100, 10.7710)])
+    assert summary(events) == [
+        ("enter", "drawings/camp", "drawing", 1001.0),
+        ("exit", "drawings/camp", "drawing", 1002.0),
+    ]
+    assert events[0]["name"] == "Camp"
+
+
+def test_first_position_inside_is_not_announced(engine, events):
+    drive(engine, "p1", [(59.9100, 10.7500), (59.9100, 10.7501)])
+    assert events == []
+    assert engine.stats()["inside"] == {"p1": ["pois/hut"]}
+
+
+def test_jitter_on_the_edge_does_not_flap(engine, events):
+    # The fence edge is 50 m from the POI; wobble 3-8 m either side of it after entering
+    edge = math.degrees(50.0 / (6371000 * math.cos(math.radians(POI["lat"]))))
+    lngs = [10.7500 + 2 * edge, 10.7500 + 0.9 * edge] + [10.7500 + edge * f for f in (1.06, 0.95, 1.15, 0.99)]
+    drive(engine, "p1", [(59.9100, lng) for lng in lngs])
+    assert summary(events) == [("enter", "pois/hut", "poi", 1001.0)]
+
+
+def test_deleted_fence_stops_matching(engine, events, storage):
+    drive(engine, "p1", [(59.9100, 10.7464)])
+    storage.delete("pois", "hut")
+    drive(engine, "p1", [(59.9100, 10.7500)])
+    assert events == []
+    assert engine.stats()["fences"] == 1
@@ -0,0 +1,40 @@
+"""Grid references at the edges of the grid."""
+import pytest
+
+from grid import COLUMNS, GRID_SIZE, ROWS, cell_bounds, column_letters, describe_cell, grid_ref, parse_grid_ref
+
+
+def test_round_trip():
+    ref = grid_ref(59.9139, 10.7522)
+    south, west, north, east = describe_cell(ref)["bounds"]
+    assert south <= 59.9139 < north and west <= 10.7522 < east
+    assert parse_grid_ref(ref.lower()) == parse_grid_ref(ref)
+
+
+def test_last_row_and_column_are_valid():
+    last = column_letters(COLUMNS - 1) + str(ROWS - 1)
+    assert parse_grid_ref(last) == (COLUMNS - 1, ROWS - 1)
+    south, west, north, east = cell_bounds(COLUMNS - 1, ROWS - 1)
+    assert north == pytest.approx(90) and east == pytest.approx(180)
+    assert south == pytest.approx(90 - GRID_SIZE)
+
+
+@pytest.mark.parametrize("ref", [
+    "A" + str(ROWS),
+    column_letters(COLUMNS) + "0",
+    column_letters(COLUMNS - 1) + str(ROWS),
+    "A-1",
+    "42",
+    "",
+])
+def test_outside_the_grid_is_rejected(ref):
+    with pytest.raises(ValueError):
+        parse_grid_ref(ref)
+
+
+@pytest.mark.parametrize("lat, lng", [(90, 180), (-90, -180), (90, 0), (0, 180)])
+def test_extreme_positions_parse(lat, lng):
+    column, row = parse_grid_ref(grid_ref(lat, lng))
+    south, west, north, east = cell_bounds(column, row)
+    assert south <= lat <= north and west <= lng <= east
+    assert north <= 90 + 1e-9 and east <= 180 + 1e-9
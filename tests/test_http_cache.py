@@ -0,0 +1,54 @@
+"""ResponseCache: one strong ETag per revision and encoding, and 304s for any of them."""
+import gzip
+import json
+
+import pytest
+from flask import Flask
+
+from http_cache import ResponseCache
+
+ITEMS = [{"id": i, "name": f"point {i}"} for i in range(100)]
+
+
+@pytest.fixture
+def state():
+    return {"revision": 1, "builds": 0}
+
+
+@pytest.fixture
+def client(state):
+    app = Flask(__name__)
+    cache = ResponseCache(boot_id="boot")
+
+    @app.route("/load")
+    def load():
+        def produce():
+            state["builds"] += 1
+            return ITEMS
+        return cache.json_response(state["revision"], produce)
+
+    return app.test_client()
+
+
+def test_each_encoding_has_its_own_tag(client, state):
+    plain = client.get("/load", headers={"Accept-Encoding": "identity"})
+    gzipped = client.get("/load", headers={"Accept-Encoding": "gzip"})
+    assert plain.headers["ETag"] == '"boot-1"'
+    assert gzipped.headers["ETag"] == '"boot-1-gzip"'
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(gzipped.data)) == json.loads(plain.data) == ITEMS
+    assert state["builds"] == 1
+
+
+@pytest.mark.parametrize("held", ['"boot-1"', '"boot-1-gzip"', 'W/"boot-1-gzip"', '"other", "boot-1-br"'])
+def test_any_current_tag_is_not_modified(client, held):
+    response = client.get("/load", headers={"If-None-Match": held, "Accept-Encoding": "gzip"})
+    assert response.status_code == 304
+    assert response.headers["ETag"] in held
+
+
+def test_new_revision_is_sent_again(client, state):
+    state["revision"] = 2
+    response = client.get("/load", headers={"If-None-Match": '"boot-1-gzip"', "Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"boot-2-gzip"'
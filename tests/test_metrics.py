@@ -0,0 +1,55 @@
+"""Prometheus rendering and the sampling profiler's limits."""
+import time
+
+from metrics import Registry
+from profiler import MIN_INTERVAL, SamplingProfiler
+
+
+def test_render_counters_and_histograms():
+    registry = Registry()
+    requests = registry.counter("test_requests_total", "Requests", ("route",))
+    seconds = registry.histogram("test_seconds", "Latency", buckets=(0.1, 1.0))
+    requests.inc(route="/a")
+    requests.inc(2, route="/a")
+    seconds.observe(0.05)
+    seconds.observe(0.5)
+
+    lines = registry.render().splitlines()
+    assert 'test_requests_total{route="/a"} 3' in lines
+    assert 'test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 2' in lines
+    assert "test_seconds_count 2" in lines
+
+
+def test_failing_collector_is_counted_in_the_same_scrape():
+    registry = Registry()
+
+    def working():
+        yield "test_phones", "gauge", "Phones", [({}, 4)]
+
+    def broken():
+        yield "test_partial", "gauge", "Never shown", [({}, 1)]
+        raise RuntimeError("stats unavailable")
+
+    registry.add_collector(working)
+    registry.add_collector(broken)
+    lines = registry.render().splitlines()
+    assert "test_phones 4" in lines
+    assert 'locator_metrics_collector_errors_total{collector="broken"} 1' in lines
+    assert not any(line.startswith("test_partial") for line in lines)
+
+
+def test_profiler_interval_has_a_floor():
+    profiler = SamplingProfiler(interval=0)
+    assert profiler.interval == MIN_INTERVAL
+    assert profiler.start(interval=-1)
+    try:
+        assert profiler.stats()["interval"] == MIN_INTERVAL
+        assert not profiler.start()
+        time.sleep(0.05)
+    finally:
+        profiler.stop()
+    assert not profiler.running
+    # At most one sample per MIN_INTERVAL, not a busy loop
+    assert 0 < profiler.stats()["samples"] <= 0.05 / MIN_INTERVAL + 5
@@ -0,0 +1,122 @@
+"""OfflineRouter on a small street grid imported from an inline OSM extract."""
+import pytest
+
+from offline_router import MODES, OfflineRouter, _dijkstra, import_osm
+from routing import CircuitBreaker, OSRMProvider, RouteRacer
+from test_routing import StubService
+
+SIZE = 4
+
+
+def node_id(row, col):
+    return 1 + row * 10 + col
+
+
+def node_position(row, col):
+    # About 110 m blocks, nudged a few meters so no two routes tie on length
+    return 59.91 + row * 0.001 + (row * 7 + col * 3) % 5 * 0.00004, 10.75 + col * 0.002 + (row * 3 + col) % 4 * 0.00006
+
+
+def way(way_id, nodes, **tags):
+    refs = "".join(f'<nd ref="{node_id(*n)}"/>' for n in nodes)
+    return f'<way id="{way_id}">{refs}' + "".join(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items()) + "</way>"
+
+
+def grid_osm():
+    """Residential rows and columns; row 0 is one-way eastbound, and a footway cuts a block diagonally"""
+    nodes = [
+        f'<node id="{node_id(r, c)}" lat="{lat}" lon="{lng}"/>'
+        for r in range(SIZE) for c in range(SIZE) for lat, lng in [node_position(r, c)]
+    ]
+    ways = [way(100, [(0, c) for c in range(SIZE)], highway="residential", name="Row 0", oneway="yes")]
+    ways += [way(100 + r, [(r, c) for c in range(SIZE)], highway="residential", name=f"Row {r}") for r in range(1, SIZE)]
+    ways += [way(200 + c, [(r, c) for r in range(SIZE)], highway="residential", name=f"Col {c}") for c in range(SIZE)]
+    ways.append(way(300, [(1, 1), (2, 2)], highway="footway", name="Shortcut"))
+    return '<?xml version="1.0"?><osm version="0.6">' + "".join(nodes + ways) + "</osm>"
+
+
+@pytest.fixture(scope="module")
+def graph(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("offline")
+    (directory / "grid.osm").write_text(grid_osm())
+    import_osm(str(directory / "grid.osm"), str(directory / "graph"))
+    return str(directory / "graph")
+
+
+@pytest.fixture
+def router(graph):
+    return OfflineRouter(graph)
+
+
+def route(router, start, end, mode):
+    return router.route(*node_position(*start), *node_position(*end), mode)
+
+
+def properties(route):
+    return route["features"][0]["properties"]
+
+
+def street_names(route):
+    return [step["name"] for step in properties(route)["steps"] if step["name"]]
+
+
+CORNERS = [(r, c) for r in range(SIZE) for c in range(SIZE)]
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_alt_and_plain_a_star_find_the_same_shortest_path(graph, mode):
+    alt = OfflineRouter(graph)
+    plain = OfflineRouter(graph)
+    plain.landmarks = {}
+    assert mode in alt.landmarks
+    (offsets, targets), (cost, usable, _) = alt._graph(mode)
+    for start in CORNERS:
+        source, _ = alt.nearest_vertex(*node_position(*start), usable)
+        times = _dijkstra(offsets, targets, cost, source)
+        for end in CORNERS:
+            if start == end:
+                continue
+            goal, _ = alt.nearest_vertex(*node_position(*end), usable)
+            with_landmarks, without = route(alt, start, end, mode), route(plain, start, end, mode)
+            assert properties(with_landmarks)["duration"] == pytest.approx(times[goal], abs=0.1)
+            assert with_landmarks["features"][0]["geometry"] == without["features"][0]["geometry"]
+
+
+def test_one_way_street_is_driven_only_in_its_direction(router):
+    eastbound = route(router, (0, 0), (0, 3), "driving")
+    westbound = route(router, (0, 3), (0, 0), "driving")
+    assert street_names(eastbound) == ["Row 0"]
+    assert "Row 0" not in street_names(westbound)
+    assert properties(westbound)["distance"] > properties(eastbound)["distance"] + 200
+
+    # Walkers may go either way
+    walking = route(router, (0, 3), (0, 0), "walking")
+    assert street_names(walking) == ["Row 0"]
+    assert properties(walking)["distance"] == pytest.approx(properties(eastbound)["distance"], abs=1)
+
+
+def test_footway_is_closed_to_cars(router):
+    walking = route(router, (1, 1), (2, 2), "walking")
+    driving = route(router, (1, 1), (2, 2), "driving")
+    assert street_names(walking) == ["Shortcut"]
+    assert "Shortcut" not in street_names(driving)
+    assert properties(walking)["distance"] < properties(driving)["distance"]
+
+
+def test_get_route_falls_back_to_the_offline_router(server, graph, monkeypatch):
+    service = StubService()
+    service.status = 503
+    try:
+        monkeypatch.setattr(server, "route_racer", RouteRacer([OSRMProvider(service.url, None, 2.0, CircuitBreaker(3, 60))]))
+        monkeypatch.setattr(server, "offline_router", OfflineRouter(graph))
+        (start_lat, start_lng), (end_lat, end_lng) = node_position(1, 1), node_position(2, 2)
+        response = server.app.test_client().post("/get_route", json={
+            "start_lat": start_lat, "start_lng": start_lng, "end_lat": end_lat, "end_lng": end_lng, "mode": "walking",
+        })
+    finally:
+        service.close()
+    assert service.requests >= 1
+    route_data = response.get_json()
+    assert route_data["service_used"] == "Offline (OpenStreetMap)"
+    assert properties(route_data)["service"] == "offline"
+    assert street_names(route_data) == ["Shortcut"]
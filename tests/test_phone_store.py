@@ -0,0 +1,30 @@
+"""PhoneStore on the shared memory-mapped table, with ids that did not arrive as strings."""
+import pytest
+
+from phone_store import PhoneStore
+from phone_table import SharedPhoneTable
+
+
+@pytest.fixture
+def store(tmp_path):
+    table = SharedPhoneTable(str(tmp_path / "phones.table"), slots=8)
+    store = PhoneStore(str(tmp_path / "phones.json"), shared_table=table)
+    yield store
+    store.close()
+
+
+def test_numeric_id_is_stored_as_a_string(store):
+    store.update(42, 59.91, 10.75, heading=90, timestamp=1000.0)
+    assert store.get("42")["lat"] == 59.91
+    assert list(store.all()) == ["42"]
+
+
+def test_replace_all_with_numeric_ids(store):
+    store.replace_all({7: {"lat": 59.91, "lng": 10.75, "timestamp": 1000.0}})
+    assert store.get("7")["lng"] == 10.75
+
+
+def test_overlong_id_is_refused(store):
+    with pytest.raises(ValueError):
+        store.update("x" * 40, 59.91, 10.75)
+    assert store.all() == {}
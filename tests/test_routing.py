@@ -0,0 +1,164 @@
+"""RouteRacer and CircuitBreaker against stub routing services on localhost."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from routing import CircuitBreaker, GraphHopperProvider, OSRMProvider, RouteRacer
+
+START = (59.91, 10.75)
+END = (59.92, 10.76)
+
+
+class StubService:
+    """Answers OSRM and GraphHopper route requests after ``delay`` seconds with ``status``"""
+
+    def __init__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.delay)
+                body = stub.body(self.path) if stub.status == 200 else {"message": "Stub failure"}
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(stub.status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    pass  # the client gave up waiting
+
+            def log_message(self, *args):
+                pass
+
+        self.delay = 0.0
+        self.status = 200
+        self.empty = False
+        self.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def body(self, path):
+        line = [[START[1], START[0]], [END[1], END[0]]]
+        if path.startswith("/api/1/route"):
+            paths = [] if self.empty else [{"points": {"coordinates": line}, "distance": 1300, "time": 900000}]
+            return {"paths": paths}
+        routes = [] if self.empty else [{"geometry": {"type": "LineString", "coordinates": line}, "distance": 1300}]
+        return {"code": "Ok", "routes": routes}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stubs():
+    services = []
+
+    def make():
+        service = StubService()
+        services.append(service)
+        return service
+
+    yield make
+    for service in services:
+        service.close()
+
+
+def race(racer):
+    return racer.route(*START, *END, "walking")
+
+
+def test_first_good_answer_wins(stubs):
+    fast, slow = stubs(), stubs()
+    slow.delay = 0.5
+    osrm = OSRMProvider(fast.url, timeout=2.0)
+    graphhopper = GraphHopperProvider(slow.url, timeout=2.0)
+    racer = RouteRacer([graphhopper, osrm])
+
+    started = time.monotonic()
+    route, label = race(racer)
+    assert label == "OSRM"
+    assert route["features"][0]["properties"]["service"] == "osrm"
+    assert time.monotonic() - started < 0.4
+    assert osrm.stats()["wins"] == 1 and graphhopper.stats()["wins"] == 0
+
+
+def test_empty_answer_does_not_win(stubs):
+    fast, slow = stubs(), stubs()
+    fast.empty = True
+    slow.delay = 0.2
+    racer = RouteRacer([OSRMProvider(fast.url, timeout=2.0), GraphHopperProvider(slow.url, timeout=2.0)])
+
+    route, label = race(racer)
+    assert label == "GraphHopper"
+    assert route["features"][0]["properties"]["service"] == "graphhopper"
+
+
+@pytest.mark.parametrize("failure", ["error", "slow"])
+def test_failing_provider_trips_breaker(stubs, failure):
+    bad, good = stubs(), stubs()
+    if failure == "error":
+        bad.status = 500
+    else:
+        bad.delay = 0.5
+    failing = OSRMProvider(bad.url, timeout=0.2, breaker=CircuitBreaker(threshold=2, cooldown=60.0))
+    racer = RouteRacer([failing, GraphHopperProvider(good.url, timeout=2.0)])
+
+    for _ in range(2):
+        route, label = race(racer)
+        assert label == "GraphHopper"
+        # Let the losing request finish so its failure reaches the breaker
+        deadline = time.monotonic() + 2.0
+        while failing.stats()["requests"] < _ + 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert failing.breaker.state == "open"
+    assert failing.stats()["failures"] == 2
+
+    requests_before = bad.requests
+    assert race(racer)[1] == "GraphHopper"
+    time.sleep(0.1)
+    assert bad.requests == requests_before
+
+
+def test_half_open_breaker_recovers(stubs):
+    service = stubs()
+    service.status = 500
+    provider = OSRMProvider(service.url, timeout=1.0, breaker=CircuitBreaker(threshold=1, cooldown=0.2))
+    racer = RouteRacer([provider])
+
+    assert race(racer) == (None, None)
+    assert provider.breaker.state == "open"
+    assert race(racer) == (None, None)
+    assert service.requests == 1
+
+    time.sleep(0.25)
+    assert provider.breaker.state == "half-open"
+    service.status = 200
+    route, label = race(racer)
+    assert label == "OSRM"
+    assert provider.breaker.state == "closed"
+
+
+def test_failed_trial_reopens_breaker(stubs):
+    service = stubs()
+    service.status = 500
+    breaker = CircuitBreaker(threshold=3, cooldown=0.2)
+    provider = OSRMProvider(service.url, timeout=1.0, breaker=breaker)
+    racer = RouteRacer([provider])
+
+    for _ in range(3):
+        race(racer)
+    assert breaker.state == "open"
+    time.sleep(0.25)
+    # One failed trial is enough to open it again, without waiting for the threshold
+    assert race(racer) == (None, None)
+    assert breaker.state == "open"
+    assert service.requests == 4
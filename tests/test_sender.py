@@ -0,0 +1,173 @@
+"""The phone sender's pipeline, with fake_termux_location.py in place of termux-location."""
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+LOCATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "locator")
+FAKE_LOCATION = [sys.executable, os.path.join(LOCATOR_DIR, "fake_termux_location.py")]
+sys.path.insert(0, LOCATOR_DIR)
+
+from fixcodec import decode_fixes  # noqa: E402
+
+
+@pytest.fixture
+def sender(monkeypatch):
+    """A fresh copy of locator/py.py, whose filter and counters are module globals"""
+    monkeypatch.setenv("FAKE_GPS_INTERVAL", "0.05")
+    # Fast enough to leave the dead-band between fixes
+    monkeypatch.setenv("FAKE_GPS_SPEED", "100")
+    # Loaded by path: "py" is also the name of a module that ships with pytest
+    spec = importlib.util.spec_from_file_location("locator_sender", os.path.join(LOCATOR_DIR, "py.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(module, "LOCATION_CMD", FAKE_LOCATION)
+    monkeypatch.setattr(module, "MIN_SAMPLE_INTERVAL", 0.05)
+    monkeypatch.setattr(module, "UPLOAD_RETRY_MIN", 0.05)
+    return module
+
+
+class StubServer:
+    """Accepts /update_locations batches while ``status`` is 200 and keeps the decoded fixes"""
+
+    def __init__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                stub.attempts += 1
+                if stub.status == 200:
+                    stub.fixes.extend(decode_fixes(body))
+                data = json.dumps({"status": "ok"}).encode()
+                self.send_response(stub.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.status = 200
+        self.attempts = 0
+        self.fixes = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/update_locations"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    stub = StubServer()
+    yield stub
+    stub.close()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def read_fixes(sender, queue, mode, count):
+    """Run a GpsReader until ``count`` fixes have been queued; returns the raw fixes it produced"""
+    sampler = sender.AdaptiveSampler()
+    raw = []
+
+    def on_fix(fix):
+        raw.append(fix)
+        sender.send_location(fix, "test1", sampler, queue)
+
+    reader = sender.GpsReader(on_fix, lambda: 0.05, mode=mode, cmd=FAKE_LOCATION)
+    reader.start()
+    try:
+        assert wait_for(lambda: len(queue) >= count), f"only {len(queue)} fix(es) queued in {mode} mode"
+    finally:
+        reader.stop()
+        reader.join(timeout=5)
+    return raw
+
+
+def reader_alive(sender):
+    return any(thread.name == "gps-reader" and thread.is_alive() for thread in threading.enumerate())
+
+
+@pytest.mark.parametrize("mode", ["stream", "poll"])
+def test_reader_fixes_reach_queue(sender, tmp_path, mode):
+    queue = sender.FixQueue(str(tmp_path / "pending.bin"))
+    raw = read_fixes(sender, queue, mode, 3)
+
+    assert not reader_alive(sender)
+    assert all(fix["lat"] == pytest.approx(59.9139) for fix in raw)
+    # Stamped when read, so they arrive in order
+    assert [fix["timestamp"] for fix in raw] == sorted(fix["timestamp"] for fix in raw)
+    queued = decode_fixes(queue.peek(len(queue))[0])
+    assert {fix["id"] for fix in queued} == {"test1"}
+    # The queue file survives a restart
+    assert len(sender.FixQueue(queue.path)) == len(queue)
+
+
+def test_uploader_drains_queue(sender, tmp_path, server):
+    queue = sender.FixQueue(str(tmp_path / "pending.bin"))
+    read_fixes(sender, queue, "stream", 3)
+    queued = len(queue)
+
+    uploader = sender.Uploader(server.url, queue)
+    uploader.start()
+    uploader.wake()
+    assert wait_for(lambda: len(queue) == 0)
+    assert len(server.fixes) == queued
+    assert {fix["id"] for fix in server.fixes} == {"test1"}
+    assert sender.stats.uploaded == queued
+
+
+def test_failed_upload_keeps_fixes_queued(sender, tmp_path, server):
+    queue = sender.FixQueue(str(tmp_path / "pending.bin"))
+    queue.append({"id": "test1", "lat": 59.9, "lng": 10.7, "timestamp": time.time()})
+
+    # Server unreachable
+    assert not sender.flush_queue("http://127.0.0.1:9/update_locations", queue)
+    assert len(queue) == 1
+
+    # Server erroring, then back: the uploader retries until the fix goes through
+    server.status = 503
+    uploader = sender.Uploader(server.url, queue)
+    uploader.start()
+    uploader.wake()
+    # The unreachable attempt above plus two refused uploads
+    assert wait_for(lambda: sender.stats.failed_uploads >= 3)
+    assert len(queue) == 1 and not server.fixes
+
+    server.status = 200
+    assert wait_for(lambda: len(queue) == 0)
+    assert [fix["id"] for fix in server.fixes] == ["test1"]
+
+
+def test_discard_skips_fixes_dropped_since_peek(sender, tmp_path):
+    queue = sender.FixQueue(str(tmp_path / "pending.bin"), max_fixes=4)
+    for i in range(4):
+        queue.append({"id": "test1", "lat": 59.9, "lng": 10.7, "timestamp": 1000.0 + i})
+    body, mark = queue.peek(3)
+
+    # The queue fills up while that batch is in flight, dropping its two oldest fixes
+    for i in range(4, 6):
+        queue.append({"id": "test1", "lat": 59.9, "lng": 10.7, "timestamp": 1000.0 + i})
+    queue.discard(3, mark)
+
+    # Only the uploaded fix still queued goes; nothing that was never sent is lost
+    assert [fix["timestamp"] for fix in decode_fixes(body)] == [1000.0, 1001.0, 1002.0]
+    assert [fix["timestamp"] for fix in decode_fixes(queue.peek(len(queue))[0])] == [1003.0, 1004.0, 1005.0]
@@ -0,0 +1,73 @@
+"""The Flask routes, through a test client against a server started in a scratch directory."""
+import time
+
+import pytest
+
+BAD_FIXES = [
+    {"id": "p1", "lat": "abc", "lng": "x"},
+    {"id": "p1", "lat": 999, "lng": 10.75},
+    {"id": "p1", "lat": 59.91, "lng": -181},
+    {"lat": 59.91, "lng": 10.75},
+    ["p1", 59.91, 10.75],
+]
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+
+def rejected(server):
+    return dict((labels["result"], value) for _, labels, value in server.fixes_ingested.samples()).get("rejected", 0)
+
+
+@pytest.mark.parametrize("fix", BAD_FIXES)
+def test_invalid_fix_is_rejected(server, client, fix):
+    before = rejected(server)
+    response = client.post("/update_location", json=fix)
+    assert response.status_code == 400
+    assert rejected(server) == before + 1
+    # Nothing unusable reached the history either
+    response = client.get("/track/p1")
+    assert response.status_code == 200
+    assert response.get_json()["properties"]["count"] == 0
+
+
+def test_valid_fix_is_stored(client):
+    response = client.post("/update_location", json={"id": "p2", "lat": 59.91, "lng": 10.75, "heading": 90})
+    assert response.status_code == 200
+    properties = client.get("/track/p2").get_json()["properties"]
+    assert properties["count"] == 1
+    assert properties["truncated"] is False
+
+
+def test_track_limit_keeps_the_newest_fixes(server, client):
+    start = time.time() - 100
+    for i in range(5):
+        server.track_store.append("p3", 59.91 + i * 0.001, 10.75, timestamp=start + i)
+    track = client.get("/track/p3?limit=2").get_json()
+    assert track["properties"]["times"] == [round(start + 3, 1), round(start + 4, 1)]
+    assert track["properties"]["truncated"] is True
+    assert client.get("/track/p3?limit=5").get_json()["properties"]["truncated"] is False
+
+
+@pytest.mark.parametrize("fix", BAD_FIXES)
+def test_rejected_fix_never_reaches_geofences(server, client, monkeypatch, fix):
+    submitted = []
+    monkeypatch.setattr(server.geofences, "submit", lambda *args, **kwargs: submitted.append(args))
+    assert client.post("/update_location", json=fix).status_code == 400
+    assert client.post("/update_locations", json={"fixes": [fix]}).status_code == 200
+    assert submitted == []
+    # A good fix still goes through
+    assert client.post("/update_location", json={"id": "p4", "lat": 59.91, "lng": 10.75}).status_code == 200
+    assert [args[0] for args in submitted] == ["p4"]
+
+
+def test_numeric_id_is_accepted_as_a_string(client):
+    assert client.post("/update_location", json={"id": 1234, "lat": 59.91, "lng": 10.75}).status_code == 200
+    assert "1234" in client.get("/load_phones").get_json()
+
+
+@pytest.mark.parametrize("body", [["p1"], {"p1": "not a record"}, {"p1": [59.91, 10.75]}])
+def test_save_phones_refuses_malformed_records(client, body):
+    assert client.post("/save_phones", json=body).status_code == 400
@@ -0,0 +1,179 @@
+"""Storage backends: legacy migration and the revision/delta protocol behind ?since=."""
+import json
+import multiprocessing
+
+import pytest
+
+from storage import JSON_FILES, JsonFileStorage, SQLiteStorage, item_keys, migrate_json_files
+
+
+def _migrate(directory, results):
+    results.put(migrate_json_files(SQLiteStorage(str(directory / "locator.db")), str(directory)))
+
+
+def test_migration_runs_once_across_workers(tmp_path):
+    pois = [{"id": f"poi{i}", "lat": 59.9, "lng": 10.7} for i in range(100)]
+    (tmp_path / JSON_FILES["pois"]).write_text(json.dumps(pois))
+    (tmp_path / JSON_FILES["radio_frequencies"]).write_text(json.dumps({"ch1": 446.00625}))
+
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_migrate, args=(tmp_path, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=30)
+    assert [worker.exitcode for worker in workers] == [0] * 4
+
+    migrated = sorted((results.get(timeout=5) for _ in workers), key=len)
+    assert migrated[:3] == [[], [], []]
+    assert sorted(migrated[3]) == sorted([JSON_FILES["pois"], JSON_FILES["radio_frequencies"]])
+    storage = SQLiteStorage(str(tmp_path / "locator.db"))
+    assert storage.list("pois") == pois
+    assert storage.get_document("radio_frequencies") == {"ch1": 446.00625}
+    assert (tmp_path / (JSON_FILES["pois"] + ".migrated")).exists()
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteStorage(str(tmp_path / "locator.db"))
+    return JsonFileStorage(str(tmp_path))
+
+
+class Client:
+    """What a map tab holds: items by key and the revision they came from, kept up to date with deltas"""
+
+    def __init__(self, storage, collection):
+        self.storage = storage
+        self.collection = collection
+        self.rev = None
+        self.items = {}
+
+    def sync(self):
+        delta = self.storage.changes_since(self.collection, self.rev)
+        if delta["full"]:
+            self.items = {}
+        for key in delta["deleted"]:
+            self.items.pop(key, None)
+        for key, item in delta["changed"]:
+            self.items[key] = item
+        self.rev = delta["rev"]
+        return delta
+
+    def matches_server(self):
+        items = self.storage.list(self.collection)
+        return self.items == dict(zip(item_keys(items), items))
+
+
+def poi(poi_id, name):
+    return {"id": poi_id, "name": name, "lat": 59.9, "lng": 10.7}
+
+
+def test_revision_grows_with_each_change(storage):
+    before = storage.revision("pois")
+    storage.upsert("pois", "a", poi("a", "Hut"))
+    after_add = storage.revision("pois")
+    storage.delete("pois", "a")
+    assert before < after_add < storage.revision("pois")
+    # Other collections keep their own revisions
+    assert storage.revision("notes") == before
+
+
+def test_add_patch_delete_replace_sync(storage):
+    client = Client(storage, "pois")
+    assert client.sync()["full"]
+    assert client.items == {}
+
+    storage.upsert("pois", "a", poi("a", "Hut"))
+    storage.upsert("pois", "b", poi("b", "Bridge"))
+    client.sync()
+    assert client.matches_server()
+
+    storage.upsert("pois", "a", poi("a", "Old hut"))
+    delta = client.sync()
+    assert client.matches_server()
+    if not delta["full"]:
+        assert delta["changed"] == [["a", poi("a", "Old hut")]]
+        assert delta["deleted"] == []
+
+    storage.delete("pois", "b")
+    delta = client.sync()
+    assert client.matches_server()
+    if not delta["full"]:
+        assert delta["changed"] == []
+        assert delta["deleted"] == ["b"]
+
+    storage.replace("pois", [poi("a", "Old hut"), poi("c", "Cairn")])
+    delta = client.sync()
+    assert client.matches_server()
+    assert set(client.items) == {"a", "c"}
+    if not delta["full"]:
+        # The unchanged item is not sent again
+        assert delta["changed"] == [["c", poi("c", "Cairn")]]
+
+
+def test_nothing_changed_is_an_empty_delta(storage):
+    storage.upsert("pois", "a", poi("a", "Hut"))
+    client = Client(storage, "pois")
+    client.sync()
+    rev = client.rev
+    storage.upsert("pois", "a", poi("a", "Hut"))
+    storage.replace("pois", [poi("a", "Hut")])
+    delta = client.sync()
+    assert client.matches_server()
+    if isinstance(storage, SQLiteStorage):
+        assert storage.revision("pois") == rev
+        assert delta == {"rev": rev, "full": False, "changed": [], "deleted": []}
+
+
+def test_readded_item_is_not_reported_deleted(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "locator.db"))
+    storage.upsert("pois", "a", poi("a", "Hut"))
+    client = Client(storage, "pois")
+    client.sync()
+    storage.delete("pois", "a")
+    storage.upsert("pois", "a", poi("a", "New hut"))
+    delta = client.sync()
+    assert delta["deleted"] == []
+    assert delta["changed"] == [["a", poi("a", "New hut")]]
+
+
+@pytest.mark.parametrize("since", [0, -1, 10 ** 9])
+def test_unusable_since_falls_back_to_full(tmp_path, since):
+    storage = SQLiteStorage(str(tmp_path / "locator.db"))
+    storage.upsert("pois", "a", poi("a", "Hut"))
+    delta = storage.changes_since("pois", since)
+    assert delta["full"]
+    assert delta["changed"] == [["a", poi("a", "Hut")]]
+
+
+def test_purged_tombstones_force_a_full_reload(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "locator.db"), tombstone_revisions=3)
+    for key in "abcdef":
+        storage.upsert("pois", key, poi(key, key))
+    client = Client(storage, "pois")
+    client.sync()
+    for key in "abcde":
+        storage.delete("pois", key)
+    # More deletions than tombstones are kept: the client can't be told about all of them
+    delta = client.sync()
+    assert delta["full"]
+    assert client.matches_server()
+    assert set(client.items) == {"f"}
+    # A client that is up to date still gets deltas
+    storage.delete("pois", "f")
+    delta = client.sync()
+    assert not delta["full"] and delta["deleted"] == ["f"]
+
+
+def test_items_without_ids_are_keyed_by_content(storage):
+    strokes = [{"type": "Feature", "geometry": {"type": "Point", "coordinates": [10.7, 59.9]}}] * 2
+    keys = storage.replace("drawings", strokes)
+    assert len(set(keys)) == 2
+    client = Client(storage, "drawings")
+    client.sync()
+    assert client.matches_server()
+    storage.replace("drawings", strokes[:1])
+    client.sync()
+    assert client.matches_server()
+    assert list(client.items) == keys[:1]
@@ -0,0 +1,458 @@
+"""Caching proxy for the map's tile layers, stored as one MBTiles file per layer.
+
+The browser asks the server for ``/tiles/<source>/<z>/<x>/<y>``. A cached
+tile is served straight from SQLite. A tile older than its source's
+``max_age`` is still served, and refreshed in the background with a
+conditional request. Tiles not in the cache are fetched from upstream once,
+however many phones ask for them. When the cache grows past its size cap,
+the least recently used tiles are evicted. Tiles downloaded with
+``python tile_cache.py prefetch`` are pinned and never evicted, so an area
+of operation can be prepared in advance and works with no uplink at all.
+
+Files follow the MBTiles layout (``metadata`` and ``tiles`` tables, TMS row
+numbering), so a tileset from another tool can be dropped into the cache
+directory as ``<source>.mbtiles``. Bookkeeping lives in an extra
+``tile_state`` table.
+"""
+import argparse
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SOURCES = {
+    "street": {
+        "name": "OpenStreetMap",
+        "url": "https://tile.openstreetmap.org/{z}/{x}/{y}.png",
+        "max_age": 7 * 86400,
+    },
+    "satellite": {
+        "name": "Esri World Imagery",
+        "url": "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
+        "max_age": 30 * 86400,
+    },
+    "weather": {
+        "name": "OpenWeatherMap precipitation",
+        "url": "https://tile.openweathermap.org/map/precipitation_new/{z}/{x}/{y}.png?appid={appid}",
+        "max_age": 600,
+    },
+    # RainViewer frames are addressed by time, passed as the tile variant
+    "radar": {
+        "name": "RainViewer radar",
+        "url": "https://tilecache.rainviewer.com/v2/radar/{variant}/256/{z}/{x}/{y}/2/1_1.png",
+        "max_age": 600,
+        "variant": True,
+    },
+}
+MAX_ZOOM = 22
+USER_AGENT = "locatormap-tile-proxy/1.0"
+# Last-access times are only rewritten when older than this, so hits stay read-only
+ACCESS_GRANULARITY = 3600
+
+
+def tile_for(lat, lng, zoom):
+    """Web Mercator tile (x, y) containing a point"""
+    lat = max(-85.0511, min(85.0511, lat))
+    n = 2 ** zoom
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_in_bbox(south, west, north, east, zooms):
+    """Every (z, x, y) covering a bounding box, lowest zoom first"""
+    for z in zooms:
+        x0, y0 = tile_for(north, west, z)
+        x1, y1 = tile_for(south, east, z)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                yield z, x, y
+
+
+def content_type(data):
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class TileStore:
+    """One MBTiles file with LRU eviction down to ``max_bytes``"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS tiles (
+            zoom_level INTEGER NOT NULL,
+            tile_column INTEGER NOT NULL,
+            tile_row INTEGER NOT NULL,
+            tile_data BLOB NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+        CREATE TABLE IF NOT EXISTS tile_state (
+            zoom_level INTEGER NOT NULL,
+            tile_column INTEGER NOT NULL,
+            tile_row INTEGER NOT NULL,
+            variant TEXT,
+            fetched REAL NOT NULL,
+            accessed REAL NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            size INTEGER NOT NULL,
+            pinned INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (zoom_level, tile_column, tile_row)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS tile_state_lru ON tile_state (pinned, accessed);
+    """
+
+    def __init__(self, path, name, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        conn.execute("INSERT OR IGNORE INTO metadata (name, value) VALUES ('name', ?), ('format', 'png')", (name,))
+        self._size = conn.execute("SELECT COALESCE(SUM(LENGTH(tile_data)), 0) FROM tiles").fetchone()[0]
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, z, x, y):
+        """Return ``(data, state)`` or None; tiles imported from elsewhere have a state of None"""
+        row = (1 << z) - 1 - y
+        conn = self._connect()
+        found = conn.execute(
+            "SELECT t.tile_data, s.variant, s.fetched, s.accessed, s.etag, s.last_modified, s.pinned"
+            " FROM tiles t LEFT JOIN tile_state s"
+            " ON s.zoom_level = t.zoom_level AND s.tile_column = t.tile_column AND s.tile_row = t.tile_row"
+            " WHERE t.zoom_level = ? AND t.tile_column = ? AND t.tile_row = ?",
+            (z, x, row),
+        ).fetchone()
+        if found is None:
+            return None
+        data, variant, fetched, accessed, etag, last_modified, pinned = found
+        if fetched is None:
+            return data, None
+        now = time.time()
+        if now - accessed > ACCESS_GRANULARITY:
+            conn.execute(
+                "UPDATE tile_state SET accessed = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (now, z, x, row),
+            )
+        return data, {
+            "variant": variant, "fetched": fetched, "etag": etag, "last_modified": last_modified, "pinned": bool(pinned),
+        }
+
+    def put(self, z, x, y, data, variant=None, etag=None, last_modified=None, pinned=False):
+        row = (1 << z) - 1 - y
+        now = time.time()
+        conn = self._connect()
+        with self._lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                old = conn.execute(
+                    "SELECT LENGTH(tile_data) FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                    (z, x, row),
+                ).fetchone()
+                was_pinned = conn.execute(
+                    "SELECT pinned FROM tile_state WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                    (z, x, row),
+                ).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                    (z, x, row, data),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO tile_state"
+                    " (zoom_level, tile_column, tile_row, variant, fetched, accessed, etag, last_modified, size, pinned)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    # A refresh keeps a prefetched tile pinned
+                    (z, x, row, variant, now, now, etag, last_modified, len(data),
+                     int(pinned or bool(was_pinned and was_pinned[0]))),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._size += len(data) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict(conn)
+
+    def revalidated(self, z, x, y):
+        """Upstream answered 304: the cached tile is fresh again"""
+        self._connect().execute(
+            "UPDATE tile_state SET fetched = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (time.time(), z, x, (1 << z) - 1 - y),
+        )
+
+    def pin(self, z, x, y):
+        self._connect().execute(
+            "UPDATE tile_state SET pinned = 1 WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, (1 << z) - 1 - y),
+        )
+
+    def _evict(self, conn):
+        # Down to 90% so eviction doesn't run again on the very next insert
+        target = self.max_bytes * 0.9
+        while self._size > target:
+            victims = conn.execute(
+                "SELECT zoom_level, tile_column, tile_row, size FROM tile_state"
+                " WHERE pinned = 0 ORDER BY accessed LIMIT 256"
+            ).fetchall()
+            if not victims:
+                break
+            conn.execute("BEGIN IMMEDIATE")
+            for z, x, row, size in victims:
+                conn.execute("DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", (z, x, row))
+                conn.execute(
+                    "DELETE FROM tile_state WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", (z, x, row)
+                )
+                self._size -= size
+                if self._size <= target:
+                    break
+            conn.execute("COMMIT")
+
+    def stats(self):
+        conn = self._connect()
+        tiles, pinned = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(pinned), 0) FROM tile_state"
+        ).fetchone()
+        total = conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+        return {"tiles": total, "pinned": pinned + (total - tiles), "bytes": self._size, "max_bytes": self.max_bytes}
+
+
+class TileProxy:
+    """Serves tiles for every source in ``SOURCES`` through per-source TileStores"""
+
+    def __init__(self, directory="tiles", max_bytes=1024 ** 3, timeout=10.0, openweathermap_key=None, sources=SOURCES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.openweathermap_key = openweathermap_key
+        self.sources = sources
+        self._stores = {}
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._inflight = {}
+        self._refresher = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tile-refresh")
+        self._hits = self._stale = self._misses = self._failures = 0
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=len(sources), pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def store(self, source):
+        with self._lock:
+            store = self._stores.get(source)
+            if store is None:
+                os.makedirs(self.directory, exist_ok=True)
+                store = TileStore(
+                    os.path.join(self.directory, f"{source}.mbtiles"), self.sources[source]["name"], self.max_bytes
+                )
+                self._stores[source] = store
+            return store
+
+    def tile(self, source, z, x, y, variant=None, appid=None):
+        """Return ``(data, status)`` with status "hit", "stale" or "miss", or ``(None, reason)``"""
+        if source not in self.sources:
+            return None, "unknown source"
+        if not 0 <= z <= MAX_ZOOM or not 0 <= x < (1 << z) or not 0 <= y < (1 << z):
+            return None, "tile out of range"
+        if self.sources[source].get("variant") and not variant:
+            return None, "this source needs ?t="
+        store = self.store(source)
+        cached = store.get(z, x, y)
+        if cached is not None:
+            data, state = cached
+            if state is None or state["variant"] == (variant or None):
+                if state is not None and time.time() - state["fetched"] < self.sources[source]["max_age"]:
+                    self._count("hit")
+                    return data, "hit"
+                # Serve what we have straight away; the refresh only helps the next request
+                self._refresh_later(source, z, x, y, variant, appid, state)
+                self._count("stale")
+                return data, "stale"
+
+        self._count("miss")
+        data = self._fetch_once(source, z, x, y, variant, appid)
+        if data is None and cached is not None:
+            # Upstream unreachable: an older radar frame beats a blank map
+            return cached[0], "stale"
+        return (data, "miss") if data is not None else (None, "upstream unavailable")
+
+    def fetch(self, source, z, x, y, variant=None, appid=None, state=None, pinned=False):
+        """Download one tile into the cache; returns its bytes, or None if upstream failed"""
+        url = self.sources[source]["url"].format(
+            z=z, x=x, y=y, variant=variant or "", appid=self.openweathermap_key or appid or "",
+        )
+        headers = {}
+        if state is not None and state.get("variant") == (variant or None):
+            if state.get("etag"):
+                headers["If-None-Match"] = state["etag"]
+            if state.get("last_modified"):
+                headers["If-Modified-Since"] = state["last_modified"]
+        store = self.store(source)
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304:
+                store.revalidated(z, x, y)
+                return None
+            response.raise_for_status()
+        except requests.RequestException as e:
+            self._count("failure")
+            print(f"Tile fetch failed for {source} {z}/{x}/{y}: {e}")
+            return None
+        data = response.content
+        store.put(z, x, y, data, variant or None, response.headers.get("ETag"),
+                  response.headers.get("Last-Modified"), pinned=pinned)
+        return data
+
+    def _fetch_once(self, source, z, x, y, variant, appid):
+        """``fetch``, but concurrent requests for the same tile share one download"""
+        key = (source, z, x, y, variant)
+        with self._lock:
+            done = self._inflight.get(key)
+            leader = done is None
+            if leader:
+                done = self._inflight[key] = threading.Event()
+        if not leader:
+            done.wait(self.timeout)
+            cached = self.store(source).get(z, x, y)
+            if cached is not None and (cached[1] is None or cached[1]["variant"] == (variant or None)):
+                return cached[0]
+            return None
+        try:
+            return self.fetch(source, z, x, y, variant, appid)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            done.set()
+
+    def _refresh_later(self, source, z, x, y, variant, appid, state):
+        key = (source, z, x, y)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.fetch(source, z, x, y, variant, appid, state)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._refresher.submit(refresh)
+
+    def _count(self, kind):
+        with self._lock:
+            if kind == "hit":
+                self._hits += 1
+            elif kind == "stale":
+                self._stale += 1
+            elif kind == "miss":
+                self._misses += 1
+            else:
+                self._failures += 1
+
+    def stats(self):
+        with self._lock:
+            counters = {"hits": self._hits, "stale": self._stale, "misses": self._misses, "failures": self._failures}
+        sources = {}
+        for source in self.sources:
+            if os.path.exists(os.path.join(self.directory, f"{source}.mbtiles")):
+                sources[source] = self.store(source).stats()
+        return dict(counters, sources=sources)
+
+    def prefetch(self, source, south, west, north, east, zooms, workers=2, variant=None, progress=None):
+        """Download and pin every tile of a bounding box; returns (fetched, already cached, failed)"""
+        store = self.store(source)
+        fetched = cached = failed = 0
+
+        def one(tile):
+            z, x, y = tile
+            existing = store.get(z, x, y)
+            if existing is not None:
+                # Already downloaded while browsing (or imported): just keep it
+                store.pin(z, x, y)
+                return "cached"
+            return "fetched" if self.fetch(source, z, x, y, variant, pinned=True) is not None else "failed"
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for done, result in enumerate(pool.map(one, tiles_in_bbox(south, west, north, east, zooms)), 1):
+                if result == "fetched":
+                    fetched += 1
+                elif result == "cached":
+                    cached += 1
+                else:
+                    failed += 1
+                if progress is not None and done % 100 == 0:
+                    progress(done, fetched, cached, failed)
+        return fetched, cached, failed
+
+
+def _parse_zooms(text):
+    low, _, high = text.partition("-")
+    return range(int(low), int(high or low) + 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tile cache for the locator map server")
+    parser.add_argument("--dir", default="tiles", help="cache directory (tile_cache_dir in config.json)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    prefetch = commands.add_parser("prefetch", help="download and pin every tile in a bounding box")
+    prefetch.add_argument("source", choices=sorted(name for name in SOURCES if not SOURCES[name].get("variant")))
+    prefetch.add_argument("bbox", help="south,west,north,east")
+    prefetch.add_argument("--zooms", default="10-16", help="zoom range, e.g. 10-16")
+    prefetch.add_argument("--workers", type=int, default=2)
+    prefetch.add_argument("--max-tiles", type=int, default=20000,
+                          help="refuse larger downloads; mind the tile servers' usage policies")
+    prefetch.add_argument("--appid", help="OpenWeatherMap key for the weather source")
+    commands.add_parser("stats", help="show cached and pinned tiles per source")
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        proxy = TileProxy(args.dir)
+        for source, stats in proxy.stats()["sources"].items():
+            print(f"{source}: {stats['tiles']} tiles ({stats['pinned']} pinned), {stats['bytes'] / 1e6:.1f} MB")
+        return 0
+
+    south, west, north, east = [float(v) for v in args.bbox.split(",")]
+    zooms = _parse_zooms(args.zooms)
+    total = sum(1 for _ in tiles_in_bbox(south, west, north, east, zooms))
+    if total > args.max_tiles:
+        print(f"{total} tiles is more than --max-tiles {args.max_tiles}; narrow the area or zoom range")
+        return 1
+    print(f"Prefetching {total} {args.source} tiles at zoom {zooms.start}-{zooms.stop - 1}")
+    proxy = TileProxy(args.dir, max_bytes=float("inf"), openweathermap_key=args.appid)
+    fetched, cached, failed = proxy.prefetch(
+        args.source, south, west, north, east, zooms, workers=args.workers,
+        progress=lambda done, f, c, x: print(f"  {done}/{total} ({f} fetched, {c} cached, {x} failed)"),
+    )
+    print(f"Done: {fetched} fetched, {cached} already cached, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import atexit
+import sqlite3
+import threading
+import time
+
+
+class TrackStore:
+    """Append-only position history per phone in SQLite, indexed by (phone, time).
+
+    Fixes are buffered in memory and written in one transaction per
+    ``flush_interval`` by a background thread, so ingest never waits on disk.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS fixes (
+            phone_id TEXT NOT NULL,
+            ts REAL NOT NULL,
+            lat REAL NOT NULL,
+            lng REAL NOT NULL,
+            alt REAL,
+            heading REAL,
+            PRIMARY KEY (phone_id, ts)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path, flush_interval=1.0, retention_days=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._stop = threading.Event()
+        self._last_prune = 0
+
+        self._connect().executescript(self.SCHEMA)
+
+        self._thread = threading.Thread(target=self._run, name="track-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---------------------------------------------------------------- writes
+
+    def append(self, phone_id, lat, lng, alt=None, heading=None, timestamp=None):
+        with self._lock:
+            self._buffer.append((phone_id, timestamp or time.time(), lat, lng, alt, heading))
+
+    def append_many(self, fixes):
+        """Queue normalised fix dicts as produced by ingest.normalize_fix"""
+        rows = [(f["id"], f["timestamp"], f["lat"], f["lng"], f.get("alt"), f.get("heading")) for f in fixes]
+        with self._lock:
+            self._buffer.extend(rows)
+
+    def flush(self):
+        with self._lock:
+            rows = self._buffer
+            self._buffer = []
+        if not rows:
+            return 0
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # A resent fix has the same (phone, time) key and is dropped
+            conn.executemany("INSERT OR IGNORE INTO fixes VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            with self._lock:
+                self._buffer[:0] = rows
+            raise
+        return len(rows)
+
+    def prune(self, older_than):
+        conn = self._connect()
+        return conn.execute("DELETE FROM fixes WHERE ts < ?", (older_than,)).rowcount
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                if self.retention_days and time.time() - self._last_prune > 3600:
+                    self.prune(time.time() - self.retention_days * 86400)
+                    self._last_prune = time.time()
+            except sqlite3.Error as e:
+                print(f"Track store flush failed: {e}")
+
+    # ----------------------------------------------------------------- reads
+
+    def query(self, phone_id, start=None, end=None, limit=None):
+        """Return (timestamps, lats, lngs, alts, headings) for one phone, oldest first.
+
+        With ``limit``, the newest ``limit`` fixes in the range are returned.
+        """
+        self.flush()
+        sql = "SELECT ts, lat, lng, alt, heading FROM fixes WHERE phone_id = ? AND ts >= ? AND ts <= ? ORDER BY ts"
+        params = [phone_id, start if start is not None else 0, end if end is not None else float("inf")]
+        if limit:
+            # The recent end of a trail is the part worth showing
+            sql += " DESC LIMIT ?"
+            params.append(limit)
+        rows = self._connect().execute(sql, params).fetchall()
+        if limit:
+            rows.reverse()
+        if not rows:
+            return [], [], [], [], []
+        return tuple(list(column) for column in zip(*rows))
+
+    def summary(self):
+        """First and last fix time and fix count for every phone with history"""
+        self.flush()
+        rows = self._connect().execute(
+            "SELECT phone_id, MIN(ts), MAX(ts), COUNT(*) FROM fixes GROUP BY phone_id"
+        ).fetchall()
+        return {phone_id: {"from": first, "to": last, "count": count} for phone_id, first, last, count in rows}
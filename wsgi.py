@@ -0,0 +1,10 @@
+"""WSGI entry point for running the server under gunicorn (see gunicorn.conf.py).
+
+By default the server runs as one worker with many threads, because phone
+positions, the event bus and the caches live in the process. Several workers
+(LOCATOR_WORKERS) need "phones_table" in config.json so they share phone
+positions and response tags; see gunicorn.conf.py.
+"""
+from server import app
+
+application = app